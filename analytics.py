@@ -0,0 +1,256 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from rules import EQUIPMENT_CATEGORIES, get_catalog
+from storage import CHARACTER_COLUMNS, STATS, fetch_characters
+
+BATCH_SIZE = 5000
+INITIAL_CAPACITY = 1024
+# Значения характеристик в гистограммах: от 0 до MAX_STAT включительно, всё выше — в последний столбец
+MAX_STAT = 30
+NO_ITEM = -1
+
+# Итоги по списку: пары (название, число) по убыванию числа; stat_histograms — число персонажей
+# с каждым значением характеристики; stat_means — {класс: средние характеристики по порядку STATS};
+# item_usage — (предмет, взяли, ожидалось) по убыванию отношения: «ожидалось» — сколько взяли бы,
+# если бы каждый выбирал из предметов своего класса в категории наугад; больше ожидаемого — перебор;
+# предметы вне наборов классов (ожидалось 0) — в конце
+RosterSummary = namedtuple(
+    "RosterSummary", ("count", "races", "classes", "race_class", "stat_histograms", "stat_means", "item_usage")
+)
+
+
+# Названия категорий и их коды в столбцах
+class Vocabulary:
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def __len__(self):
+        return len(self.names)
+
+
+def sorted_counts(names, counts):
+    order = np.argsort(-counts, kind="stable")
+    return [(names[code], int(counts[code])) for code in order if counts[code]]
+
+
+# Список персонажей по столбцам: характеристики, коды рас, классов и предметов по категориям.
+# Строка персонажа не меняется, пока он есть в базе; строки удалённых помечаются мёртвыми
+# и занимаются новыми персонажами. Итоги считаются целиком по столбцам, без обхода персонажей
+class RosterColumns:
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.lock = threading.Lock()
+        self.store = None
+        self.ready = False
+        self.building = False
+        self.replay = []
+        # Счётчик изменений: окно аналитики пересчитывает графики, только если он вырос
+        self.version = 0
+        self.rows = {}
+        self.free_rows = []
+        self.size = 0
+        self.races = Vocabulary()
+        self.classes = Vocabulary()
+        self.items = Vocabulary()
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.race = np.zeros(capacity, dtype=np.int32)
+        self.character_class = np.zeros(capacity, dtype=np.int32)
+        self.stats = np.zeros((capacity, len(STATS)), dtype=np.int16)
+        self.equipment = np.full((capacity, len(EQUIPMENT_CATEGORIES)), NO_ITEM, dtype=np.int32)
+
+    # Столбцы растут вдвое, чтобы добавление по одному не копировало их каждый раз
+    def reserve(self, size):
+        capacity = len(self.alive)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        old = (self.alive, self.race, self.character_class, self.stats, self.equipment)
+        self.allocate(capacity)
+        for new, previous in zip((self.alive, self.race, self.character_class, self.stats, self.equipment), old):
+            new[:len(previous)] = previous
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Подписка на хранилище и построение в фоновом потоке, как у поискового индекса
+    def attach(self, store, on_ready=None):
+        with self.lock:
+            self.store = store
+            self.building = True
+            self.replay = []
+        store.add_listener(self.on_roster_changed)
+        thread = threading.Thread(target=self.build, args=(store.path, on_ready), daemon=True)
+        thread.start()
+        return thread
+
+    def build(self, path, on_ready=None):
+        columns = RosterColumns()
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            cursor = connection.execute(f"SELECT {', '.join(CHARACTER_COLUMNS)} FROM characters")
+            while True:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                columns.add_rows(rows)
+                # Отдаём GIL потоку интерфейса между пачками
+                time.sleep(0)
+        finally:
+            connection.close()
+
+        with self.lock:
+            for name in ("rows", "free_rows", "size", "races", "classes", "items", "alive", "race",
+                         "character_class", "stats", "equipment"):
+                setattr(self, name, getattr(columns, name))
+            for characters, deleted in self.replay:
+                self.apply(characters, deleted)
+            self.replay = []
+            self.building = False
+            self.ready = True
+            self.version += 1
+        if on_ready:
+            on_ready()
+
+    # Подписчик хранилища: вызывается в том же потоке, что и сохранение
+    def on_roster_changed(self, saved, deleted):
+        characters = [character for _, character in fetch_characters(self.store.connection, saved).values()]
+        self.update(characters, deleted)
+
+    def update(self, characters, deleted=()):
+        with self.lock:
+            if self.building:
+                self.replay.append((characters, deleted))
+            self.apply(characters, deleted)
+            self.version += 1
+
+    def apply(self, characters, deleted):
+        for name in deleted:
+            row = self.rows.pop(name, None)
+            if row is not None:
+                self.alive[row] = False
+                self.free_rows.append(row)
+        for character in characters:
+            row = self.rows.get(character["Имя"])
+            if row is None:
+                row = self.free_rows.pop() if self.free_rows else self.new_row()
+                self.rows[character["Имя"]] = row
+            equipment = character.get("Снаряжение") or {}
+            self.set_row(
+                row,
+                character["Раса"],
+                character["Класс"],
+                [character[stat] for stat in STATS],
+                [equipment.get(category) for category in EQUIPMENT_CATEGORIES],
+            )
+
+    def new_row(self):
+        self.reserve(self.size + 1)
+        self.size += 1
+        return self.size - 1
+
+    def set_row(self, row, race, character_class, stats, equipment):
+        self.alive[row] = True
+        self.race[row] = self.races.code(race)
+        self.character_class[row] = self.classes.code(character_class)
+        self.stats[row] = stats
+        self.equipment[row] = [self.items.code(item) if item else NO_ITEM for item in equipment]
+
+    # Первичное заполнение пачкой: коды считаются по уникальным значениям столбца
+    def add_rows(self, rows):
+        first = self.size
+        self.reserve(first + len(rows))
+        self.size += len(rows)
+        for offset, row in enumerate(rows):
+            self.rows[row[0]] = first + offset
+        block = slice(first, self.size)
+        self.alive[block] = True
+        self.race[block] = self.encode(self.races, [row[1] for row in rows])
+        self.character_class[block] = self.encode(self.classes, [row[2] for row in rows])
+        self.stats[block] = np.array([row[6:12] for row in rows], dtype=np.int16).reshape(-1, len(STATS))
+        equipment = [(json.loads(row[4]) if row[4] else None) or {} for row in rows]
+        for position, category in enumerate(EQUIPMENT_CATEGORIES):
+            items = [character_equipment.get(category) or "" for character_equipment in equipment]
+            self.equipment[block, position] = self.encode(self.items, items, empty="")
+
+    @staticmethod
+    def encode(vocabulary, values, empty=None):
+        unique, inverse = np.unique(np.array(values, dtype=object), return_inverse=True)
+        codes = np.array([NO_ITEM if value == empty else vocabulary.code(value) for value in unique], dtype=np.int32)
+        return codes[inverse.reshape(-1)]
+
+    # Все итоги одним проходом по столбцам: группировки через bincount по кодам
+    def summary(self, catalog=None):
+        catalog = catalog or get_catalog()
+        with self.lock:
+            alive = self.alive[:self.size]
+            race = self.race[:self.size][alive]
+            character_class = self.character_class[:self.size][alive]
+            stats = self.stats[:self.size][alive]
+            equipment = self.equipment[:self.size][alive]
+            race_names = list(self.races.names)
+            class_names = list(self.classes.names)
+            item_names = list(self.items.names)
+
+        count = len(race)
+        race_counts = np.bincount(race, minlength=len(race_names))
+        class_counts = np.bincount(character_class, minlength=len(class_names))
+        race_class = np.bincount(
+            race * len(class_names) + character_class, minlength=len(race_names) * len(class_names)
+        ).reshape(len(race_names), len(class_names))
+
+        clipped = np.clip(stats, 0, MAX_STAT)
+        # Смещение по характеристике превращает шесть гистограмм в один bincount
+        offsets = clipped + np.arange(len(STATS)) * (MAX_STAT + 1)
+        histograms = np.bincount(offsets.ravel(), minlength=len(STATS) * (MAX_STAT + 1)).reshape(len(STATS), -1)
+
+        sums = np.stack([
+            np.bincount(character_class, weights=stats[:, position], minlength=len(class_names))
+            for position in range(len(STATS))
+        ], axis=1)
+        stat_means = {
+            class_names[code]: tuple((sums[code] / class_counts[code]).tolist()) for code in range(len(class_names))
+            if class_counts[code]
+        }
+
+        items = equipment[equipment != NO_ITEM]
+        item_counts = np.bincount(items, minlength=len(item_names))
+        expected = {}
+        for class_name, class_count in zip(class_names, class_counts.tolist()):
+            if class_name not in catalog.classes:
+                continue
+            for category, category_items in catalog.equipment(class_name).items():
+                for item in category_items:
+                    expected[item] = expected.get(item, 0.0) + class_count / len(category_items)
+        item_usage = [
+            (name, int(item_counts[code]), expected.get(name, 0.0)) for code, name in enumerate(item_names)
+            if item_counts[code]
+        ]
+        # Предметы, которых нет в наборах классов (ожидалось 0), отношения не имеют и идут в конце
+        item_usage.sort(key=lambda usage: (-(usage[1] / usage[2]) if usage[2] else float("inf"), -usage[1]))
+
+        return RosterSummary(
+            count,
+            sorted_counts(race_names, race_counts),
+            sorted_counts(class_names, class_counts),
+            (race_names, class_names, race_class),
+            histograms,
+            stat_means,
+            item_usage,
+        )
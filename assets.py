@@ -0,0 +1,184 @@
+import argparse
+import io
+import json
+import mmap
+import os
+import struct
+import time
+
+# Файл пакета: MAGIC, длина оглавления (4 байта), оглавление в JSON, затем содержимое файлов подряд.
+# В оглавлении для каждого файла: смещение от начала содержимого, размер и время изменения исходника
+MAGIC = b"DNDPACK1"
+HEADER = struct.Struct("<8sI")
+PACK_VERSION = 1
+DEFAULT_PACK = "assets.pack"
+DEFAULT_FOLDERS = ("Pictures", "Music")
+
+
+def asset_name(folder, file_name):
+    return f"{folder.rstrip('/')}/{file_name}"
+
+
+# Файловый объект поверх буфера без копирования всего файла: pygame читает из него кусками.
+# pygame закрывает переданный объект, поэтому на каждую передачу нужен новый
+class BufferReader(io.RawIOBase):
+    def __init__(self, data):
+        super().__init__()
+        self.data = memoryview(data)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), len(self.data) - self.position))
+        buffer[:size] = self.data[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.data)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.data.release()
+        super().close()
+
+
+# Картинки и музыка из обычных папок, для разработки
+class AssetFolder:
+    def __init__(self, root="."):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def files(self, folder):
+        path = self.path(folder)
+        return sorted(
+            asset_name(folder, file_name) for file_name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, file_name))
+        )
+
+    def data(self, name):
+        with open(self.path(name), "rb") as file:
+            return file.read()
+
+    # Меняется вместе с содержимым файла; по нему строятся ключи дискового кэша
+    def signature(self, name):
+        stat = os.stat(self.path(name))
+        return f"{os.path.abspath(self.path(name))}|{stat.st_mtime_ns}|{stat.st_size}"
+
+
+# Все файлы в одном пакете, отображённом в память: список папки берётся из оглавления,
+# а содержимое отдаётся срезом отображения без чтения и копирования
+class AssetPack:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} не является пакетом ресурсов")
+        index = json.loads(bytes(self.map[HEADER.size:HEADER.size + index_size]))
+        if index.get("version") != PACK_VERSION:
+            self.map.close()
+            raise ValueError(f"Неподдерживаемая версия пакета ресурсов {path}: {index.get('version')}")
+        data_start = HEADER.size + index_size
+        self.entries = {
+            name: (data_start + offset, size, mtime_ns) for name, (offset, size, mtime_ns) in index["files"].items()
+        }
+        self.view = memoryview(self.map)
+
+    def files(self, folder):
+        prefix = folder.rstrip("/") + "/"
+        return sorted(name for name in self.entries if name.startswith(prefix) and "/" not in name[len(prefix):])
+
+    def entry(self, name):
+        try:
+            return self.entries[name]
+        except KeyError:
+            raise FileNotFoundError(f"{name} нет в пакете {self.path}") from None
+
+    # Просьба к ОС подгрузить страницы заранее, чтобы чтение из потока интерфейса не ждало диск
+    def data(self, name):
+        offset, size, _ = self.entry(name)
+        if size and hasattr(self.map, "madvise"):
+            start = offset - offset % mmap.PAGESIZE
+            self.map.madvise(mmap.MADV_WILLNEED, start, offset + size - start)
+        return self.view[offset:offset + size]
+
+    def signature(self, name):
+        offset, size, mtime_ns = self.entry(name)
+        return f"{os.path.abspath(self.path)}:{name}|{mtime_ns}|{size}|{offset}"
+
+
+# Пакет, если он собран, иначе файлы из папок рядом с программой
+def open_assets(pack_path=DEFAULT_PACK, root="."):
+    if pack_path and os.path.isfile(pack_path):
+        return AssetPack(pack_path)
+    return AssetFolder(root)
+
+
+def collect_files(root, folders):
+    names = []
+    for folder in folders:
+        for directory, subdirectories, file_names in os.walk(os.path.join(root, folder)):
+            subdirectories.sort()
+            relative = os.path.relpath(directory, root).replace(os.sep, "/")
+            names.extend(asset_name(relative, file_name) for file_name in sorted(file_names))
+    return names
+
+
+# Смещения в оглавлении отсчитываются от конца оглавления, поэтому их можно посчитать заранее по размерам
+def build_pack(output, root=".", folders=DEFAULT_FOLDERS):
+    source = AssetFolder(root)
+    names = collect_files(root, folders)
+    stats = {name: os.stat(source.path(name)) for name in names}
+    files = {}
+    offset = 0
+    for name in names:
+        files[name] = [offset, stats[name].st_size, stats[name].st_mtime_ns]
+        offset += stats[name].st_size
+    index = json.dumps({"version": PACK_VERSION, "files": files}, ensure_ascii=False).encode("utf-8")
+
+    temporary_path = output + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(index)))
+        file.write(index)
+        for name in names:
+            with open(source.path(name), "rb") as asset:
+                data = asset.read()
+            if len(data) != stats[name].st_size:
+                raise OSError(f"{name} изменился во время упаковки")
+            file.write(data)
+    os.replace(temporary_path, output)
+    return names
+
+
+def pack_main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py pack", description="Сборка картинок и музыки в один пакет ресурсов")
+    parser.add_argument("folders", nargs="*", default=list(DEFAULT_FOLDERS))
+    parser.add_argument("--root", default=".")
+    parser.add_argument("--output", default=DEFAULT_PACK)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    names = build_pack(args.output, args.root, args.folders)
+    size = os.path.getsize(args.output)
+    print(
+        f"Упаковано {len(names)} файлов в {args.output} ({size / 1024 / 1024:.1f} МБ) "
+        f"за {time.perf_counter() - started:.2f} с"
+    )
+    return 0
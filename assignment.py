@@ -0,0 +1,89 @@
+import itertools
+
+from rules import get_catalog
+from storage import STATS, modifier
+
+STANDARD_ARRAY = (15, 14, 13, 12, 10, 8)
+# Все 720 способов разложить стандартный набор по шести характеристикам
+PERMUTATIONS = tuple(itertools.permutations(STANDARD_ARRAY))
+# При равных модификаторах выше ставится вариант с большими итоговыми значениями в важных характеристиках
+TIE_BREAK = 0.01
+
+# Профили, подключённые поверх весов из справочника правил
+custom_profiles = {}
+
+
+def register_profile(class_name, weights):
+    custom_profiles[class_name] = tuple(float(weights.get(stat, 0)) for stat in STATS)
+
+
+# Веса характеристик класса: свой профиль, затем справочник, иначе все равны
+def class_profile(class_name):
+    if class_name in custom_profiles:
+        return custom_profiles[class_name]
+    classes = get_catalog().classes
+    if class_name in classes:
+        return classes[class_name].stat_priorities
+    return tuple(1.0 for _ in STATS)
+
+
+def score_table(race_bonuses, weights, pool=STANDARD_ARRAY):
+    table = []
+    for stat, weight in zip(STATS, weights):
+        bonus = race_bonuses.get(stat, 0)
+        table.append({value: weight * (modifier(value + bonus) + TIE_BREAK * (value + bonus)) for value in set(pool)})
+    return table
+
+
+# Разные способы разложить набор; у выброшенных значений бывают повторы
+def pool_permutations(pool):
+    if sorted(pool) == sorted(STANDARD_ARRAY):
+        return PERMUTATIONS
+    return tuple(set(itertools.permutations(pool)))
+
+
+# Лучшие распределения набора значений (по умолчанию стандартного) для расы и класса.
+# fixed — уже выбранные значения {характеристика: значение}, с ними совместимы только часть вариантов
+def rank_assignments(race_bonuses, class_name=None, fixed=None, limit=3, weights=None, pool=STANDARD_ARRAY):
+    if weights is None:
+        weights = class_profile(class_name)
+    table = score_table(race_bonuses, weights, pool)
+    fixed_positions = [(STATS.index(stat), value) for stat, value in (fixed or {}).items()]
+
+    ranked = []
+    for values in pool_permutations(pool):
+        if any(values[position] != value for position, value in fixed_positions):
+            continue
+        score = (
+            table[0][values[0]] + table[1][values[1]] + table[2][values[2]]
+            + table[3][values[3]] + table[4][values[4]] + table[5][values[5]]
+        )
+        ranked.append((score, values))
+    ranked.sort(key=lambda entry: entry[0], reverse=True)
+    return [(score, dict(zip(STATS, values))) for score, values in ranked[:limit]]
+
+
+# Лучшее распределение для каждой пары раса×класс за один векторный проход
+def best_assignments_for_all(catalog=None):
+    # numpy нужен только здесь: модуль импортируется при запуске окна
+    import numpy as np
+
+    catalog = catalog or get_catalog()
+    races = list(catalog.races.values())
+    class_names = list(catalog.classes)
+
+    permutations = np.array(PERMUTATIONS, dtype=np.int16)
+    bonuses = np.array([[race.bonus(stat) for stat in STATS] for race in races], dtype=np.int16)
+    weights = np.array([class_profile(name) for name in class_names], dtype=np.float64)
+
+    totals = permutations[np.newaxis, :, :] + bonuses[:, np.newaxis, :]
+    values = np.floor_divide(totals - 10, 2) + TIE_BREAK * totals
+    scores = np.einsum("rps,cs->rcp", values, weights)
+    best = scores.argmax(axis=2)
+
+    result = {}
+    for race_index, race in enumerate(races):
+        for class_index, class_name in enumerate(class_names):
+            chosen = permutations[best[race_index, class_index]]
+            result[(race.name, class_name)] = dict(zip(STATS, (int(value) for value in chosen)))
+    return result
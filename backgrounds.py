@@ -0,0 +1,87 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QRunnable, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from metrics import metrics
+
+
+# Сигналы фоновых задач; QPixmap нельзя создавать вне GUI-потока, поэтому наружу отдаётся QImage
+class BackgroundSignals(QObject):
+    loaded = pyqtSignal(str, QImage)
+    scaled = pyqtSignal(str, QSize, QImage)
+
+
+# Декодирование картинки фона в пуле потоков; из пакета ресурсов картинка читается без копирования
+class BackgroundLoader(QRunnable):
+    def __init__(self, assets, path):
+        super().__init__()
+        self.assets = assets
+        self.path = path
+        self.signals = BackgroundSignals()
+
+    @metrics.timed("background_decode")
+    def run(self):
+        image = QImage()
+        try:
+            image.loadFromData(self.assets.data(self.path))
+        except OSError as error:
+            print(f"Не удалось прочитать {self.path}: {error}")
+        self.signals.loaded.emit(self.path, image)
+
+
+# Плавное масштабирование под размер окна; результат по желанию кэшируется на диске
+class BackgroundScaler(QRunnable):
+    def __init__(self, assets, path, image, size, cache_folder=None):
+        super().__init__()
+        self.assets = assets
+        self.path = path
+        self.image = image
+        self.size = size
+        self.cache_folder = cache_folder
+        self.signals = BackgroundSignals()
+
+    @metrics.timed("background_smooth_scale")
+    def run(self):
+        cache_path = self.cache_path()
+        scaled = QImage(cache_path) if cache_path and os.path.exists(cache_path) else QImage()
+        if scaled.isNull():
+            scaled = self.image.scaled(self.size, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+            if cache_path:
+                os.makedirs(self.cache_folder, exist_ok=True)
+                # Пишем во временный файл, чтобы параллельный запуск не прочитал недописанную картинку
+                temporary_path = cache_path + ".tmp.jpg"
+                if scaled.save(temporary_path, "JPG", 95):
+                    os.replace(temporary_path, cache_path)
+        self.signals.scaled.emit(self.path, self.size, scaled)
+
+    def cache_path(self):
+        if not self.cache_folder:
+            return None
+        try:
+            signature = self.assets.signature(self.path)
+        except OSError:
+            return None
+        key = f"{signature}|{self.size.width()}x{self.size.height()}"
+        return os.path.join(self.cache_folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jpg")
+
+
+# Готовые отмасштабированные фоны по ключу (картинка, ширина, высота)
+class ScaledPixmapCache:
+    def __init__(self, capacity=4):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def get(self, path, size):
+        key = (path, size.width(), size.height())
+        pixmap = self.entries.get(key)
+        if pixmap is not None:
+            self.entries.move_to_end(key)
+        return pixmap
+
+    def put(self, path, size, pixmap):
+        self.entries[(path, size.width(), size.height())] = pixmap
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
@@ -0,0 +1,746 @@
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QEvent, QObject
+from PyQt5.QtWidgets import QApplication, QMessageBox, QWidget
+
+from storage import CharacterStore, STATS
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def random_character(number, rng):
+    character = {
+        "Имя": f"Персонаж {number:06d}",
+        "Раса": rng.choice(["Человек", "Эльф", "Тифлинг", "Дварф", "Гном"]),
+        "Класс": rng.choice(["Бард", "Варвар", "Воин", "Волшебник", "Колдун"]),
+        "Описание": "Сгенерирован для замера",
+        "Снаряжение": {"оружие": "Кинжал", "снаряжение": None, "инструменты": None, "снаряжение класса": None},
+        "Особенности расы": "Темновидение",
+    }
+    for stat in STATS:
+        character[stat] = rng.randint(8, 17)
+    return character
+
+
+def fill_store(store, count, seed=0):
+    rng = random.Random(seed)
+    batch = []
+    for number in range(count):
+        batch.append(random_character(number, rng))
+        if len(batch) == 5000:
+            store.save_many(batch)
+            batch = []
+    store.save_many(batch)
+
+
+def application():
+    return QApplication.instance() or QApplication(sys.argv[:1])
+
+
+# Время до первой отрисовки списка персонажей и память на 1k/10k/100k персонажей
+def bench_character_list(args):
+    from main import CharacterListWidget
+
+    app = application()
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            store = CharacterStore(os.path.join(folder, "characters.db"))
+            fill_store(store, size)
+            owner = QWidget()
+            owner.character_store = store
+            # Замеряется сам список, без поискового индекса
+            owner.search_index = None
+            owner.is_viewing_characters = True
+
+            rss_before = rss_mb()
+            started = time.perf_counter()
+            widget = CharacterListWidget(owner)
+            widget.show()
+            widget.repaint()
+            app.processEvents()
+            first_paint = time.perf_counter() - started
+            print(
+                f"{size:>7} персонажей: первая отрисовка {first_paint * 1000:7.1f} мс, "
+                f"память +{rss_mb() - rss_before:6.1f} МБ"
+            )
+            widget.close()
+            widget.deleteLater()
+            app.processEvents()
+            store.close()
+
+
+def live_qobjects(owner):
+    gc.collect()
+    return len(owner.findChildren(QObject)), sum(isinstance(item, QObject) for item in gc.get_objects())
+
+
+# Число живых QObject после N проходов мастера создания (созданий и отмен на разных шагах)
+def bench_wizard_leak(args):
+    from main import CharacterCreationWizard, CharacterWriterService
+    from rules import get_catalog
+
+    app = application()
+    # Подсказки модальные, в замере они только мешают
+    QMessageBox.information = staticmethod(lambda *args, **kwargs: QMessageBox.Ok)
+    QMessageBox.question = staticmethod(lambda *args, **kwargs: QMessageBox.No)
+    class_count = len(get_catalog().classes)
+    with tempfile.TemporaryDirectory() as folder:
+        owner = QWidget()
+        owner.character_store = CharacterStore(os.path.join(folder, "characters.db"))
+        owner.character_writer = CharacterWriterService(owner.character_store, owner)
+        owner.is_creating_character = False
+        owner.draft_path = os.path.join(folder, "characters-draft.db")
+        wizard = CharacterCreationWizard(owner)
+
+        # Панели снаряжения создаются по одной на класс, поэтому рост до первого прохода всех классов ожидаем.
+        # После прогрева нужен хотя бы один полный круг по шагам остановки, иначе проверять нечего
+        stop_steps = len(wizard.steps) + 1
+        warm_up = class_count * stop_steps
+        if args.cycles < warm_up + stop_steps:
+            print(f"Нужно не меньше {warm_up + stop_steps} проходов: первые {warm_up} — прогрев")
+            wizard.close_drafts()
+            owner.character_writer.close()
+            owner.character_store.close()
+            sys.exit(1)
+
+        counts = []
+        started = time.perf_counter()
+        for cycle in range(args.cycles):
+            owner.is_creating_character = True
+            wizard.start()
+            stop_step = cycle % stop_steps
+            for step in range(stop_step):
+                page = wizard.steps[step]
+                if page is wizard.race_page:
+                    page.race_buttons.buttons()[cycle % len(page.race_buttons.buttons())].click()
+                elif page is wizard.class_page:
+                    page.class_buttons.buttons()[cycle % class_count].click()
+                elif page is wizard.stat_page:
+                    for stat, value in zip(STATS, ["15", "14", "13", "12", "10", "8"]):
+                        page.stat_comboboxes[stat].setCurrentText(value)
+                elif page is wizard.description_page:
+                    page.name_edit.setText(f"НПС {cycle}")
+                if page is wizard.equipment_page:
+                    page.finish_creation()
+                    # Запись идёт в фоновом потоке, итог приходит сигналом
+                    while page.pending_save is not None:
+                        app.processEvents()
+                else:
+                    page.proceed_to_next_step()
+            if owner.is_creating_character:
+                wizard.cancel()
+            app.processEvents()
+            counts.append(live_qobjects(owner))
+        elapsed = time.perf_counter() - started
+
+        print(f"Проходов: {args.cycles}, {elapsed / args.cycles * 1000:.1f} мс на проход")
+        print(f"Дочерних QObject: после 1-го {counts[0][0]}, после прогрева {counts[warm_up][0]}, в конце {counts[-1][0]}")
+        print(f"Обёрток QObject в Python: после 1-го {counts[0][1]}, после прогрева {counts[warm_up][1]}, в конце {counts[-1][1]}")
+        leaked = counts[-1][0] - counts[warm_up][0]
+        print("Утечек нет" if leaked <= 0 else f"Рост после прогрева: {leaked} QObject")
+        wizard.close_drafts()
+        owner.character_writer.close()
+        owner.character_store.close()
+    if leaked > 0:
+        sys.exit(1)
+
+
+# Процесс записи для проверки crash: сохраняет count персонажей через CharacterWriter и перед
+# каждой транзакцией печатает имена её пачки, после — отметку о записи
+def bench_crash_writer(args):
+    import json
+    from storage import CharacterWriter
+
+    class AnnouncingWriter(CharacterWriter):
+        def write_batch(self, store, batch):
+            names = [value["Имя"] if action == "save" else value for _, action, value in batch]
+            print(json.dumps({"batch": names}, ensure_ascii=False), flush=True)
+            super().write_batch(store, batch)
+
+    def report(batch):
+        print(json.dumps({"written": len(batch.saved), "error": batch.error}, ensure_ascii=False), flush=True)
+
+    writer = AnnouncingWriter(args.database, report)
+    rng = random.Random(args.seed)
+    for number in range(args.count):
+        writer.save(random_character(number, rng))
+    writer.close()
+
+
+# Восстановление после сбоя: процесс записи убивается посреди потока сохранений, после чего база
+# должна открываться, проходить integrity_check и содержать только целые пачки, каждую без искажений
+def bench_crash(args):
+    import json
+    import subprocess
+
+    failures = 0
+    rng = random.Random(args.seed)
+    expected_rng = random.Random(args.seed)
+    expected = [random_character(number, expected_rng) for number in range(args.count)]
+    for trial in range(args.trials):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "characters.db")
+            CharacterStore(path).close()
+            kill_after = rng.randint(1, args.kill_after)
+            child = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "crash-writer", path,
+                 "--count", str(args.count), "--seed", str(args.seed)],
+                stdout=subprocess.PIPE, text=True, encoding="utf-8",
+            )
+            batches = []
+            written = 0
+            # Процесс убивается через случайное время после того, как объявил очередную пачку:
+            # её транзакция в этот момент идёт или только что закончилась
+            for line in child.stdout:
+                event = json.loads(line)
+                if "batch" in event:
+                    batches.append(event["batch"])
+                    if len(batches) > kill_after:
+                        time.sleep(rng.uniform(0, args.max_delay / 1000))
+                        child.kill()
+                        break
+                else:
+                    written += 1
+            # Пачки, объявленные до гибели процесса, ещё лежат в канале
+            for line in child.stdout:
+                event = json.loads(line)
+                if "batch" in event:
+                    batches.append(event["batch"])
+            child.wait()
+
+            store = CharacterStore(path)
+            integrity = store.connection.execute("PRAGMA integrity_check").fetchone()[0]
+            stored = set(store.names())
+            whole = set()
+            complete = 0
+            for batch in batches:
+                if not set(batch) <= stored:
+                    break
+                whole.update(batch)
+                complete += 1
+            errors = []
+            if integrity != "ok":
+                errors.append(f"integrity_check: {integrity}")
+            if stored != whole:
+                errors.append(f"{len(stored - whole)} персонажей из незавершённой пачки")
+            if complete < written:
+                errors.append(f"подтверждено {written} пачек, в базе целиком только {complete}")
+            for character in expected:
+                if character["Имя"] in stored and store.get(character["Имя"]) != character:
+                    errors.append(f"{character['Имя']} записан с искажениями")
+                    break
+            store.close()
+
+        status = "; ".join(errors) if errors else "ok"
+        print(f"Проход {trial + 1}: убит после {written} подтверждённых пачек, "
+              f"в базе {len(stored)} персонажей ({complete} из {len(batches)} начатых пачек) — {status}")
+        failures += bool(errors)
+    print("Сбоев нет" if not failures else f"Проходов с ошибками: {failures}")
+    if failures:
+        sys.exit(1)
+
+
+# Скорость сборки, проверки и сохранения персонажей без графического интерфейса
+def bench_core(args):
+    from assignment import STANDARD_ARRAY
+    from core import Character, CharacterBuilder
+    from rules import EQUIPMENT_CATEGORIES, get_catalog
+
+    catalog = get_catalog()
+    rng = random.Random(args.seed)
+    race_names = list(catalog.races)
+    class_names = list(catalog.classes)
+    choices = []
+    for number in range(args.count):
+        class_name = rng.choice(class_names)
+        equipment = catalog.equipment(class_name)
+        values = list(STANDARD_ARRAY)
+        rng.shuffle(values)
+        choices.append((
+            f"НПС {number}",
+            rng.choice(race_names),
+            class_name,
+            values,
+            [rng.choice(equipment[category]) if equipment[category] else None for category in EQUIPMENT_CATEGORIES],
+        ))
+
+    def measure(title, operation, items):
+        started = time.perf_counter()
+        result = [operation(item) for item in items]
+        elapsed = time.perf_counter() - started
+        print(f"{title:<24} {len(items) / elapsed:12,.0f} в секунду")
+        return result
+
+    def build(choice):
+        name, race, class_name, values, items = choice
+        builder = CharacterBuilder().with_name(name).with_race(race).with_class(class_name)
+        return builder.replace(base_stats=values, equipment=items)
+
+    builders = measure("сборка", build, choices)
+    measure("проверка", lambda builder: builder.validate(catalog), builders)
+    characters = measure("сборка с проверкой", lambda builder: builder.build(catalog), builders)
+    dicts = measure("в словарь", lambda character: character.to_dict(catalog), characters)
+    measure("в лист .txt", lambda character: character.to_sheet(catalog), characters)
+    measure("в JSON", lambda character: character.to_json(catalog), characters)
+    measure("из словаря", lambda character: Character.from_dict(character, catalog), dicts)
+
+
+# Время построения поискового индекса и поиска по мере набора запроса
+def bench_search(args):
+    from search import SearchIndex
+
+    query = args.query
+    with tempfile.TemporaryDirectory() as folder:
+        store = CharacterStore(os.path.join(folder, "characters.db"))
+        fill_store(store, args.size)
+        index = SearchIndex()
+        started = time.perf_counter()
+        index.attach(store).join()
+        print(f"Индекс на {args.size} персонажей построен за {time.perf_counter() - started:.2f} с")
+
+        # Каждый префикс запроса — как очередное нажатие клавиши
+        worst = 0
+        for length in range(1, len(query) + 1):
+            started = time.perf_counter()
+            found = index.search(query[:length])
+            elapsed = time.perf_counter() - started
+            worst = max(worst, elapsed)
+        print(f"Запрос «{query}»: найдено {len(found)}, худшее нажатие {worst * 1000:.1f} мс")
+
+        started = time.perf_counter()
+        store.save(random_character(args.size + 1, random.Random(args.size)))
+        print(f"Сохранение с обновлением индекса: {(time.perf_counter() - started) * 1000:.1f} мс")
+        store.close()
+
+
+# Скорость бросков и подсчёта распределений для выражений с кубиками
+def bench_dice(args):
+    import dice
+    import numpy as np
+
+    rng = np.random.default_rng(args.seed)
+    for text in args.expressions:
+        expression = dice.parse(text)
+        started = time.perf_counter()
+        expression.roll(args.rolls, rng)
+        elapsed = time.perf_counter() - started
+        dice_per_second = args.rolls * expression.dice_count() / elapsed
+        started = time.perf_counter()
+        distribution = expression.distribution(rng=rng)
+        distribution_time = time.perf_counter() - started
+        print(
+            f"{text:<12} {dice_per_second:14,.0f} кубиков в секунду, "
+            f"распределение за {distribution_time * 1000:7.1f} мс: {distribution.summary()}"
+        )
+
+
+# Открытие ресурсов, список папок и чтение всех файлов: пакет против папок
+def bench_assets(args):
+    import zlib
+    from assets import AssetFolder, AssetPack, build_pack
+
+    with tempfile.TemporaryDirectory() as folder:
+        pack_path = os.path.join(folder, "assets.pack")
+        build_pack(pack_path)
+        checksums = set()
+        for title, open_source in (("папки", AssetFolder), ("пакет", lambda: AssetPack(pack_path))):
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                source = open_source()
+                names = [name for folder in ("Pictures/Background", "Pictures/Icon", "Music") for name in source.files(folder)]
+                # Контрольная сумма читает каждый байт: у пакета data() отдаёт срез отображения
+                # файла, и без чтения замер показывал бы только нарезку срезов
+                size = checksum = 0
+                for name in names:
+                    data = source.data(name)
+                    size += len(data)
+                    checksum = zlib.crc32(data, checksum)
+            elapsed = (time.perf_counter() - started) / args.repeat
+            checksums.add(checksum)
+            print(f"{title:<8} {len(names)} файлов, {size / 1024 / 1024:.1f} МБ за {elapsed * 1000:8.2f} мс")
+        if len(checksums) != 1:
+            print("Содержимое пакета не совпадает с папками")
+            sys.exit(1)
+
+
+# Пакетный разбор и запись листов персонажей первой и второй версий формата
+def bench_sheet(args):
+    import sheet
+    from npc import generate
+
+    characters = list(generate(args.count, args.seed, workers=1))
+    texts = {1: [sheet.format_sheet(character) for character in characters]}
+    texts[2] = [sheet.format_sheet(character, 2) for character in characters]
+    del characters
+
+    def measure(title, operation, items):
+        started = time.perf_counter()
+        result = operation(items)
+        elapsed = time.perf_counter() - started
+        print(f"{title:<24} {len(items) / elapsed:12,.0f} листов в секунду")
+        return result
+
+    measure("parse_sheet, в словари", lambda items: [sheet.parse_sheet(text) for text in items], texts[1])
+    for version in (1, 2):
+        parsed = measure(f"parse_many, v{version}", sheet.parse_many, texts[version])
+        lossless = all(result.serialize() == text for (result, _), text in zip(parsed, texts[version]))
+        print(f"{'':<24} запись совпадает с исходным текстом: {'да' if lossless else 'НЕТ'}")
+        # Неизменённый лист записывается своим исходным текстом; после replace() — собирается из полей,
+        # и замеряется именно сборка
+        changed = [result.replace(description=result.description) for result, _ in parsed]
+        del parsed
+        rendered = measure(f"format_many, v{version}", sheet.format_many, changed)
+        same = all(
+            sheet.parse(text).to_character() == result.to_character() for text, result in zip(rendered, changed)
+        )
+        print(f"{'':<24} поля после записи и разбора те же: {'да' if same else 'НЕТ'}")
+        del changed, rendered
+
+
+# Сотни планшетов с постоянными соединениями листают список; замер задержки ответа сервера
+def bench_serve(args):
+    import asyncio
+    import json
+    import urllib.parse
+    import urllib.request
+    from search import SearchIndex
+    from server import CACHE_SIZE, RosterService
+    from storage import ChangeWatcher
+
+    if not 0 < args.hot <= CACHE_SIZE:
+        print(f"--hot должен быть от 1 до {CACHE_SIZE}, иначе тёплый прогон вытесняет свои же ответы из кэша")
+        sys.exit(1)
+
+    async def client(host, port, number, latencies):
+        reader, writer = await asyncio.open_connection(host, port)
+        for request in range(args.requests):
+            offset = (number * args.requests + request) % args.hot * 50 % args.size
+            started = time.perf_counter()
+            writer.write(
+                f"GET /characters?offset={offset}&limit=50 HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: gzip\r\n\r\n"
+                .encode("ascii")
+            )
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = next(
+                int(line.split(b":")[1]) for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")
+            )
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+        writer.close()
+
+    async def run_clients(host, port):
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(*(client(host, port, number, latencies) for number in range(args.clients)))
+        return latencies, time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "characters.db")
+        store = CharacterStore(path)
+        fill_store(store, args.size)
+        index = SearchIndex()
+        index.attach(store).join()
+        service = RosterService(path, index, port=0, store_version=lambda: store.version)
+        host, port = service.start()
+        # Страниц в ходу не больше, чем ответов в кэше: холодный прогон начинается с пустого кэша,
+        # тёплый повторяет те же запросы
+        service.cache.clear()
+        for attempt in ("холодный кэш", "тёплый кэш"):
+            hits = service.cache_hits
+            latencies, elapsed = asyncio.run(run_clients(host, port))
+            latencies.sort()
+            print(
+                f"{attempt}: {args.clients} клиентов, {len(latencies) / elapsed:,.0f} запросов в секунду, "
+                f"медиана {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+                f"99% {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс, "
+                f"из кэша {(service.cache_hits - hits) / len(latencies):.0%}"
+            )
+        service.stop()
+
+        # Как в python main.py serve: индекс следует за записями другого соединения
+        watched = SearchIndex()
+        watcher = ChangeWatcher(path, watched.attach)
+        service = RosterService(path, watched, port=0, store_version=lambda: watcher.store.version if watcher.store else 0)
+        host, port = service.start()
+        while not watched.ready:
+            time.sleep(0.01)
+
+        def found(query):
+            with urllib.request.urlopen(f"http://{host}:{port}/search?q={urllib.parse.quote(query)}") as response:
+                return json.load(response)["total"]
+
+        late = random_character(args.size, random.Random(0))
+        late["Имя"] = "Опоздавший"
+        store.save(late)
+        store.delete("Персонаж 000000")
+        started = time.perf_counter()
+        while (found("Опоздавший"), found("Персонаж 000000")) != (1, 0) and time.perf_counter() - started < 5:
+            time.sleep(0.05)
+        fresh = (found("Опоздавший"), found("Персонаж 000000")) == (1, 0)
+        print(f"Поиск увидел чужую запись за {(time.perf_counter() - started) * 1000:.0f} мс" if fresh
+              else "Поиск не увидел чужую запись за 5 с")
+        service.stop()
+        watcher.close()
+        store.close()
+    if not fresh:
+        sys.exit(1)
+
+
+# Создание страниц мастера: стили на каждом виджете, как было раньше, против одной таблицы
+# на всё приложение. Прежние вызовы setStyleSheet воспроизводятся по ролям из theme.RULES
+def bench_theme(args):
+    import re
+    import theme
+    from main import CharacterCreationWizard, CharacterWriterService
+    from PyQt5.QtWidgets import QGroupBox
+
+    app = application()
+    role_styles = {}
+    for selector, declarations in theme.theme_rules(theme.DEFAULT_THEME):
+        role = re.search(r'role~="(\w+)"', selector)
+        if role:
+            role_styles[role.group(1)] = declarations
+
+    def per_widget_styles(page):
+        for widget in [page] + page.findChildren(QWidget):
+            declarations = " ".join(role_styles[role] for role in str(widget.property("role") or "").split())
+            if declarations:
+                widget.setStyleSheet(declarations)
+        for groupbox in page.findChildren(QGroupBox):
+            groupbox.setStyleSheet("background-color: white;")
+
+    def build(wizard, page_class, legacy):
+        started = time.perf_counter()
+        page = page_class(wizard)
+        if hasattr(page, "class_stack"):
+            page.reset()
+        if legacy:
+            per_widget_styles(page)
+        for widget in [page] + page.findChildren(QWidget):
+            widget.ensurePolished()
+        elapsed = time.perf_counter() - started
+        page.deleteLater()
+        # Без цикла событий отложенное удаление само не выполняется
+        app.sendPostedEvents(None, QEvent.DeferredDelete)
+        return elapsed
+
+    with tempfile.TemporaryDirectory() as folder:
+        owner = QWidget()
+        owner.character_store = CharacterStore(os.path.join(folder, "characters.db"))
+        owner.character_writer = CharacterWriterService(owner.character_store, owner)
+        owner.is_creating_character = False
+        owner.draft_path = os.path.join(folder, "characters-draft.db")
+        wizard = CharacterCreationWizard(owner)
+        wizard.builder = wizard.builder.with_race("Человек").with_class(next(iter(theme_classes())))
+        results = {}
+        for legacy, title in ((True, "стили на виджетах"), (False, "одна таблица")):
+            app.setStyleSheet("" if legacy else theme.compile_stylesheet(theme.DEFAULT_THEME))
+            for page in wizard.steps:
+                page_class = type(page)
+                build(wizard, page_class, legacy)
+                times = sorted(build(wizard, page_class, legacy) for _ in range(args.repeat))
+                results[(title, page_class.__name__)] = times[len(times) // 2]
+        print(f"{'страница':<28} {'стили на виджетах':>18} {'одна таблица':>14}")
+        for page in wizard.steps:
+            name = type(page).__name__
+            before = results[("стили на виджетах", name)] * 1000
+            after = results[("одна таблица", name)] * 1000
+            print(f"{name:<28} {before:15.2f} мс {after:11.2f} мс")
+
+        started = time.perf_counter()
+        for name in theme.theme_names() * args.repeat:
+            theme.apply_theme(name, app)
+            app.processEvents()
+        switch = (time.perf_counter() - started) / (len(theme.theme_names()) * args.repeat)
+        print(f"Смена темы при открытом мастере: {switch * 1000:.1f} мс")
+        wizard.close_drafts()
+        owner.character_writer.close()
+        owner.character_store.close()
+
+
+# Подбор снаряжения при каждом щелчке: все классы, значения Силы и закреплённые предметы
+def bench_loadout(args):
+    import loadout
+    from rules import get_catalog
+
+    catalog = get_catalog()
+    requests = []
+    for class_name in catalog.classes:
+        equipment = catalog.equipment(class_name)
+        fixed_choices = [{}] + [{category: item} for category, items in equipment.items() for item in items]
+        for strength in range(3, 21):
+            for fixed in fixed_choices:
+                requests.append((class_name, strength, fixed))
+
+    loadout.solve_loadout.cache_clear()
+    for title in ("первый расчёт", "из кэша"):
+        started = time.perf_counter()
+        for class_name, strength, fixed in requests:
+            loadout.optimize_loadout(class_name, strength, args.budget, fixed, catalog)
+        elapsed = time.perf_counter() - started
+        print(f"{title:<14} {len(requests)} подборов, {elapsed / len(requests) * 1e6:8.1f} мкс на подбор")
+
+
+# Итоги для окна аналитики по столбцам: построение, полный пересчёт и правки по одному персонажу
+def bench_analytics(args):
+    import npc
+    from analytics import RosterColumns
+
+    with tempfile.TemporaryDirectory() as folder:
+        store = CharacterStore(os.path.join(folder, "characters.db"))
+        npc.save_batches(store, npc.generate(args.size, args.seed))
+        columns = RosterColumns()
+        started = time.perf_counter()
+        columns.attach(store).join()
+        print(f"Столбцы на {args.size} персонажей построены за {time.perf_counter() - started:.2f} с")
+
+        worst = 0
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            summary = columns.summary()
+            worst = max(worst, time.perf_counter() - started)
+        print(f"Итоги по {summary.count} персонажам: худший пересчёт {worst * 1000:.1f} мс")
+
+        characters = list(npc.generate(args.repeat, args.seed + 1, workers=1, first_number=args.size))
+        started = time.perf_counter()
+        for character in characters:
+            store.save(character)
+        for character in characters:
+            store.delete(character["Имя"])
+        elapsed = (time.perf_counter() - started) / (2 * len(characters))
+        print(f"Сохранение или удаление с обновлением столбцов: {elapsed * 1000:.2f} мс")
+        after = columns.summary()
+        if (after.races, after.classes, after.item_usage) != (summary.races, summary.classes, summary.item_usage):
+            print("Итоги после правок не совпали с исходными")
+        store.close()
+
+
+# Повышение уровня всему списку одной транзакцией и кривые хитов по тысячам прогонов
+def bench_progression(args):
+    import npc
+    import progression
+
+    with tempfile.TemporaryDirectory() as folder:
+        store = CharacterStore(os.path.join(folder, "characters.db"))
+        npc.save_batches(store, npc.generate(args.size, args.seed))
+        for levels in (1, progression.MAX_LEVEL - 1):
+            started = time.perf_counter()
+            count = progression.level_up_roster(store, levels, seed=args.seed)
+            elapsed = time.perf_counter() - started
+            print(f"+{levels} уровней для {count} персонажей: {elapsed:.2f} с, {elapsed / count * 1e6:.1f} мкс на персонажа")
+        store.close()
+
+    started = time.perf_counter()
+    curve = progression.simulate_hit_points(constitution=args.constitution, runs=args.runs, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Кривые хитов: {len(curve.class_names)} классов × {args.runs} прогонов за {elapsed * 1000:.0f} мс")
+    for class_name, mean, low, high in zip(curve.class_names, curve.mean, curve.low, curve.high):
+        print(f"  {class_name:<13} 1-й {mean[0]:5.1f}  5-й {mean[4]:5.1f}  20-й {mean[-1]:6.1f} ({low[-1]:.0f}–{high[-1]:.0f})")
+
+
+def theme_classes():
+    from rules import get_catalog
+    return get_catalog().classes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности D&D character creator")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    character_list = commands.add_parser("character-list", help="список персонажей")
+    character_list.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    character_list.set_defaults(run=bench_character_list)
+
+    wizard_leak = commands.add_parser("wizard-leak", help="утечки при повторном создании персонажей")
+    wizard_leak.add_argument("--cycles", type=int, default=200)
+    wizard_leak.set_defaults(run=bench_wizard_leak)
+
+    crash = commands.add_parser("crash", help="восстановление базы после гибели процесса записи")
+    crash.add_argument("--trials", type=int, default=5)
+    crash.add_argument("--count", type=int, default=20000)
+    crash.add_argument("--kill-after", type=int, default=10, help="наибольшее число пачек до той, на которой процесс убивается")
+    crash.add_argument("--max-delay", type=float, default=30, help="наибольшая задержка гибели после начала пачки, мс")
+    crash.add_argument("--seed", type=int, default=0)
+    crash.set_defaults(run=bench_crash)
+
+    crash_writer = commands.add_parser("crash-writer", help="служебная: процесс записи для crash")
+    crash_writer.add_argument("database")
+    crash_writer.add_argument("--count", type=int, default=20000)
+    crash_writer.add_argument("--seed", type=int, default=0)
+    crash_writer.set_defaults(run=bench_crash_writer)
+
+    core = commands.add_parser("core", help="сборка, проверка и сохранение персонажей без интерфейса")
+    core.add_argument("--count", type=int, default=100000)
+    core.add_argument("--seed", type=int, default=0)
+    core.set_defaults(run=bench_core)
+
+    search = commands.add_parser("search", help="поисковый индекс по списку персонажей")
+    search.add_argument("--size", type=int, default=100000)
+    search.add_argument("--query", default="раса:тифлинг класс:колдун Харизма>=16 перс")
+    search.set_defaults(run=bench_search)
+
+    dice_bench = commands.add_parser("dice", help="броски кубиков и распределения")
+    dice_bench.add_argument("--rolls", type=int, default=1000000)
+    dice_bench.add_argument("--seed", type=int, default=0)
+    dice_bench.add_argument("--expressions", nargs="+", default=["4d6kh3", "2d20kl1+5", "8d6", "10d10kh5"])
+    dice_bench.set_defaults(run=bench_dice)
+
+    assets_bench = commands.add_parser("assets", help="пакет ресурсов и папки с файлами")
+    assets_bench.add_argument("--repeat", type=int, default=20)
+    assets_bench.set_defaults(run=bench_assets)
+
+    sheet_bench = commands.add_parser("sheet", help="разбор и запись листов персонажей")
+    sheet_bench.add_argument("--count", type=int, default=100000)
+    sheet_bench.add_argument("--seed", type=int, default=0)
+    sheet_bench.set_defaults(run=bench_sheet)
+
+    theme_bench = commands.add_parser("theme", help="создание страниц мастера с таблицей стилей и без")
+    theme_bench.add_argument("--repeat", type=int, default=30)
+    theme_bench.set_defaults(run=bench_theme)
+
+    loadout_bench = commands.add_parser("loadout", help="подбор снаряжения под грузоподъёмность и бюджет")
+    loadout_bench.add_argument("--budget", type=int, default=200)
+    loadout_bench.set_defaults(run=bench_loadout)
+
+    analytics_bench = commands.add_parser("analytics", help="итоги по столбцам для окна аналитики")
+    analytics_bench.add_argument("--size", type=int, default=100000)
+    analytics_bench.add_argument("--seed", type=int, default=0)
+    analytics_bench.add_argument("--repeat", type=int, default=20)
+    analytics_bench.set_defaults(run=bench_analytics)
+
+    progression_bench = commands.add_parser("progression", help="повышение уровня списка и кривые хитов")
+    progression_bench.add_argument("--size", type=int, default=100000)
+    progression_bench.add_argument("--runs", type=int, default=10000)
+    progression_bench.add_argument("--constitution", type=int, default=14)
+    progression_bench.add_argument("--seed", type=int, default=0)
+    progression_bench.set_defaults(run=bench_progression)
+
+    serve_bench = commands.add_parser("serve", help="HTTP-сервис списка персонажей под нагрузкой")
+    serve_bench.add_argument("--size", type=int, default=10000)
+    serve_bench.add_argument("--clients", type=int, default=300)
+    serve_bench.add_argument("--requests", type=int, default=10)
+    serve_bench.add_argument("--hot", type=int, default=256, help="разных страниц в запросах, не больше кэша сервиса")
+    serve_bench.set_defaults(run=bench_serve)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import json
+from collections import namedtuple
+
+from assignment import STANDARD_ARRAY
+from rules import EQUIPMENT_CATEGORIES, get_catalog
+from storage import STATS, format_sheet, modifier
+
+SORTED_STANDARD_ARRAY = sorted(STANDARD_ARRAY)
+EMPTY_STATS = tuple(None for _ in STATS)
+EMPTY_EQUIPMENT = tuple(None for _ in EQUIPMENT_CATEGORIES)
+MIN_STAT = 1
+MAX_STAT = 30
+# Способы получить значения характеристик: стандартный набор или броски кубиков
+STANDARD_METHOD = "standard"
+ROLL_METHOD = "4d6kh3"
+STAT_METHODS = (STANDARD_METHOD, ROLL_METHOD)
+CHARACTER_FIELDS = (
+    "name", "race", "character_class", "description", "base_stats", "equipment", "stat_method", "stat_pool",
+)
+
+
+# Ошибки проверки персонажа, по одной строке на каждую
+class ValidationError(ValueError):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+# Характеристики с расовыми бонусами; не выбранная характеристика равна одному бонусу
+def final_stats(base_stats, race_bonuses):
+    return {
+        stat: (value or 0) + race_bonuses.get(stat, 0) for stat, value in zip(STATS, base_stats)
+    }
+
+
+def race_bonuses(race_name, catalog=None):
+    return (catalog or get_catalog()).race_bonuses.get(race_name, {})
+
+
+# Ошибки персонажа в формате хранилища относительно справочника правил.
+# Характеристики могут быть любыми допустимыми: листы и импорт не обязаны следовать стандартному набору
+def check_character(character, catalog=None):
+    catalog = catalog or get_catalog()
+    errors = []
+    if not str(character.get("Имя", "")).strip():
+        errors.append("Имя персонажа не может быть пустым.")
+    race = character.get("Раса")
+    if race not in catalog.races:
+        errors.append(f"Неизвестная раса: {race}")
+    class_name = character.get("Класс")
+    if class_name not in catalog.classes:
+        errors.append(f"Неизвестный класс: {class_name}")
+    for stat in STATS:
+        value = character.get(stat)
+        if not isinstance(value, int) or isinstance(value, bool) or not MIN_STAT <= value <= MAX_STAT:
+            errors.append(f"{stat}: ожидается целое число от {MIN_STAT} до {MAX_STAT}, получено {value!r}")
+    equipment = character.get("Снаряжение")
+    if not isinstance(equipment, dict):
+        errors.append("Снаряжение должно быть словарём категория → предмет.")
+    elif class_name in catalog.classes:
+        allowed = catalog.equipment(class_name)
+        for category, item in equipment.items():
+            if category not in allowed:
+                errors.append(f"Неизвестная категория снаряжения: {category}")
+            elif item is not None and item not in allowed[category]:
+                errors.append(f"{item} нельзя выбрать в категории «{category}» для класса {class_name}")
+    return errors
+
+
+# Неизменяемая заготовка персонажа: каждый with_* возвращает новую заготовку.
+# base_stats — значения из stat_pool по порядку STATS, equipment — предметы по порядку категорий.
+# stat_pool — стандартный набор или шесть выброшенных значений, смотря по stat_method.
+# Основа — namedtuple, а не Record из rules: заготовки создаются сотнями тысяч в секунду
+class CharacterBuilder(namedtuple("CharacterBuilder", CHARACTER_FIELDS)):
+    __slots__ = ()
+
+    def __new__(cls, name="", race=None, character_class=None, description="",
+                base_stats=EMPTY_STATS, equipment=EMPTY_EQUIPMENT, stat_method=STANDARD_METHOD,
+                stat_pool=STANDARD_ARRAY):
+        return super().__new__(
+            cls, name, race, character_class, description, tuple(base_stats), tuple(equipment),
+            stat_method, tuple(stat_pool),
+        )
+
+    def replace(self, **changes):
+        return self._replace(**changes)
+
+    def with_name(self, name):
+        return self.replace(name=name.strip())
+
+    def with_description(self, description):
+        return self.replace(description=description.strip())
+
+    def with_race(self, race):
+        return self.replace(race=race)
+
+    def with_class(self, character_class):
+        # Снаряжение зависит от класса
+        return self.replace(character_class=character_class, equipment=EMPTY_EQUIPMENT)
+
+    def with_stat(self, stat, value):
+        base_stats = list(self.base_stats)
+        base_stats[STATS.index(stat)] = value
+        return self.replace(base_stats=tuple(base_stats))
+
+    def with_stats(self, values):
+        return self.replace(base_stats=tuple(values.get(stat) for stat in STATS))
+
+    # Смена способа или новый бросок сбрасывают распределённые характеристики
+    def with_stat_method(self, method, rng=None):
+        if method == STANDARD_METHOD:
+            pool = STANDARD_ARRAY
+        else:
+            # dice тянет за собой numpy, поэтому импортируется только для бросков
+            import dice
+            pool = sorted(dice.roll(method, len(STATS), rng).tolist(), reverse=True)
+        return self.replace(stat_method=method, stat_pool=tuple(pool), base_stats=EMPTY_STATS)
+
+    def reroll_stats(self, rng=None):
+        return self.with_stat_method(self.stat_method, rng)
+
+    def with_equipment(self, category, item):
+        equipment = list(self.equipment)
+        equipment[EQUIPMENT_CATEGORIES.index(category)] = item
+        return self.replace(equipment=tuple(equipment))
+
+    def stats(self, catalog=None):
+        return final_stats(self.base_stats, race_bonuses(self.race, catalog))
+
+    def equipment_dict(self):
+        return dict(zip(EQUIPMENT_CATEGORIES, self.equipment))
+
+    def validate(self, catalog=None):
+        catalog = catalog or get_catalog()
+        errors = []
+        if not self.name:
+            errors.append("Имя персонажа не может быть пустым.")
+        if self.race not in catalog.races:
+            errors.append(f"Неизвестная раса: {self.race}")
+        if self.character_class not in catalog.classes:
+            errors.append(f"Неизвестный класс: {self.character_class}")
+        errors.extend(self.validate_pool())
+        if None in self.base_stats:
+            errors.append("Распределены не все характеристики.")
+        elif sorted(self.base_stats) != sorted(self.stat_pool):
+            pool = ", ".join(str(value) for value in sorted(self.stat_pool, reverse=True))
+            errors.append(f"Характеристики должны быть распределены из набора {pool}.")
+        if self.character_class in catalog.classes:
+            allowed = catalog.classes[self.character_class].equipment
+            for (category, items), item in zip(allowed, self.equipment):
+                if item is not None and item not in items:
+                    errors.append(f"{item} нельзя выбрать в категории «{category}» для класса {self.character_class}")
+        return errors
+
+    def validate_pool(self):
+        if self.stat_method not in STAT_METHODS:
+            return [f"Неизвестный способ получения характеристик: {self.stat_method}"]
+        if self.stat_method == STANDARD_METHOD:
+            if sorted(self.stat_pool) != SORTED_STANDARD_ARRAY:
+                return ["Стандартный набор — 15, 14, 13, 12, 10, 8."]
+            return []
+        import dice
+        low, high = dice.parse(self.stat_method).bounds()
+        if len(self.stat_pool) != len(STATS) or any(not low <= value <= high for value in self.stat_pool):
+            return [f"Нужно {len(STATS)} бросков {self.stat_method} со значениями от {low} до {high}."]
+        return []
+
+    def build(self, catalog=None):
+        errors = self.validate(catalog)
+        if errors:
+            raise ValidationError(errors)
+        return Character(*self)
+
+
+# Готовый проверенный персонаж
+class Character(namedtuple("Character", CHARACTER_FIELDS)):
+    __slots__ = ()
+
+    def stats(self, catalog=None):
+        return final_stats(self.base_stats, race_bonuses(self.race, catalog))
+
+    def to_dict(self, catalog=None):
+        catalog = catalog or get_catalog()
+        character = {
+            "Имя": self.name,
+            "Раса": self.race,
+            "Класс": self.character_class,
+            "Описание": self.description,
+            "Снаряжение": dict(zip(EQUIPMENT_CATEGORIES, self.equipment)),
+            "Особенности расы": catalog.races[self.race].features,
+        }
+        character.update(self.stats(catalog))
+        return character
+
+    def to_sheet(self, catalog=None):
+        return format_sheet(self.to_dict(catalog))
+
+    def to_json(self, catalog=None):
+        return json.dumps(self.to_dict(catalog), ensure_ascii=False)
+
+    def modifiers(self, catalog=None):
+        return {stat: modifier(value) for stat, value in self.stats(catalog).items()}
+
+    # Персонаж из словаря в формате хранилища (характеристики уже с бонусами расы)
+    @classmethod
+    def from_dict(cls, character, catalog=None):
+        bonuses = race_bonuses(character["Раса"], catalog)
+        equipment = character.get("Снаряжение") or {}
+        base_stats = [character[stat] - bonuses.get(stat, 0) for stat in STATS]
+        # Способ не хранится: если это не стандартный набор, значения считаются выброшенными
+        method = STANDARD_METHOD if sorted(base_stats) == SORTED_STANDARD_ARRAY else ROLL_METHOD
+        builder = CharacterBuilder(
+            character["Имя"],
+            character["Раса"],
+            character["Класс"],
+            character.get("Описание", ""),
+            base_stats,
+            [equipment.get(category) for category in EQUIPMENT_CATEGORIES],
+            method,
+            base_stats,
+        )
+        return builder.build(catalog)
@@ -0,0 +1,214 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# Слагаемое выражения: кубики «4d6kh3», «d20», «2к20kl1» или число
+TERM = re.compile(r"([+-])?(?:(\d*)[dдк](\d+)(?:(kh|kl)(\d+))?|(\d+))", re.IGNORECASE)
+# Если точный подсчёт дороже этого числа операций, распределение оценивается бросками
+MAX_EXACT_COST = 20_000_000
+DEFAULT_SAMPLES = 1_000_000
+# Сколько кубиков бросается за один проход, чтобы не держать в памяти огромные массивы
+CHUNK_DICE = 4_000_000
+MAX_DICE = 1000
+MAX_SIDES = 1000
+
+
+class DiceError(ValueError):
+    pass
+
+
+# Сумма keep больших (или меньших) кубиков в каждой строке. Частые случаи (один кубик или
+# все без одного) считаются через min/max, остальные через partition вместо полной сортировки
+def keep_dice(rolls, keep, highest):
+    count = rolls.shape[1]
+    if keep == 1:
+        return (rolls.max(axis=1) if highest else rolls.min(axis=1)).astype(np.int64)
+    if keep == count - 1:
+        dropped = rolls.min(axis=1) if highest else rolls.max(axis=1)
+        return rolls.sum(axis=1, dtype=np.int64) - dropped
+    if keep is not None:
+        if highest:
+            rolls = np.partition(rolls, count - keep, axis=1)[:, count - keep:]
+        else:
+            rolls = np.partition(rolls, keep - 1, axis=1)[:, :keep]
+    return rolls.sum(axis=1, dtype=np.int64)
+
+
+# Кубики одного вида: count кубиков с sides гранями, из них остаются keep больших или меньших
+class DiceTerm:
+    __slots__ = ("sign", "count", "sides", "keep", "highest")
+
+    def __init__(self, sign, count, sides, keep=None, highest=True):
+        if not 1 <= count <= MAX_DICE:
+            raise DiceError(f"Число кубиков должно быть от 1 до {MAX_DICE}")
+        if not 1 <= sides <= MAX_SIDES:
+            raise DiceError(f"Число граней должно быть от 1 до {MAX_SIDES}")
+        if keep is not None and not 1 <= keep <= count:
+            raise DiceError(f"Оставить можно от 1 до {count} кубиков")
+        self.sign = sign
+        self.count = count
+        self.sides = sides
+        self.keep = None if keep == count else keep
+        self.highest = highest
+
+    def __str__(self):
+        text = f"{self.count}d{self.sides}"
+        if self.keep is not None:
+            text += f"{'kh' if self.highest else 'kl'}{self.keep}"
+        return text
+
+    def bounds(self):
+        kept = self.count if self.keep is None else self.keep
+        return (kept, kept * self.sides) if self.sign > 0 else (-kept * self.sides, -kept)
+
+    def roll(self, size, rng):
+        rolls = rng.integers(1, self.sides + 1, size=(size, self.count), dtype=np.int16)
+        return self.sign * keep_dice(rolls, self.keep, self.highest)
+
+    # Примерная цена точного подсчёта: свёртки для простой суммы, перебор исходов при отбрасывании
+    def exact_cost(self):
+        if self.keep is None:
+            return (self.count * self.sides) ** 2 // 2
+        return self.sides ** self.count * self.count
+
+    # Точное распределение: (наименьшее значение, вероятности значений подряд начиная с него)
+    def distribution(self):
+        if self.keep is None:
+            face = np.full(self.sides, 1 / self.sides)
+            pmf = np.ones(1)
+            for _ in range(self.count):
+                pmf = np.convolve(pmf, face)
+            low = self.count
+        else:
+            # Все исходы разом: кубики — разряды номера исхода в системе счисления с основанием sides
+            outcomes = np.arange(self.sides ** self.count)
+            rolls = np.empty((len(outcomes), self.count), dtype=np.int16)
+            for die in range(self.count):
+                rolls[:, die] = outcomes // self.sides ** die % self.sides + 1
+            totals = keep_dice(rolls, self.keep, self.highest)
+            low = int(totals.min())
+            pmf = np.bincount(totals - low) / len(totals)
+        if self.sign < 0:
+            return -(low + len(pmf) - 1), pmf[::-1]
+        return low, pmf
+
+
+# Распределение суммы: значения, их вероятности и признак точного подсчёта
+class Distribution:
+    def __init__(self, values, probabilities, exact, samples=0):
+        self.values = values
+        self.probabilities = probabilities
+        self.exact = exact
+        self.samples = samples
+        self.cumulative = np.cumsum(probabilities)
+
+    @property
+    def mean(self):
+        return float(np.dot(self.values, self.probabilities))
+
+    @property
+    def std(self):
+        return float(np.sqrt(np.dot((self.values - self.mean) ** 2, self.probabilities)))
+
+    def percentile(self, q):
+        position = np.searchsorted(self.cumulative, q / 100 - 1e-12)
+        return int(self.values[min(position, len(self.values) - 1)])
+
+    def percentiles(self, qs=(5, 25, 50, 75, 95)):
+        return {q: self.percentile(q) for q in qs}
+
+    def probability(self, value):
+        found = np.flatnonzero(self.values == value)
+        return float(self.probabilities[found[0]]) if len(found) else 0.0
+
+    def at_least(self, value):
+        return float(self.probabilities[self.values >= value].sum())
+
+    def summary(self):
+        kind = "точно" if self.exact else f"по {self.samples:,} броскам"
+        percentiles = ", ".join(f"{q}%: {value}" for q, value in self.percentiles().items())
+        return f"среднее {self.mean:.2f} ({kind}); {percentiles}"
+
+
+class DiceExpression:
+    def __init__(self, text, terms, constant):
+        self.text = text
+        self.terms = terms
+        self.constant = constant
+
+    def __str__(self):
+        parts = [("-" if term.sign < 0 else "+") + str(term) for term in self.terms]
+        if self.constant:
+            parts.append(f"{self.constant:+d}")
+        return "".join(parts).lstrip("+") or "0"
+
+    def bounds(self):
+        low = high = self.constant
+        for term in self.terms:
+            term_low, term_high = term.bounds()
+            low += term_low
+            high += term_high
+        return low, high
+
+    def dice_count(self):
+        return sum(term.count for term in self.terms)
+
+    # Сумма броска; с size — массив из size независимых бросков
+    def roll(self, size=None, rng=None):
+        rng = rng or np.random.default_rng()
+        count = 1 if size is None else size
+        totals = np.full(count, self.constant, dtype=np.int64)
+        rows = max(1, CHUNK_DICE // max(1, self.dice_count()))
+        for start in range(0, count, rows):
+            stop = min(count, start + rows)
+            for term in self.terms:
+                totals[start:stop] += term.roll(stop - start, rng)
+        return int(totals[0]) if size is None else totals
+
+    def is_exact(self):
+        return all(term.exact_cost() <= MAX_EXACT_COST for term in self.terms)
+
+    # Точное распределение, если исходы можно перебрать, иначе оценка по samples броскам
+    def distribution(self, samples=DEFAULT_SAMPLES, rng=None):
+        if self.is_exact():
+            low, pmf = self.constant, np.ones(1)
+            for term in self.terms:
+                term_low, term_pmf = term.distribution()
+                low += term_low
+                pmf = np.convolve(pmf, term_pmf)
+            values = np.arange(low, low + len(pmf))
+            keep = pmf > 0
+            return Distribution(values[keep], pmf[keep], exact=True)
+        values, counts = np.unique(self.roll(samples, rng), return_counts=True)
+        return Distribution(values, counts / samples, exact=False, samples=samples)
+
+
+@lru_cache(maxsize=256)
+def parse(text):
+    source = text.replace(" ", "").lower()
+    if not source:
+        raise DiceError("Пустое выражение")
+    terms = []
+    constant = 0
+    position = 0
+    while position < len(source):
+        match = TERM.match(source, position)
+        if not match or match.end() == position or (position and not match.group(1)):
+            raise DiceError(f"Не удалось разобрать «{text}» с позиции {position + 1}")
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(6) is not None:
+            constant += sign * int(match.group(6))
+        else:
+            keep = int(match.group(5)) if match.group(5) else None
+            terms.append(DiceTerm(sign, int(match.group(2) or 1), int(match.group(3)), keep, match.group(4) != "kl"))
+        position = match.end()
+    return DiceExpression(text, tuple(terms), constant)
+
+
+def roll(text, size=None, rng=None):
+    return parse(text).roll(size, rng)
+
+
+def distribution(text, samples=DEFAULT_SAMPLES, rng=None):
+    return parse(text).distribution(samples, rng)
@@ -0,0 +1,134 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+from core import CHARACTER_FIELDS, CharacterBuilder
+from metrics import metrics
+from rules import get_catalog
+
+# Черновик создаваемого персонажа: поля заготовки, номер шага мастера и текст имени и описания
+# в том виде, как он набран. Каждое поле — отдельная строка таблицы, поэтому правка описания
+# перезаписывает только описание
+DRAFT_FIELDS = CHARACTER_FIELDS + ("step",)
+
+
+def draft_path(database_path):
+    return os.path.splitext(database_path)[0] + "-draft.db"
+
+
+# Поля, которые отличаются от уже записанных
+def draft_changes(saved, current):
+    return {field: value for field, value in current.items() if field not in saved or saved[field] != value}
+
+
+# Заготовка из черновика; поля, которых нет в черновике, остаются по умолчанию
+def builder_from_draft(fields):
+    builder = CharacterBuilder(**{field: fields[field] for field in CHARACTER_FIELDS if field in fields})
+    return builder.with_name(builder.name).with_description(builder.description)
+
+
+# Шаг, с которого можно продолжить: не дальше первого шага, выбор на котором не сделан
+# или не подходит к нынешнему справочнику правил
+def resumable_step(builder, step, catalog=None):
+    catalog = catalog or get_catalog()
+    done = (
+        builder.race in catalog.races,
+        builder.character_class in catalog.classes,
+        None not in builder.base_stats and sorted(builder.base_stats) == sorted(builder.stat_pool),
+        bool(builder.name),
+    )
+    step = max(0, min(step, len(done)))
+    for position, finished in enumerate(done[:step]):
+        if not finished:
+            return position
+    return step
+
+
+# Черновик стоит предлагать, только если в нём что-то выбрано или набрано
+def is_worth_resuming(fields):
+    return bool(fields.get("race") or fields.get("name") or fields.get("description"))
+
+
+class DraftStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS draft (field TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.commit()
+
+    def load(self):
+        rows = self.connection.execute("SELECT field, value FROM draft").fetchall()
+        return {field: json.loads(value) for field, value in rows if field in DRAFT_FIELDS}
+
+    def write(self, changes, clear=False):
+        with self.connection:
+            if clear:
+                self.connection.execute("DELETE FROM draft")
+            self.connection.executemany(
+                "INSERT INTO draft (field, value) VALUES (?, ?) ON CONFLICT(field) DO UPDATE SET value = excluded.value",
+                [(field, json.dumps(value, ensure_ascii=False)) for field, value in changes.items()],
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+# Запись черновика в фоновом потоке. Изменения, пришедшие, пока поток писал предыдущие,
+# сливаются в одну транзакцию; clear() отменяет всё, что было до него
+class DraftWriter:
+    STOP = object()
+
+    def __init__(self, path):
+        self.path = path
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def update(self, changes):
+        self.requests.put((False, dict(changes)))
+
+    def clear(self):
+        self.requests.put((True, {}))
+
+    # Дописывает очередь и останавливает поток
+    def close(self):
+        if self.thread.is_alive():
+            self.requests.put(self.STOP)
+            self.thread.join()
+
+    def next_batch(self):
+        request = self.requests.get()
+        if request is self.STOP:
+            return None, True
+        clear, changes = request
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                return (clear, changes), False
+            if request is self.STOP:
+                return (clear, changes), True
+            if request[0]:
+                clear, changes = True, {}
+            changes.update(request[1])
+
+    def write_loop(self):
+        store = DraftStore(self.path)
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self.next_batch()
+                if batch is None:
+                    continue
+                try:
+                    with metrics.timed("draft_write"):
+                        store.write(batch[1], clear=batch[0])
+                except sqlite3.Error as error:
+                    print(f"Не удалось сохранить черновик персонажа: {error}")
+        finally:
+            store.close()
+
@@ -0,0 +1,112 @@
+import functools
+from collections import namedtuple
+
+from metrics import metrics
+from rules import EQUIPMENT_CATEGORIES, get_catalog
+
+# Грузоподъёмность по правилам D&D 5e: значение Силы × 15 фунтов
+CARRY_MULTIPLIER = 15
+DEFAULT_BUDGET = 200
+# Вес считается в полуфунтах, цена в медных монетах: так ограничения в DP целочисленные
+WEIGHT_UNITS = 2
+COST_UNITS = 100
+# Ценность предмета: средний урон и прибавка к КД, одно очко КД — как ARMOR_CLASS_VALUE урона.
+# Любой взятый предмет лучше пустой категории
+ARMOR_CLASS_VALUE = 2
+ITEM_VALUE = 1
+
+# Набор снаряжения: предметы по порядку категорий (None — категория пуста), ценность, вес и цена
+Loadout = namedtuple("Loadout", ("items", "value", "weight", "cost"))
+
+
+def carrying_capacity(strength):
+    return strength * CARRY_MULTIPLIER
+
+
+@functools.lru_cache(maxsize=None)
+def damage_mean(damage):
+    if not damage:
+        return 0.0
+    # dice тянет за собой numpy, а loadout импортируется при запуске окна
+    import dice
+    return dice.distribution(damage).mean
+
+
+def item_value(item):
+    return ITEM_VALUE + damage_mean(item.damage) + ARMOR_CLASS_VALUE * item.armor_class
+
+
+def describe_item(item):
+    parts = [f"{item.weight:g} фнт", f"{item.cost:g} зм"]
+    if item.damage:
+        parts.append(f"урон {item.damage}")
+    if item.armor_class:
+        parts.append(f"КД +{item.armor_class}")
+    return ", ".join(parts)
+
+
+def loadout_totals(items, catalog=None):
+    catalog = catalog or get_catalog()
+    chosen = [catalog.item(name) for name in items if name]
+    return sum(item.weight for item in chosen), sum(item.cost for item in chosen)
+
+
+# Лучший набор для класса: по одному предмету или ничего в каждой категории, суммарный вес
+# не больше грузоподъёмности, цена не больше бюджета. fixed — уже выбранные предметы
+# {категория: предмет}, они остаются в наборе. None, если выбранное уже не помещается
+def optimize_loadout(class_name, strength, budget=DEFAULT_BUDGET, fixed=None, catalog=None):
+    fixed = tuple(sorted((fixed or {}).items()))
+    with metrics.timed("loadout_optimize"):
+        return solve_loadout(catalog or get_catalog(), class_name, carrying_capacity(strength), budget, fixed)
+
+
+# Результаты запоминаются: при щелчке по флажку меняется только fixed, и повторные наборы
+# условий (снять и снова поставить флажок) не считаются заново
+@functools.lru_cache(maxsize=4096)
+def solve_loadout(catalog, class_name, capacity, budget, fixed):
+    fixed = dict(fixed)
+    options = []
+    for category in EQUIPMENT_CATEGORIES:
+        names = catalog.equipment(class_name).get(category, ())
+        if fixed.get(category) is not None:
+            names = [fixed[category]]
+            choices = []
+        else:
+            choices = [None]
+        for name in names:
+            item = catalog.item(name)
+            choices.append((name, round(item.weight * WEIGHT_UNITS), round(item.cost * COST_UNITS), item_value(item)))
+        options.append(choices)
+
+    # Многовариантный рюкзак сверху вниз: best(категория, остаток веса, остаток денег).
+    # Из равных по ценности наборов выбирается более лёгкий, затем более дешёвый
+    memo = {}
+
+    def best(position, weight_left, cost_left):
+        if position == len(options):
+            return 0.0, 0, 0, ()
+        key = (position, weight_left, cost_left)
+        if key in memo:
+            return memo[key]
+        result = None
+        for choice in options[position]:
+            if choice is None:
+                name, weight, cost, value = None, 0, 0, 0.0
+            else:
+                name, weight, cost, value = choice
+            if weight > weight_left or cost > cost_left:
+                continue
+            rest = best(position + 1, weight_left - weight, cost_left - cost)
+            if rest is None:
+                continue
+            candidate = (rest[0] + value, rest[1] + weight, rest[2] + cost, (name,) + rest[3])
+            if result is None or (candidate[0], -candidate[1], -candidate[2]) > (result[0], -result[1], -result[2]):
+                result = candidate
+        memo[key] = result
+        return result
+
+    result = best(0, capacity * WEIGHT_UNITS, round(budget * COST_UNITS))
+    if result is None:
+        return None
+    value, weight, cost, items = result
+    return Loadout(items, value, weight / WEIGHT_UNITS, cost / COST_UNITS)
@@ -1,56 +1,183 @@
-import math
 import sys
 import os
 import random
-import pygame
-from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QScrollArea, QDialog,
+import time
+from collections import OrderedDict
+
+from startup import trace as startup_trace
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QScrollArea,
                              QHBoxLayout, QRadioButton, QLineEdit, QTextEdit, QComboBox, QCheckBox,
-                             QListWidget, QGroupBox, QFormLayout, QMessageBox)
-from PyQt5.QtGui import QPixmap, QPalette, QBrush, QIcon
-from PyQt5.QtCore import Qt, QTimer
+                             QListView, QGroupBox, QFormLayout, QMessageBox, QStackedWidget, QButtonGroup,
+                             QSpinBox)
+from PyQt5.QtGui import QPixmap, QPalette, QBrush, QIcon, QImageReader, QPainter, QColor
+from PyQt5.QtCore import (Qt, QTimer, QAbstractListModel, QModelIndex, QObject, QFileSystemWatcher, QThreadPool,
+                          QByteArray, QBuffer, pyqtSignal)
+startup_trace.mark("импорт PyQt5")
+
+from assets import AssetFolder, DEFAULT_PACK, open_assets
+from metrics import metrics
+from backgrounds import BackgroundLoader, BackgroundScaler, ScaledPixmapCache
+from assignment import rank_assignments
+from core import CharacterBuilder, ROLL_METHOD, STANDARD_METHOD, ValidationError, race_bonuses
+from loadout import DEFAULT_BUDGET, carrying_capacity, describe_item, loadout_totals, optimize_loadout
+from drafts import DraftStore, DraftWriter, builder_from_draft, draft_changes, draft_path, is_worth_resuming, \
+    resumable_step
+from rules import EQUIPMENT_CATEGORIES, get_catalog
+from theme import apply_theme, current_theme, initial_theme, next_theme, set_role
+from storage import CharacterStore, CharacterWriter, SheetCache, SheetSyncer, STATS, format_sheet, modifier
+startup_trace.mark("импорт модулей приложения")
 
 # Главное окно приложения
 class MainWindow(QWidget):
-    def __init__(self, image_folder, icon_path, music_folder):
+    RESIZE_SETTLE_DELAY = 150
+
+    # image_folder, icon_path и music_folder — имена внутри assets: пакета ресурсов или папки с файлами
+    def __init__(self, image_folder, icon_path, music_folder, database_path, characters_folder, cache_folder=None,
+                 assets=None, serve_address=None):
         super().__init__()
+        self.assets = assets or AssetFolder()
+        self.database_path = database_path
+        self.draft_path = draft_path(database_path)
+        self.serve_address = serve_address
+        self.roster_service = None
         self.image_folder = image_folder
         self.icon_path = icon_path
         self.music_folder = music_folder
+        self.characters_folder = characters_folder
+        self.cache_folder = cache_folder
+
+        with startup_trace.stage("открытие базы персонажей"):
+            self.character_store = CharacterStore(database_path)
+            self.character_writer = CharacterWriterService(self.character_store, self)
 
         self.current_background = None
+        self.background_path = None
+        self.background_image = None
+        self.background_tasks = []
+        self.scaled_backgrounds = ScaledPixmapCache()
+        # Плавное масштабирование запускается, только когда размер окна перестал меняться
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.timeout.connect(self.scale_background_smoothly)
         self.is_fullscreen = True
         self.is_creating_character = False
         self.is_viewing_characters = False
-
-        self.init_ui()
-        self.init_music()
+        self.is_viewing_analytics = False
+        # Поисковый индекс и столбцы аналитики держат данные в numpy: их модули импортируются
+        # не при запуске, а отложенным этапом и при первом открытии аналитики
+        self.search_index = None
+        self.search_index_signals = SearchIndexSignals(self)
+        self.search_index_signals.ready.connect(self.on_search_index_ready)
+        self.roster_columns = None
+        self.roster_columns_signals = SearchIndexSignals(self)
+        self.roster_columns_signals.ready.connect(self.on_roster_columns_ready)
+
+        # Сначала рисуется меню, остальное поднимается по этапам после первого кадра
+        self.first_frame_painted = False
+        self.deferred_stages = [
+            ("фон", self.set_random_background),
+            ("музыка", self.init_music),
+            ("индекс персонажей", self.init_roster_index),
+            ("поисковый индекс", self.init_search_index),
+        ]
+        if serve_address:
+            self.deferred_stages.append(("HTTP-сервер", self.init_roster_service))
+
+        with startup_trace.stage("создание меню"):
+            self.init_ui()
+
+        if metrics.enabled:
+            self.event_loop_monitor = EventLoopMonitor(self)
+            self.event_loop_monitor.start()
 
     def init_ui(self):
-        self.setWindowIcon(QIcon(self.icon_path))
-        self.set_random_background()
+        self.setWindowIcon(self.load_icon())
         self.create_buttons()
         self.showFullScreen()
         self.setWindowTitle("D&D character creator")
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_frame_painted:
+            self.first_frame_painted = True
+            startup_trace.mark("первый кадр меню")
+            QTimer.singleShot(0, self.run_next_stage)
+
+    def run_next_stage(self):
+        if not self.deferred_stages:
+            startup_trace.finish()
+            return
+        name, start_stage = self.deferred_stages.pop(0)
+        with startup_trace.stage(name):
+            start_stage()
+        # Между этапами Qt успевает обработать события и перерисовать окно
+        QTimer.singleShot(0, self.run_next_stage)
+
+    def init_roster_index(self):
+        self.roster_watcher = RosterWatcher(self.character_store, self.characters_folder, self)
+
+    # Индекс строится в фоновом потоке, о готовности сообщает сигнал в потоке интерфейса
+    def init_search_index(self):
+        from search import SearchIndex
+
+        self.search_index = SearchIndex()
+        self.search_index.attach(self.character_store, self.search_index_signals.ready.emit)
+
+    # Список персонажей для планшетов игроков; сервер работает в своём потоке и читает базу
+    # своими соединениями, поэтому запросы не задерживают интерфейс
+    def init_roster_service(self):
+        from server import RosterService, parse_address
+
+        host, port = parse_address(self.serve_address)
+        service = RosterService(self.database_path, self.search_index, host, port,
+                                store_version=lambda: self.character_store.version)
+        try:
+            host, port = service.start()
+        except OSError as error:
+            print(f"Не удалось запустить HTTP-сервер на {host}:{port}: {error}")
+            return
+        self.roster_service = service
+        print(f"Список персонажей доступен по адресу http://{host}:{port}/characters")
+
+    def on_search_index_ready(self):
+        if hasattr(self, "character_list_widget"):
+            self.character_list_widget.on_search_index_ready()
+
+    # В .ico несколько размеров, QImageReader отдаёт их по очереди
+    def load_icon(self):
+        icon = QIcon()
+        try:
+            data = QByteArray(bytes(self.assets.data(self.icon_path)))
+        except OSError as error:
+            print(f"Не удалось прочитать {self.icon_path}: {error}")
+            return icon
+        buffer = QBuffer(data)
+        reader = QImageReader(buffer)
+        for _ in range(max(1, reader.imageCount())):
+            image = reader.read()
+            if not image.isNull():
+                icon.addPixmap(QPixmap.fromImage(image))
+            if not reader.jumpToNextImage():
+                break
+        return icon
+
     def create_buttons(self):
         self.create_character_button = self.create_button("Создать персонажа", self.show_race_selection)
         self.view_characters_button = self.create_button("Список персонажей", self.show_character_list)
+        self.analytics_button = self.create_button("Аналитика", self.show_analytics)
+        self.theme_button = self.create_button(f"Тема: {current_theme()}", self.switch_theme)
         self.exit_button = self.create_button("Выход", self.close)
 
         button_layout = QVBoxLayout()
         button_layout.addWidget(self.create_character_button)
         button_layout.addWidget(self.view_characters_button)
+        button_layout.addWidget(self.analytics_button)
+        button_layout.addWidget(self.theme_button)
         button_layout.addWidget(self.exit_button)
 
         main_layout = QHBoxLayout()
         main_layout.addLayout(button_layout)
 
-        self.race_selection_widget = QWidget()
-        self.class_selection_widget = QWidget()
-
-        main_layout.addWidget(self.race_selection_widget)
-        main_layout.addWidget(self.class_selection_widget)
-
         self.setLayout(main_layout)
 
     def create_button(self, text, callback):
@@ -59,58 +186,120 @@ class MainWindow(QWidget):
         button.clicked.connect(callback)
         return button
 
+    # Следующая тема по кругу, сразу во всех открытых окнах
+    def switch_theme(self):
+        with metrics.timed("theme_switch"):
+            name = apply_theme(next_theme(current_theme()))
+        self.theme_button.setText(f"Тема: {name}")
+
     def set_random_background(self):
-        images = [f for f in os.listdir(self.image_folder) if os.path.isfile(os.path.join(self.image_folder, f))]
+        images = self.assets.files(self.image_folder)
         if not images:
             raise Exception("No images found in the specified directory.")
-        random_image_path = os.path.join(self.image_folder, random.choice(images))
-        self.current_background = QPixmap(random_image_path)
+        loader = BackgroundLoader(self.assets, random.choice(images))
+        loader.signals.loaded.connect(self.on_background_loaded)
+        self.start_background_task(loader)
+
+    def start_background_task(self, task):
+        # Ссылка держится до конца задачи, иначе объект сигналов удалится раньше времени
+        self.background_tasks.append(task)
+        QThreadPool.globalInstance().start(task)
+
+    def finish_background_task(self):
+        self.background_tasks = [task for task in self.background_tasks if task.signals is not self.sender()]
+
+    def on_background_loaded(self, path, image):
+        self.finish_background_task()
+        if image.isNull():
+            return
+        self.background_path = path
+        self.background_image = image
+        self.current_background = QPixmap.fromImage(image)
         self.update_background()
 
+    @metrics.timed("background_rescale")
     def update_background(self):
-        if self.current_background:
-            scaled_pixmap = self.current_background.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
-            palette = QPalette()
-            palette.setBrush(QPalette.Background, QBrush(scaled_pixmap))
-            self.setPalette(palette)
+        if not self.current_background:
+            return
+        cached = self.scaled_backgrounds.get(self.background_path, self.size())
+        if cached is not None:
+            self.resize_timer.stop()
+            self.apply_background(cached)
+            return
+        # Пока окно меняет размер, показываем быстрый черновой вариант
+        self.apply_background(
+            self.current_background.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.FastTransformation)
+        )
+        self.resize_timer.start(self.RESIZE_SETTLE_DELAY)
+
+    def scale_background_smoothly(self):
+        scaler = BackgroundScaler(self.assets, self.background_path, self.background_image, self.size(), self.cache_folder)
+        scaler.signals.scaled.connect(self.on_background_scaled)
+        self.start_background_task(scaler)
+
+    def on_background_scaled(self, path, size, image):
+        self.finish_background_task()
+        if image.isNull() or path != self.background_path:
+            return
+        pixmap = QPixmap.fromImage(image)
+        self.scaled_backgrounds.put(path, size, pixmap)
+        if size == self.size():
+            self.apply_background(pixmap)
+
+    def apply_background(self, pixmap):
+        palette = QPalette()
+        palette.setBrush(QPalette.Background, QBrush(pixmap))
+        self.setPalette(palette)
 
     def show_race_selection(self):
-        if not self.is_creating_character and not self.is_viewing_characters:
+        if not self.is_creating_character and not self.is_viewing_characters and not self.is_viewing_analytics:
             self.is_creating_character = True
             self.is_viewing_characters = False
             self.hide_widget_if_exists("character_list_widget")
-            self.race_selection_widget = RaceSelectionWidget(self)
-            self.layout().addWidget(self.race_selection_widget)
-            self.race_selection_widget.show()
+            if not hasattr(self, "creation_wizard"):
+                with metrics.timed("window_construction", window="CharacterCreationWizard"):
+                    self.creation_wizard = CharacterCreationWizard(self)
+                self.layout().addWidget(self.creation_wizard)
+            self.creation_wizard.start()
 
     def show_character_list(self):
-        if not self.is_viewing_characters and not self.is_creating_character:
+        if not self.is_viewing_characters and not self.is_creating_character and not self.is_viewing_analytics:
             self.is_viewing_characters = True
             self.is_creating_character = False
-            self.hide_widget_if_exists("race_selection_widget")
-            self.character_list_widget = CharacterListWidget(self)
-            self.layout().addWidget(self.character_list_widget)
+            self.hide_widget_if_exists("creation_wizard")
+            if hasattr(self, "character_list_widget"):
+                self.character_list_widget.refresh()
+            else:
+                with metrics.timed("window_construction", window="CharacterListWidget"):
+                    self.character_list_widget = CharacterListWidget(self)
+                self.layout().addWidget(self.character_list_widget)
             self.character_list_widget.show()
 
+    def show_analytics(self):
+        if self.is_viewing_analytics or self.is_creating_character or self.is_viewing_characters:
+            return
+        self.is_viewing_analytics = True
+        # Столбцы для аналитики строятся при первом открытии окна аналитики
+        if self.roster_columns is None:
+            from analytics import RosterColumns
+
+            self.roster_columns = RosterColumns()
+            self.roster_columns.attach(self.character_store, self.roster_columns_signals.ready.emit)
+        if not hasattr(self, "analytics_widget"):
+            with metrics.timed("window_construction", window="AnalyticsWidget"):
+                self.analytics_widget = AnalyticsWidget(self)
+            self.layout().addWidget(self.analytics_widget)
+        self.analytics_widget.refresh()
+        self.analytics_widget.show()
+
+    def on_roster_columns_ready(self):
+        if hasattr(self, "analytics_widget") and self.analytics_widget.isVisible():
+            self.analytics_widget.refresh()
+
     def hide_widget_if_exists(self, widget_name):
         if hasattr(self, widget_name):
             getattr(self, widget_name).hide()
 
-    def show_equipment_selection(self, description_window):
-        self.equipment_selection_widget = EquipmentSelectionWidget(description_window)
-        self.layout().addWidget(self.equipment_selection_widget)
-        self.equipment_selection_widget.show()
-
-    def show_stat_selection(self, class_selection_widget, selected_race, race_bonuses):
-        self.stat_selection_widget = StatSelectionWidget(self, class_selection_widget, selected_race, race_bonuses)
-        self.layout().addWidget(self.stat_selection_widget)
-        self.stat_selection_widget.show()
-
-    def show_character_description(self, selected_race, stat_selection_widget):
-        self.character_description_widget = CharacterDescriptionWidget(self, selected_race, stat_selection_widget)
-        self.layout().addWidget(self.character_description_widget)
-        self.character_description_widget.show()
-
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_F10:
             if self.is_fullscreen:
@@ -124,95 +313,310 @@ class MainWindow(QWidget):
         self.update_background()
         super().resizeEvent(event)
 
+    # Перед выходом дописываются все изменения из очереди
+    def closeEvent(self, event):
+        if self.roster_service:
+            self.roster_service.stop()
+        if hasattr(self, "creation_wizard"):
+            self.creation_wizard.close_drafts()
+        if hasattr(self, "roster_watcher"):
+            self.roster_watcher.close()
+        self.character_writer.close()
+        super().closeEvent(event)
+
     def init_music(self):
-        pygame.display.init()
-        pygame.mixer.init()
+        # pygame импортируется только здесь: он заметно замедляет запуск
+        with startup_trace.stage("импорт pygame"):
+            from music import MusicPlayer
+        self.music_player = MusicPlayer(self.assets, self.music_folder, parent=self)
+        self.music_player.start()
 
-        self.music_files = [f for f in os.listdir(self.music_folder)if os.path.isfile(os.path.join(self.music_folder, f))]
-        if not self.music_files:
-            raise Exception("No music files found in the specified directory.")
-        self.play_random_music()
 
-    def play_random_music(self):
-        random_music_path = os.path.join(
-            self.music_folder, random.choice(self.music_files)
-        )
-        pygame.mixer.music.load(random_music_path)
-        pygame.mixer.music.play()
-        pygame.mixer.music.set_volume(0.1)
-        pygame.mixer.music.set_endevent(pygame.USEREVENT)
-        self.music_timer = QTimer(self)
-        self.music_timer.timeout.connect(self.check_music_end)
-        self.music_timer.start(1000)
+class SearchIndexSignals(QObject):
+    ready = pyqtSignal()
 
-    def check_music_end(self):
-        for event in pygame.event.get():
-            if event.type == pygame.USEREVENT:
-                self.play_random_music()
 
+# Запись персонажей без блокировки интерфейса. Итог каждой пачки приходит сигналом written
+# в поток интерфейса; перед ним подписчики хранилища (список, поисковый индекс) узнают об изменениях
+class CharacterWriterService(QObject):
+    written = pyqtSignal(object)
+    batch_written = pyqtSignal(object)
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.batch_written.connect(self.on_batch_written)
+        self.writer = CharacterWriter(store.path, self.batch_written.emit)
+
+    def save(self, character):
+        return self.writer.save(character)
+
+    def delete(self, name):
+        return self.writer.delete(name)
+
+    def close(self):
+        self.writer.close()
+        QApplication.sendPostedEvents(self)
+
+    def on_batch_written(self, batch):
+        if batch.error:
+            print(f"Не удалось записать персонажей: {batch.error}")
+        else:
+            self.store.notify(batch.saved, batch.deleted)
+        self.written.emit(batch)
+
+
+# Задержка цикла событий: таймер ждёт INTERVAL мс, а всё, на что он сработал позже, —
+# время, когда поток интерфейса был занят и не обрабатывал ввод и перерисовку
+class EventLoopMonitor(QObject):
+    INTERVAL = 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.expected = None
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.on_timeout)
+
+    def start(self):
+        self.expected = time.perf_counter() + self.INTERVAL / 1000
+        self.timer.start(self.INTERVAL)
+
+    def stop(self):
+        self.timer.stop()
+
+    def on_timeout(self):
+        now = time.perf_counter()
+        metrics.observe("event_loop_lag", max(0.0, now - self.expected))
+        self.expected = now + self.INTERVAL / 1000
+
+
+# Слежение за папкой листов: новые и изменённые .txt попадают в базу без полного пересканирования.
+# Если QFileSystemWatcher не может следить за папкой, сравнивается время изменения папки по таймеру.
+# Сверка идёт в фоновом потоке, имена добавленных персонажей приходят сигналом synced
+class RosterWatcher(QObject):
+    SYNC_DELAY = 300
+    POLL_INTERVAL = 5000
+    # Столько имён за раз получают подписчики хранилища; между порциями Qt перерисовывает окно
+    NOTIFY_CHUNK = 500
+    synced = pyqtSignal(object)
+
+    def __init__(self, store, folder, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.pending_names = []
+        self.notify_timer = QTimer(self)
+        self.notify_timer.setInterval(0)
+        self.notify_timer.timeout.connect(self.notify_next_chunk)
+        self.synced.connect(self.on_synced)
+        self.syncer = SheetSyncer(store.path, folder, self.synced.emit)
+
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.timeout.connect(self.sync)
+
+        self.folder_mtime = None
+        self.watcher = QFileSystemWatcher(self)
+        if self.watcher.addPath(folder):
+            self.watcher.directoryChanged.connect(self.schedule_sync)
+        else:
+            self.poll_timer = QTimer(self)
+            self.poll_timer.timeout.connect(self.check_folder_mtime)
+            self.poll_timer.start(self.POLL_INTERVAL)
+        self.sync()
+
+    def schedule_sync(self):
+        # Пачка изменений от другой программы сводится в одну сверку
+        self.sync_timer.start(self.SYNC_DELAY)
+
+    def check_folder_mtime(self):
+        try:
+            folder_mtime = os.stat(self.folder).st_mtime
+        except OSError:
+            return
+        if folder_mtime != self.folder_mtime:
+            self.schedule_sync()
+
+    def sync(self):
+        try:
+            self.folder_mtime = os.stat(self.folder).st_mtime
+        except OSError:
+            return
+        self.syncer.request()
+
+    # Персонажи уже в базе; подписчики хранилища интерфейса (список, индексы) узнают о них
+    # порциями, чтобы первый импорт большой папки не останавливал интерфейс
+    def on_synced(self, names):
+        self.pending_names.extend(names)
+        if not self.notify_timer.isActive():
+            self.notify_timer.start()
+
+    def notify_next_chunk(self):
+        chunk = self.pending_names[:self.NOTIFY_CHUNK]
+        del self.pending_names[:self.NOTIFY_CHUNK]
+        if not self.pending_names:
+            self.notify_timer.stop()
+        if chunk:
+            self.store.notify(chunk, [])
+
+    def close(self):
+        self.syncer.close()
+        QApplication.sendPostedEvents(self)
+
+
+# Мастер создания персонажа: страницы создаются один раз и сбрасываются при каждом проходе.
+# Переход вперёд сбрасывает страницу и показывает подсказку, переход назад сохраняет выбор
+class CharacterCreationWizard(QStackedWidget):
+    DRAFT_DELAY = 500
 
-# Окно выбора расы
-class RaceSelectionWidget(QWidget):
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
-        self.selected_race = None
-        self.race_bonuses = {}
-        self.races = {
-            "Человек": {
-                "description": "Раса людей не придерживается какого-то одного ремесла, поэтому им легко в любых начинаниях",
-                "features": "Дополнительный бонус +1 ко всем характеристикам.",
-                "bonuses": {"Сила": 1,"Ловкость": 1,"Телосложение": 1,"Интеллект": 1,"Мудрость": 1,"Харизма": 1,},
-            },
-            "Драконорождённый": {
-                "description": "Мистическая раса, чьё происхождение так и не было до конца раскрыто",
-                "features": "Наследие дракона (Сопротивление стихии и драконье дыхание своего родителя)",
-                "bonuses": {"Сила": 2, "Харизма": 1},
-            },
-            "Эльф": {
-                "description": "Адепты лесной магии и природы. Они проворны, мудры и красноречивы",
-                "features": "Темновидение, защита от очарования, магическая способность.",
-                "bonuses": {"Ловкость": 2},
-            },
-            "Тифлинг": {
-                "description": "По большей части раса людей, в чьих жилах крепко накрепко засела дьявольская кровь",
-                "features": "Темновидение, сопротивление огню, дьявольское наследие (мелкое колдовство).",
-                "bonuses": {"Интеллект": 1, "Харизма": 2},
-            },
-            "Дварф": {
-                "description": "Горный народ, известный своей жадностью, огромным волосяным покровом и грубой силой",
-                "features": "Темновидение, стойкость, устойчивость к ядам.",
-                "bonuses": {"Телосложение": 2},
-            },
-            "Халфлинг": {
-                "description": "Полурослики, чей род часто тратит своё свободное время на отдых и безделье. По характеру чем-то похожи на известных хоббитов",
-                "features": "Темновидение, защита от испуга, ловкость рук.",
-                "bonuses": {"Ловкость": 2},
-            },
-            "Гном": {
-                "description": "Не путайте их с Дварфами. В отличие от них, Гномы живут на лугах и лесах, предпочитая грубой силе умственную работу",
-                "features": "Темновидение, сопротивление магии, гномья хитрость.",
-                "bonuses": {"Интеллект": 2},
-            },
-            "Полуэльф": {
-                "description": "Полуэльфы — это смесь эльфов и людей. Они совмещают в себе магические силы и способности к адаптации, которые используют для жизни среди людей",
-                "features": "Темновидение, устойчивость к очарованию, дополнительное мастерство.",
-                "bonuses": {"Ловкость": 1, "Харизма": 2},
-            },
-            "Полуорк": {
-                "description": "Сила и умение выживать унаследована от орков, а по происхождению являются смесью людей и орков",
-                "features": "Темновидение, ярость, сила зверя.",
-                "bonuses": {"Сила": 2, "Телосложение": 1},
-            },
-            "Тёмный эльф": {
-                "description": "Эльфы, чьё происхождение отличается от лесных. Их далекие предки были тесно связаны с силами зла",
-                "features": "Темновидение, устойчивость к огню, магическая способность.",
-                "bonuses": {"Ловкость": 1, "Интеллект": 1, "Харизма": 1},
-            },
+        # Черновик пишется в фоновом потоке через DRAFT_DELAY мс после последней правки;
+        # saved_draft — то, что уже отдано на запись, с ним сравнивается следующий снимок
+        self.draft_timer = QTimer(self)
+        self.draft_timer.setSingleShot(True)
+        self.draft_timer.setInterval(self.DRAFT_DELAY)
+        self.draft_timer.timeout.connect(self.save_draft)
+        self.draft_writer = DraftWriter(parent.draft_path)
+        with metrics.timed("draft_load"):
+            draft_store = DraftStore(parent.draft_path)
+            self.saved_draft = draft_store.load()
+            draft_store.close()
+        # Всё состояние создаваемого персонажа; страницы только показывают и меняют его
+        self.character_builder = CharacterBuilder()
+        self.steps = [
+            self.create_page(RaceSelectionWidget),
+            self.create_page(ClassSelectionWidget),
+            self.create_page(StatSelectionWidget),
+            self.create_page(CharacterDescriptionWidget),
+            self.create_page(EquipmentSelectionWidget),
+        ]
+        self.race_page, self.class_page, self.stat_page, self.description_page, self.equipment_page = self.steps
+        for page in self.steps:
+            self.addWidget(page)
+        self.description_page.name_edit.textChanged.connect(self.schedule_draft)
+        self.description_page.description_edit.textChanged.connect(self.schedule_draft)
+        self.currentChanged.connect(self.schedule_draft)
+
+    # Любая замена заготовки — правка черновика
+    @property
+    def builder(self):
+        return self.character_builder
+
+    @builder.setter
+    def builder(self, builder):
+        self.character_builder = builder
+        self.schedule_draft()
+
+    def create_page(self, page_class):
+        with metrics.timed("wizard_page_construction", page=page_class.__name__):
+            return page_class(self)
+
+    # Незаконченного персонажа, брошенного кнопкой «Выход» или оставшегося после сбоя, можно продолжить
+    def start(self):
+        if is_worth_resuming(self.saved_draft) and QMessageBox.question(
+            self, "Черновик", "Продолжить создание незаконченного персонажа?", QMessageBox.Yes | QMessageBox.No
+        ) == QMessageBox.Yes:
+            self.restore_draft(self.saved_draft)
+            self.show()
+            return
+        self.discard_draft()
+        self.builder = CharacterBuilder()
+        self.description_page.reset()
+        self.go_forward(0)
+        self.show()
+
+    # Страницы до сохранённого шага показывают выбор из черновика, подсказки не появляются
+    def restore_draft(self, fields):
+        with metrics.timed("draft_restore"):
+            self.builder = builder_from_draft(fields)
+            step = resumable_step(self.builder, fields.get("step", 0))
+            self.description_page.name_edit.setText(fields.get("name", ""))
+            self.description_page.description_edit.setPlainText(fields.get("description", ""))
+            for page in self.steps[:step + 1]:
+                page.restore()
+            self.setCurrentWidget(self.steps[step])
+
+    # Снимок состояния мастера; имя и описание — как они набраны, даже до перехода к следующему шагу
+    def draft_state(self):
+        state = {
+            field: list(value) if isinstance(value, tuple) else value
+            for field, value in self.builder._asdict().items()
         }
+        state["name"] = self.description_page.name_edit.text()
+        state["description"] = self.description_page.description_edit.toPlainText()
+        state["step"] = self.currentIndex()
+        return state
+
+    def schedule_draft(self, *args):
+        self.draft_timer.start()
+
+    def save_draft(self):
+        self.draft_timer.stop()
+        changes = draft_changes(self.saved_draft, self.draft_state())
+        if changes:
+            self.saved_draft.update(changes)
+            self.draft_writer.update(changes)
+
+    def discard_draft(self):
+        self.draft_timer.stop()
+        if self.saved_draft:
+            self.saved_draft = {}
+            self.draft_writer.clear()
+
+    def close_drafts(self):
+        if self.parent.is_creating_character:
+            self.save_draft()
+        self.draft_timer.stop()
+        self.draft_writer.close()
+
+    # Подсказка модальная и ждёт пользователя, поэтому замеряется отдельно от перехода
+    def go_forward(self, step):
+        page = self.steps[step]
+        with metrics.timed("wizard_transition", page=type(page).__name__, direction="forward"):
+            page.reset()
+            self.setCurrentWidget(page)
+        with metrics.timed("wizard_hint_dialog", page=type(page).__name__):
+            QMessageBox.information(page, page.HINT_TITLE, page.HINT_TEXT)
+
+    def next_step(self):
+        self.go_forward(self.currentIndex() + 1)
+
+    def previous_step(self):
+        page = self.steps[self.currentIndex() - 1]
+        with metrics.timed("wizard_transition", page=type(page).__name__, direction="back"):
+            self.setCurrentWidget(page)
+
+    # Черновик сохраняется сразу, не дожидаясь таймера
+    def cancel(self):
+        self.save_draft()
+        self.hide()
+        self.parent.is_creating_character = False
+
+    def finish(self):
+        self.discard_draft()
+        self.hide()
+        self.parent.is_creating_character = False
+
+
+# Окно выбора расы
+class RaceSelectionWidget(QWidget):
+    HINT_TITLE = "Раса"
+    HINT_TEXT = "Выберите расу персонажа"
+
+    def __init__(self, wizard):
+        super().__init__(wizard)
+        self.wizard = wizard
+        self.races = get_catalog().races
+        self.race_buttons = QButtonGroup(self)
         self.init_ui()
 
     def init_ui(self):
+        set_role(self, "page")
         self.scroll_area = QScrollArea(self)
         self.scroll_area.setWidgetResizable(True)
         self.widget = QWidget()
@@ -223,48 +627,50 @@ class RaceSelectionWidget(QWidget):
         self.exit_button = QPushButton("Выход", self)
         self.next_button.setEnabled(False)
         self.next_button.clicked.connect(self.proceed_to_next_step)
-        self.exit_button.clicked.connect(self.close)
+        self.exit_button.clicked.connect(self.wizard.cancel)
 
         main_layout = QVBoxLayout()
         main_layout.addWidget(self.scroll_area)
         main_layout.addWidget(self.next_button)
         main_layout.addWidget(self.exit_button)
-        self.setStyleSheet("background-style:white;")
         self.setLayout(main_layout)
-        QMessageBox.information(self, "Раса", "Выберите расу персонажа")
+
+    def reset(self):
+        uncheck_buttons(self.race_buttons)
+        self.next_button.setEnabled(False)
+        self.scroll_area.verticalScrollBar().setValue(0)
+
+    def restore(self):
+        check_button(self.race_buttons, self.wizard.builder.race)
+        self.next_button.setEnabled(self.wizard.builder.race is not None)
 
     def update_scroll_area(self):
         self.widget.setLayout(self.layout)
         self.scroll_area.setWidget(self.widget)
 
-    def select_race(self, race_name, bonuses):
-        self.selected_race = race_name
-        self.race_bonuses = bonuses
+    def select_race(self, race_name):
+        self.wizard.builder = self.wizard.builder.with_race(race_name)
         self.next_button.setEnabled(True)
 
-    def close(self):
-        self.parent.is_creating_character = False
-        super().close()
-
     def display_races(self):
-        for race_name, race_info in self.races.items():
-            self.create_race_option(race_name, race_info)
-        self.setStyleSheet("font-size: 16px;")
+        for race in self.races.values():
+            self.create_race_option(race)
         self.update_scroll_area()
 
-    def create_race_option(self, race_name, race_info):
-        race_radio_button = QRadioButton(race_name)
+    def create_race_option(self, race):
+        race_radio_button = QRadioButton(race.name)
         race_radio_button.clicked.connect(
-            lambda _, rn=race_name, rb=race_info["bonuses"]: self.select_race(rn, rb)
+            lambda _, rn=race.name: self.select_race(rn)
         )
+        self.race_buttons.addButton(race_radio_button)
         self.layout.addWidget(race_radio_button)
 
-        description_label = QLabel(race_info["description"])
-        features_label = QLabel("Особенности расы: " + race_info["features"])
+        description_label = QLabel(race.description)
+        features_label = QLabel("Особенности расы: " + race.features)
         bonuses_label = QLabel(
             "Дополнительные бонусы: "
             + ", ".join(
-                f"{key} +{value}" for key, value in race_info["bonuses"].items()
+                f"{key} +{value}" for key, value in race.bonuses
             )
         )
 
@@ -273,25 +679,22 @@ class RaceSelectionWidget(QWidget):
         self.layout.addWidget(bonuses_label)
 
     def proceed_to_next_step(self):
-        self.class_selection_widget = ClassSelectionWidget(
-            self.parent, self.selected_race, self.race_bonuses
-        )
-        self.class_selection_widget.show()
-        self.parent.layout().addWidget(self.class_selection_widget)
-        self.hide()
+        self.wizard.next_step()
 
 
 # Окно выбора класса
 class ClassSelectionWidget(QWidget):
-    def __init__(self, parent, selected_race, race_bonuses):
-        super().__init__(parent)
-        self.parent = parent
-        self.selected_class = None
-        self.selected_race = selected_race
-        self.race_bonuses = race_bonuses
+    HINT_TITLE = "Класс"
+    HINT_TEXT = "Выберите класс персонажа"
+
+    def __init__(self, wizard):
+        super().__init__(wizard)
+        self.wizard = wizard
+        self.class_buttons = QButtonGroup(self)
         self.init_ui()
 
     def init_ui(self):
+        set_role(self, "page")
         self.scroll_area = QScrollArea(self)
         self.scroll_area.setWidgetResizable(True)
         self.widget = QWidget()
@@ -308,37 +711,29 @@ class ClassSelectionWidget(QWidget):
         main_layout.addWidget(self.scroll_area)
         main_layout.addWidget(self.next_button)
         main_layout.addWidget(self.back_button)
-        self.setStyleSheet("background-style:white;")
         self.setLayout(main_layout)
-        QMessageBox.information(self, "Класс", "Выберите класс персонажа")
+
+    def reset(self):
+        self.wizard.builder = self.wizard.builder.with_class(None)
+        uncheck_buttons(self.class_buttons)
+        self.next_button.setEnabled(False)
+        self.scroll_area.verticalScrollBar().setValue(0)
+
+    def restore(self):
+        check_button(self.class_buttons, self.wizard.builder.character_class)
+        self.next_button.setEnabled(self.wizard.builder.character_class is not None)
 
     def update_scroll_area(self):
         self.widget.setLayout(self.layout)
         self.scroll_area.setWidget(self.widget)
 
     def select_class(self, class_name):
-        self.selected_class = class_name
+        self.wizard.builder = self.wizard.builder.with_class(class_name)
         self.next_button.setEnabled(True)
 
     def display_classes(self):
-        classes = {
-            "Бард": "Неважно, кем является бард: учёным, скальдом или проходимцем; он плетёт магию из слов и музыки, вдохновляя союзников, деморализуя противников, манипулируя сознанием, создавая иллюзии, и даже исцеляя раны.",
-            "Варвар": "Несмотря на разнообразие, всех варваров объединяет одно — их ярость. Необузданный, неугасимый и бездумный гнев. Не просто эмоция, их ярость как свирепость загнанного в угол хищника, как безжалостный удар урагана, как штормовые валы океана.",
-            "Воин": "Странствующие рыцари, военачальники-завоеватели, королевские чемпионы, элитная пехота, бронированные наёмники и короли разбоя — будучи воинами, все они мастерски владеют оружием, доспехами, и приёмами ведения боя.",
-            "Волшебник": "Волшебники — адепты высшей магии, объединяющиеся по типу своих заклинаний. Опираясь на тонкие плетения магии, пронизывающей вселенную, волшебники способны создавать заклинания взрывного огня, искрящихся молний, тонкого обмана и грубого контроля над сознанием.",
-            "Друид": "Призывая стихии или подражая животным, друиды воплощают незыблемость, приспособляемость и гнев природы. Они ни в коем случае не владыки природы — вместо этого друиды ощущают себя частью её неодолимой воли.",
-            "Жрец": "Жрецы являются посредниками между миром смертных и далёкими мирами богов. Настолько же разные, насколько боги, которым они служат, жрецы воплощают работу своих божеств.",
-            "Изобретатель": "Изобретатели — величайшие мастера пробуждать магию в обычных предметах. Они рассматривают магию как сложную систему, которую следует расшифровать и применять в заклинаниях и изобретениях.",
-            "Колдун": "Колдуны — искатели знаний, что скрываются в ткани мультивселенной. Через договор, заключённый с таинственными существами сверхъестественной силы, колдуны открывают для себя магические эффекты, как едва уловимые, так и впечатляющие воображение.",
-            "Монах": "Вне зависимости от выбранной дисциплины, всех монахов объединяет одно — возможность управлять энергией, текущей в их телах. Вне зависимости от того, проявляется ли она выдающимися боевыми способностями, или чуть заметным усилением защиты и скорости, эта энергия влияет на всё, что делает монах.",
-            "Паладин": "Вне зависимости от происхождения и миссии, паладинов объединяет их клятва противостоять силам зла. Принесённая ли перед алтарём бога и заверенная священником, или же на священной поляне перед духами природы и феями, или в момент отчаяния и горя смерти, присяга паладина — могущественный договор.",
-            "Плут": "Плуты полагаются на мастерство, скрытность и уязвимые места врагов, чтобы взять верх в любой ситуации. У них достаточно сноровки для нахождения решения в любой ситуации, демонстрируя находчивость и гибкость, которые являются краеугольным камнем любой успешной группы искателей приключений.",
-            "Следопыт": "Вдали от суеты городов и посёлков, за изгородями, которые защищают самые далёкие фермы от ужасов дикой природы, среди плотно стоящих деревьев, беспутья лесов и на просторах необъятных равнин следопыты несут свой бесконечный дозор.",
-            "Чародей": "Чародеи являются носителями магии, дарованной им при рождении их экзотической родословной, неким потусторонним влиянием или воздействием неизвестных вселенских сил. Никто не может обучиться чародейству, как, например, выучить язык, так же как никто не может обучить, как прожить легендарную жизнь.",
-        }
-        for class_name, class_description in classes.items():
-            self.create_class_option(class_name, class_description)
-        self.setStyleSheet("font-size: 16px;")
+        for character_class in get_catalog().classes.values():
+            self.create_class_option(character_class.name, character_class.description)
         self.update_scroll_area()
 
     def create_class_option(self, class_name, class_description):
@@ -346,81 +741,94 @@ class ClassSelectionWidget(QWidget):
         class_radio_button.clicked.connect(
             lambda _, cn=class_name: self.select_class(cn)
         )
+        self.class_buttons.addButton(class_radio_button)
         self.layout.addWidget(class_radio_button)
         self.layout.addWidget(QLabel(class_description))
 
     def proceed_to_next_step(self):
-        self.parent.show_stat_selection(self, self.selected_race, self.race_bonuses)
-        self.hide()
+        self.wizard.next_step()
 
     def return_to_previous_step(self):
-        self.parent.race_selection_widget.show()
-        self.hide()
+        self.wizard.previous_step()
 
 
 # Окно распределения характеристик
 class StatSelectionWidget(QWidget):
-    def __init__(self, parent, class_selection_widget, selected_race, race_bonuses):
-        super().__init__(parent)
-        self.parent = parent
-        self.class_selection_widget = class_selection_widget
-        self.selected_race = selected_race
-        self.stats = {
-            "Сила": 0,
-            "Ловкость": 0,
-            "Телосложение": 0,
-            "Интеллект": 0,
-            "Мудрость": 0,
-            "Харизма": 0,
-        }
-        self.selected_values = {}
-        self.race_bonuses = race_bonuses
+    HINT_TITLE = "Характеристики"
+    HINT_TEXT = "Распределите характеристики персонажа"
+    STAT_METHODS = {
+        "Стандартный набор": STANDARD_METHOD,
+        "Бросок 4d6, меньший кубик отбрасывается": ROLL_METHOD,
+    }
+
+    def __init__(self, wizard):
+        super().__init__(wizard)
+        self.wizard = wizard
+        self.stats = {stat: 0 for stat in STATS}
+        # Характеристика -> номер значения в наборе: выброшенные значения могут повторяться
+        self.selected_slots = {}
+        self.race_bonuses = {}
+        self.suggestion = None
         self.init_ui()
 
     def init_ui(self):
+        set_role(self, "page")
         self.layout = QVBoxLayout()
         self.stat_comboboxes = {}
+        self.race_bonus_labels = {}
         self.final_stat_labels = {}
 
         inner_widget = QWidget()
         inner_layout = QVBoxLayout(inner_widget)
         inner_widget.setLayout(inner_layout)
-        inner_widget.setStyleSheet("background-color: white;")
-
-        for stat, bonus in self.race_bonuses.items():
-            self.stats[stat] += bonus
-
-        stat_distribution_label = QLabel(
-            "Стандартное распределение характеристик: 15, 14, 13, 12, 10, 8")
+        set_role(inner_widget, "panel")
+
+        method_layout = QHBoxLayout()
+        self.method_combobox = QComboBox()
+        self.method_combobox.addItems(self.STAT_METHODS.keys())
+        self.method_combobox.currentTextChanged.connect(self.change_stat_method)
+        self.roll_button = QPushButton("Бросить кубики", self)
+        self.roll_button.clicked.connect(self.reroll_stats)
+        method_layout.addWidget(self.method_combobox)
+        method_layout.addWidget(self.roll_button)
+        inner_layout.addLayout(method_layout)
+
+        self.stat_distribution_label = QLabel()
+        self.odds_label = QLabel()
+        self.odds_label.setWordWrap(True)
         stat_distribution_label_2=QLabel("Совет: Чем выше модификатор(значение в скобках), тем лучше вы будете справляться с проверками характеристик")
-        inner_layout.addWidget(stat_distribution_label)
+        inner_layout.addWidget(self.stat_distribution_label)
+        inner_layout.addWidget(self.odds_label)
         inner_layout.addWidget(stat_distribution_label_2)
 
         for stat in self.stats.keys():
             h_layout = QHBoxLayout()
-            stat_label = QLabel(
-                f"{stat} (бонус от расы: +{self.race_bonuses.get(stat, 0)})"
-            )
+            stat_label = QLabel()
+            self.race_bonus_labels[stat] = stat_label
             stat_combobox = QComboBox()
-            stat_combobox.addItems(["15", "14", "13", "12", "10", "8", "0"])
-            stat_combobox.setCurrentIndex(6)
             stat_combobox.currentIndexChanged.connect(
                 lambda _, s=stat, cb=stat_combobox: self.update_stat(
-                    s, cb.currentText()
+                    s, cb.currentData()
                 )
             )
             h_layout.addWidget(stat_label)
             h_layout.addWidget(stat_combobox)
             self.stat_comboboxes[stat] = stat_combobox
 
-            final_stat_label = QLabel(
-                f"Итоговое значение и модификатор: {self.stats[stat]} ({math.floor((self.stats[stat] - 10) / 2)})"
-            )
+            final_stat_label = QLabel()
             self.final_stat_labels[stat] = final_stat_label
             h_layout.addWidget(final_stat_label)
 
             inner_layout.addLayout(h_layout)
 
+        # Лучшее распределение для расы и класса с учётом уже выбранных значений
+        self.suggestion_label = QLabel()
+        self.suggestion_label.setWordWrap(True)
+        self.suggest_button = QPushButton("Распределить автоматически", self)
+        self.suggest_button.clicked.connect(self.apply_suggestion)
+        inner_layout.addWidget(self.suggestion_label)
+        inner_layout.addWidget(self.suggest_button)
+
         self.next_button = QPushButton("Далее", self)
         self.back_button = QPushButton("Назад", self)
         self.next_button.setEnabled(False)
@@ -435,78 +843,173 @@ class StatSelectionWidget(QWidget):
         self.scroll_area.setWidget(inner_widget)
 
         self.layout.addWidget(self.scroll_area)
-        self.setStyleSheet("font-size: 16px;")
         self.setLayout(self.layout)
-        QMessageBox.information(
-            self, "Характеристики", "Распределите характеристики персонажа"
+
+    # Способ и выброшенные значения хранятся в заготовке, поэтому при возврате на шаг не перебрасываются
+    def reset(self):
+        self.wizard.builder = self.wizard.builder.with_stats({})
+        self.show_method()
+        self.show_pool()
+
+    # Набор из черновика не перебрасывается, распределённые значения возвращаются на места
+    def restore(self):
+        values = dict(zip(STATS, self.wizard.builder.base_stats))
+        self.show_method()
+        self.show_pool()
+        self.select_values(values)
+
+    def show_method(self):
+        self.race_bonuses = race_bonuses(self.wizard.builder.race)
+        for stat in STATS:
+            self.race_bonus_labels[stat].setText(
+                f"{stat} (бонус от расы: +{self.race_bonuses.get(stat, 0)})"
+            )
+        self.method_combobox.blockSignals(True)
+        for title, method in self.STAT_METHODS.items():
+            if method == self.wizard.builder.stat_method:
+                self.method_combobox.setCurrentText(title)
+        self.method_combobox.blockSignals(False)
+
+    def change_stat_method(self, title):
+        self.wizard.builder = self.wizard.builder.with_stat_method(self.STAT_METHODS[title])
+        self.show_pool()
+
+    def reroll_stats(self):
+        self.wizard.builder = self.wizard.builder.reroll_stats()
+        self.show_pool()
+
+    # Новый набор значений: выбор характеристик начинается заново
+    def show_pool(self):
+        builder = self.wizard.builder
+        rolled = builder.stat_method != STANDARD_METHOD
+        pool = ", ".join(str(value) for value in builder.stat_pool)
+        if rolled:
+            self.stat_distribution_label.setText(f"Выпало ({builder.stat_method}): {pool}")
+            import dice
+
+            odds = dice.distribution(builder.stat_method)
+            self.odds_label.setText(
+                f"Один бросок {builder.stat_method}: {odds.summary()}; 16 и выше — {odds.at_least(16):.1%}"
+            )
+        else:
+            self.stat_distribution_label.setText(f"Стандартное распределение характеристик: {pool}")
+            self.odds_label.setText("")
+        self.odds_label.setVisible(rolled)
+        self.roll_button.setEnabled(rolled)
+
+        self.selected_slots = {}
+        self.stats = builder.stats()
+        for stat in STATS:
+            self.show_final_stat(stat)
+        self.update_comboboxes()
+        self.next_button.setEnabled(False)
+        self.refresh_suggestion()
+
+    def show_final_stat(self, stat):
+        self.final_stat_labels[stat].setText(
+            f"Итоговое значение и модификатор: {self.stats[stat]} ({modifier(self.stats[stat])})"
         )
 
-    def update_stat(self, stat, value):
-        if value and value != "0":
-            self.selected_values[stat] = value
+    def refresh_suggestion(self):
+        pool = self.wizard.builder.stat_pool
+        fixed = {stat: pool[slot] for stat, slot in self.selected_slots.items()}
+        ranked = rank_assignments(self.race_bonuses, self.wizard.builder.character_class, fixed, limit=1, pool=pool)
+        self.suggestion = ranked[0][1] if ranked else None
+        if self.suggestion is None:
+            self.suggestion_label.setText("Рекомендация: нет распределения с выбранными значениями")
         else:
-            self.selected_values.pop(stat, None)
+            self.suggestion_label.setText(
+                "Рекомендация: " + ", ".join(f"{stat} {value}" for stat, value in self.suggestion.items())
+            )
+        self.suggest_button.setEnabled(self.suggestion is not None)
 
-        self.stats[stat] = (
-            int(value) + self.race_bonuses.get(stat, 0) if value != "0" else 0
+    def apply_suggestion(self):
+        if self.suggestion is None:
+            return
+        self.select_values(self.suggestion)
+
+    # Каждому значению — свой номер в наборе; значения, которых в наборе не осталось, не выбираются
+    def select_values(self, values):
+        free_slots = list(range(len(self.wizard.builder.stat_pool)))
+        pool = self.wizard.builder.stat_pool
+        self.selected_slots = {}
+        for stat, value in values.items():
+            slot = next((slot for slot in free_slots if pool[slot] == value), None)
+            if slot is not None:
+                free_slots.remove(slot)
+                self.selected_slots[stat] = slot
+        self.wizard.builder = self.wizard.builder.with_stats(
+            {stat: pool[slot] for stat, slot in self.selected_slots.items()}
         )
-        modifier = math.floor((self.stats[stat] - 10) / 2)
-        self.final_stat_labels[stat].setText(
-            f"Итоговое значение и модификатор: {self.stats[stat]} ({modifier})"
+        self.stats = self.wizard.builder.stats()
+        for stat in STATS:
+            self.show_final_stat(stat)
+        self.update_comboboxes()
+        self.next_button.setEnabled(len(self.selected_slots) == len(self.stats))
+        self.refresh_suggestion()
+
+    def update_stat(self, stat, slot):
+        if slot is not None:
+            self.selected_slots[stat] = slot
+        else:
+            self.selected_slots.pop(stat, None)
+
+        self.wizard.builder = self.wizard.builder.with_stat(
+            stat, self.wizard.builder.stat_pool[slot] if slot is not None else None
         )
+        self.stats = self.wizard.builder.stats()
+        self.show_final_stat(stat)
         self.update_comboboxes()
 
-        self.next_button.setEnabled(len(self.selected_values) == len(self.stats))
+        self.next_button.setEnabled(len(self.selected_slots) == len(self.stats))
+        self.refresh_suggestion()
 
+    # В каждом списке — свободные значения набора (одинаковые показываются один раз) и «0»
+    @metrics.timed("stat_comboboxes_rebuild")
     def update_comboboxes(self):
-        all_values = {"0", "15", "14", "13", "12", "10", "8"}
-        used_values = set(self.selected_values.values())
+        pool = self.wizard.builder.stat_pool
 
         for stat, combobox in self.stat_comboboxes.items():
-            current_value = combobox.currentText()
+            current_slot = self.selected_slots.get(stat)
+            used_slots = {slot for other, slot in self.selected_slots.items() if other != stat}
+            slots = {}
+            if current_slot is not None:
+                slots[pool[current_slot]] = current_slot
+            for slot, value in enumerate(pool):
+                if slot not in used_slots:
+                    slots.setdefault(value, slot)
 
             combobox.blockSignals(True)
             combobox.clear()
-            for value in sorted(all_values, key=int, reverse=True):
-                if value == current_value or value not in used_values:
-                    combobox.addItem(value)
-
-            combobox.setCurrentText(
-                current_value if current_value in all_values else "0"
-            )
+            for value in sorted(slots, reverse=True):
+                combobox.addItem(str(value), slots[value])
+            combobox.addItem("0", None)
+            combobox.setCurrentIndex(combobox.findData(current_slot) if current_slot is not None else combobox.count() - 1)
             combobox.blockSignals(False)
 
     def proceed_to_next_step(self):
-        self.parent.race_bonuses = self.race_bonuses
-        self.parent.show_character_description(self.selected_race, self)
-        self.hide()
+        self.wizard.next_step()
 
     def return_to_previous_step(self):
-        self.class_selection_widget.show()
-        self.hide()
+        self.wizard.previous_step()
 
 
 # Окно описания персонажа
-class CharacterDescriptionWidget(QDialog):
-    def __init__(self, parent, selected_race, stat_selection_widget):
-        super().__init__(parent)
-        self.setWindowFlags(Qt.FramelessWindowHint)
-        self.setGeometry(276, 76, 1555, 922)
-        self.character_description = ""
-        self.character_name = ""
-        self.selected_race = selected_race
-        self.stat_selection_widget = stat_selection_widget
-        self.race_bonuses = parent.race_bonuses
-        self.class_selection_widget = (
-            parent.stat_selection_widget.class_selection_widget
-        )
+class CharacterDescriptionWidget(QWidget):
+    HINT_TITLE = "Описание"
+    HINT_TEXT = "Введите Имя и описание персонажа"
+
+    def __init__(self, wizard):
+        super().__init__(wizard)
+        self.wizard = wizard
         self.init_ui()
 
     def init_ui(self):
+        set_role(self, "page")
         layout = QVBoxLayout()
 
         name_label = QLabel("Введите имя персонажа:")
-        name_label.setStyleSheet("background-color: white; font-size: 16px;")
+        set_role(name_label, "caption")
         layout.addWidget(name_label)
 
         self.name_edit = QLineEdit()
@@ -514,7 +1017,7 @@ class CharacterDescriptionWidget(QDialog):
         layout.addWidget(self.name_edit)
 
         description_label = QLabel("Описание персонажа:")
-        description_label.setStyleSheet("background-color: white; font-size: 16px;")
+        set_role(description_label, "caption")
         layout.addWidget(description_label)
 
         self.description_edit = QTextEdit()
@@ -528,168 +1031,82 @@ class CharacterDescriptionWidget(QDialog):
 
         layout.addWidget(self.next_button)
         layout.addWidget(self.back_button)
-        self.setStyleSheet("background-style:white;")
-        self.setStyleSheet("font-size: 16px;")
         self.setLayout(layout)
-        QMessageBox.information(self, "Описание", "Введите Имя и описание персонажа")
+
+    # Поля заполняются из заготовки: имя и описание из черновика или уже принятые кнопкой «Далее»
+    # не стираются при переходе на страницу
+    def reset(self):
+        self.name_edit.setText(self.wizard.builder.name)
+        self.description_edit.setPlainText(self.wizard.builder.description)
+        self.check_input()
+
+    def restore(self):
+        self.check_input()
 
     def check_input(self):
         self.next_button.setEnabled(bool(self.name_edit.text().strip()))
 
     def proceed_to_next_step(self):
-        self.character_name = self.name_edit.text().strip()
-        self.character_description = self.description_edit.toPlainText().strip()
-        if not self.character_name:
+        self.wizard.builder = self.wizard.builder.with_name(self.name_edit.text()).with_description(
+            self.description_edit.toPlainText()
+        )
+        if not self.wizard.builder.name:
             QMessageBox.warning(self, "Ошибка", "Имя персонажа не может быть пустым.")
             return
-        self.parent().show_equipment_selection(self)
-        self.hide()
+        self.wizard.next_step()
 
     def return_to_previous_step(self):
-        if self.stat_selection_widget:
-            self.stat_selection_widget.show()
-        self.parent().is_creating_character = False
-        self.close()
+        self.wizard.previous_step()
 
 
 # Окно выбора снаряжения
-class EquipmentSelectionWidget(QDialog):
-    def __init__(self, description_window):
-        super().__init__(description_window)
+class EquipmentSelectionWidget(QWidget):
+    HINT_TITLE = "Снаряжение"
+    HINT_TEXT = "Выберите снаряжение персонажа (По одному предмету каждого типа)"
+
+    def __init__(self, wizard):
+        super().__init__(wizard)
         self.setWindowTitle("Выбор снаряжения")
-        self.setWindowFlags(Qt.FramelessWindowHint)
-        self.setGeometry(276, 76, 1555, 922)
-        self.description_window = description_window
-        self.selected_equipment = {
-            "оружие": None,
-            "снаряжение": None,
-            "инструменты": None,
-            "снаряжение класса": None,
-        }
+        self.wizard = wizard
+        # Набор флажков строится один раз для каждого класса
+        self.class_panels = {}
+        self.class_checkboxes = {}
+        self.equipment_checkboxes = {}
+        # Номер заявки на запись создаваемого персонажа, пока запись не закончилась
+        self.pending_save = None
+        self.wizard.parent.character_writer.written.connect(self.on_character_written)
         self.init_ui()
 
     def init_ui(self):
+        set_role(self, "page panel")
         layout = QVBoxLayout()
-        class_name = self.description_window.class_selection_widget.selected_class
-
-        equipment = {
-            "Бард": {
-                "оружие": ["Рапира", "Длинный меч", "Кинжал"],
-                "снаряжение": ["Кожаная броня", "Мантия"],
-                "инструменты": ["Набор артиста", "Набор дипломата", "Набор книг"],
-                "снаряжение класса": ["Лютня", "Флейта", "Скрипка"],
-            },
-            "Варвар": {
-                "оружие": ["Секира", "Молот", "Два ручных топора"],
-                "снаряжение": ["Кожаная броня", "Кольчуга", "Обмотки"],
-                "инструменты": ["Набор путешественника"],
-                "снаряжение класса": ["Боевой рог"],
-            },
-            "Воин": {
-                "оружие": ["Двуручный меч", "Длинный меч", "Длинный лук"],
-                "снаряжение": ["Кожаная броня", "Кольчуга"],
-                "инструменты": [
-                    "Набор путешественника",
-                    "Набор исследователя подземелий",
-                ],
-                "снаряжение класса": [],
-            },
-            "Волшебник": {
-                "оружие": ["Посох", "Кинжал"],
-                "снаряжение": ["Мантия"],
-                "инструменты": ["Набор учёного", "Мешочек с компонентами"],
-                "снаряжение класса": ["Книга заклинаний"],
-            },
-            "Друид": {
-                "оружие": ["Боевой", "Скимитар"],
-                "снаряжение": ["Кожаная броня", "Тканный доспех"],
-                "инструменты": ["Набор путешественника"],
-                "снаряжение класса": ["Посох друида"],
-            },
-            "Жрец": {
-                "оружие": ["Булава", "Боевой молот"],
-                "снаряжение": ["Чешуйчатый доспех", "Кольчуга", "Кожаный доспех"],
-                "инструменты": ["Набор путешественника", "Набор священника"],
-                "снаряжение класса": ["Священный символ и щит церкви"],
-            },
-            "Изобретатель": {
-                "оружие": ["Меч", "Лёгкий арбалет"],
-                "снаряжение": ["Поклёпанная броня", "Чешуйчатый доспех"],
-                "инструменты": [
-                    "Воровские инструменты",
-                    "Набор исследователя подземелий",
-                ],
-                "снаряжение класса": ["Однозарядный пистолет"],
-            },
-            "Колдун": {
-                "оружие": ["Короткий меч", "Лёгкий арбалет"],
-                "снаряжение": ["Кожаная броня"],
-                "инструменты": [
-                    "Набор учёного",
-                    "Набор исследователя подземелий",
-                    "Мешочек с компонентами",
-                ],
-                "снаряжение класса": ["Гримуар"],
-            },
-            "Монах": {
-                "оружие": ["Боевой посохч", "Короткий меч"],
-                "снаряжение": ["Обмотки"],
-                "инструменты": [
-                    "Набор путешественника",
-                    "Набор исследователя подземелий",
-                ],
-                "снаряжение класса": ["Чётки для ци"],
-            },
-            "Паладин": {
-                "оружие": ["Двуручный меч", "Боевой молот"],
-                "снаряжение": ["Кольчуга", "Латные доспехи"],
-                "инструменты": ["Набор путешественника", "Набор священника"],
-                "снаряжение класса": ["Священный символ"],
-            },
-            "Плут": {
-                "оружие": ["Рапира", "Короткий меч"],
-                "снаряжение": ["Кожаный доспех с капюшоном"],
-                "инструменты": [
-                    "Набор взломщика",
-                    "Набор исследователя подземелий",
-                    "Набор путешественника",
-                ],
-                "снаряжение класса": ["Кинжалы"],
-            },
-            "Следопыт": {
-                "оружие": ["Два скимитара", "Два коротких меча"],
-                "снаряжение": ["Кожаная броня", "Чешуйчатый доспех"],
-                "инструменты": [
-                    "Набор путешественника",
-                    "Набор исследователя подземелий",
-                ],
-                "снаряжение класса": ["Длинный лук"],
-            },
-            "Чародей": {
-                "оружие": ["Два кинжала", "Короткий меч"],
-                "снаряжение": ["Мантия"],
-                "инструменты": [
-                    "Набор путешественника",
-                    "Набор исследователя подземелий",
-                    "Мешочек с компонентами",
-                ],
-                "снаряжение класса": ["Магическая семейная реликвия"],
-            },
-        }
-
-        equipment_label = QLabel(f"Выберите снаряжение для класса: {class_name}")
-        equipment_label.setStyleSheet("background-color: white;font-size:16px;")
-        layout.addWidget(equipment_label)
-
-        self.equipment_checkboxes = {
-            "оружие": [],
-            "снаряжение": [],
-            "инструменты": [],
-            "снаряжение класса": [],
-        }
 
-        for category, items in equipment[class_name].items():
-            layout.addWidget(self.create_equipment_groupbox(category, items))
+        self.equipment_label = QLabel()
+        set_role(self.equipment_label, "caption")
+        layout.addWidget(self.equipment_label)
+
+        budget_layout = QHBoxLayout()
+        budget_layout.addWidget(QLabel("Бюджет, зм:"))
+        self.budget_spinbox = QSpinBox()
+        self.budget_spinbox.setRange(0, 100000)
+        self.budget_spinbox.setValue(DEFAULT_BUDGET)
+        self.budget_spinbox.valueChanged.connect(self.refresh_loadout)
+        budget_layout.addWidget(self.budget_spinbox)
+        layout.addLayout(budget_layout)
+
+        self.class_stack = QStackedWidget()
+        layout.addWidget(self.class_stack)
+
+        # Вес и цена выбранного против грузоподъёмности и бюджета, и лучший набор с учётом выбранного
+        self.totals_label = QLabel()
+        self.suggestion_label = QLabel()
+        self.suggestion_label.setWordWrap(True)
+        self.suggest_button = QPushButton("Взять рекомендованное", self)
+        self.suggest_button.clicked.connect(self.apply_suggestion)
+        self.suggestion = None
+        layout.addWidget(self.totals_label)
+        layout.addWidget(self.suggestion_label)
+        layout.addWidget(self.suggest_button)
 
         self.finish_button = QPushButton("Закончить", self)
         self.back_button = QPushButton("Назад", self)
@@ -698,15 +1115,45 @@ class EquipmentSelectionWidget(QDialog):
 
         layout.addWidget(self.finish_button)
         layout.addWidget(self.back_button)
-        self.setStyleSheet("background-color: white; font-size: 16px;")
         self.setLayout(layout)
-        QMessageBox.information(
-            self,
-            "Снаряжение",
-            "Выберите снаряжение персонажа (По одному предмету каждого типа)",
-        )
 
-    def create_equipment_groupbox(self, title, items):
+    def reset(self):
+        class_name = self.wizard.builder.character_class
+        self.equipment_label.setText(f"Выберите снаряжение для класса: {class_name}")
+        if class_name not in self.class_panels:
+            self.class_panels[class_name] = self.create_class_panel(class_name)
+            self.class_stack.addWidget(self.class_panels[class_name])
+        self.equipment_checkboxes = self.class_checkboxes[class_name]
+        for checkboxes in self.equipment_checkboxes.values():
+            for checkbox in checkboxes:
+                checkbox.blockSignals(True)
+                checkbox.setChecked(False)
+                checkbox.setEnabled(True)
+                checkbox.blockSignals(False)
+        for category in EQUIPMENT_CATEGORIES:
+            self.wizard.builder = self.wizard.builder.with_equipment(category, None)
+        self.class_stack.setCurrentWidget(self.class_panels[class_name])
+        self.refresh_loadout()
+
+    # Флажки отмечаются так же, как щелчком, и возвращают предметы в заготовку
+    def restore(self):
+        equipment = self.wizard.builder.equipment_dict()
+        self.reset()
+        for category, item in equipment.items():
+            for checkbox in self.equipment_checkboxes.get(category, ()):
+                if checkbox.text() == item:
+                    checkbox.setChecked(True)
+
+    def create_class_panel(self, class_name):
+        panel = QWidget()
+        panel_layout = QVBoxLayout(panel)
+        panel_layout.setContentsMargins(0, 0, 0, 0)
+        self.class_checkboxes[class_name] = {category: [] for category in EQUIPMENT_CATEGORIES}
+        for category, items in get_catalog().equipment(class_name).items():
+            panel_layout.addWidget(self.create_equipment_groupbox(class_name, category, items))
+        return panel
+
+    def create_equipment_groupbox(self, class_name, title, items):
         groupbox = QGroupBox(title)
         form_layout = QFormLayout()
         for item in items:
@@ -716,10 +1163,9 @@ class EquipmentSelectionWidget(QDialog):
                     cat, cb
                 )
             )
-            form_layout.addRow(checkbox)
-            self.equipment_checkboxes[title].append(checkbox)
+            form_layout.addRow(checkbox, QLabel(describe_item(get_catalog().item(item))))
+            self.class_checkboxes[class_name][title].append(checkbox)
         groupbox.setLayout(form_layout)
-        groupbox.setStyleSheet("background-color: white;")
         return groupbox
 
     def update_equipment_selection(self, category, checkbox):
@@ -727,66 +1173,277 @@ class EquipmentSelectionWidget(QDialog):
             for cb in self.equipment_checkboxes[category]:
                 if cb != checkbox:
                     cb.setEnabled(False)
-            self.selected_equipment[category] = checkbox.text()
+            self.wizard.builder = self.wizard.builder.with_equipment(category, checkbox.text())
         else:
             for cb in self.equipment_checkboxes[category]:
                 cb.setEnabled(True)
-            self.selected_equipment[category] = None
+            self.wizard.builder = self.wizard.builder.with_equipment(category, None)
+        self.refresh_loadout()
+
+    # Пересчёт при каждом щелчке: выбранные предметы закреплены, остальные категории подбираются заново
+    def refresh_loadout(self):
+        builder = self.wizard.builder
+        strength = builder.stats()["Сила"]
+        budget = self.budget_spinbox.value()
+        equipment = builder.equipment_dict()
+        weight, cost = loadout_totals(equipment.values())
+        capacity = carrying_capacity(strength)
+        problems = []
+        if weight > capacity:
+            problems.append("перегруз")
+        if cost > budget:
+            problems.append("не хватает денег")
+        self.totals_label.setText(
+            f"Вес: {weight:g} из {capacity} фнт, цена: {cost:g} из {budget} зм"
+            + (f" — {', '.join(problems)}" if problems else "")
+        )
+
+        chosen = {category: item for category, item in equipment.items() if item is not None}
+        self.suggestion = optimize_loadout(builder.character_class, strength, budget, chosen)
+        if self.suggestion is None:
+            self.suggestion_label.setText("Рекомендация: выбранное не помещается в грузоподъёмность или бюджет")
+        else:
+            picks = [
+                f"{category} — {item}" for category, item in zip(EQUIPMENT_CATEGORIES, self.suggestion.items)
+                if item is not None
+            ]
+            self.suggestion_label.setText(
+                f"Рекомендация: {'; '.join(picks) or 'ничего'} "
+                f"({self.suggestion.weight:g} фнт, {self.suggestion.cost:g} зм)"
+            )
+        self.suggest_button.setEnabled(
+            self.suggestion is not None
+            and any(item != equipment.get(category) for category, item in zip(EQUIPMENT_CATEGORIES, self.suggestion.items))
+        )
+
+    # Отмечаются рекомендованные предметы в пустых категориях; выбранное игроком не трогается
+    def apply_suggestion(self):
+        if self.suggestion is None:
+            return
+        for category, item in zip(EQUIPMENT_CATEGORIES, self.suggestion.items):
+            if item is None or self.wizard.builder.equipment_dict().get(category) is not None:
+                continue
+            for checkbox in self.equipment_checkboxes.get(category, ()):
+                if checkbox.text() == item:
+                    checkbox.setChecked(True)
 
     def finish_creation(self):
-        selected_race = self.description_window.selected_race
-        race_features = self.description_window.parent().race_selection_widget.races[
-            selected_race
-        ]["features"]
-
-        character_data = {
-            "Имя": self.description_window.character_name,
-            "Раса": selected_race,
-            "Класс": self.description_window.class_selection_widget.selected_class,
-            "Описание": self.description_window.character_description,
-            "Снаряжение": self.selected_equipment,
-            "Особенности расы": race_features,
-        }
+        try:
+            character = self.wizard.builder.build()
+        except ValidationError as error:
+            QMessageBox.warning(self, "Ошибка", "\n".join(error.errors))
+            return
 
-        stats_and_modifiers = self.description_window.stat_selection_widget.stats
-        for stat, value in stats_and_modifiers.items():
-            character_data[f"{stat}"] = f"{value} ({math.floor((value - 10) / 2)})"
+        self.finish_button.setEnabled(False)
+        self.back_button.setEnabled(False)
+        self.pending_save = (self.wizard.parent.character_writer.save(character.to_dict()), character.name)
 
-        if not os.path.exists("characters"):
-            os.makedirs("characters")
-        file_path = os.path.join("characters", f"{character_data['Имя']}.txt")
-        with open(file_path, "w") as file:
-            for key, value in character_data.items():
-                file.write(f"{key}: {value}\n")
+    def on_character_written(self, batch):
+        if self.pending_save is None or self.pending_save[0] not in batch.tickets:
+            return
+        name = self.pending_save[1]
+        self.pending_save = None
+        self.finish_button.setEnabled(True)
+        self.back_button.setEnabled(True)
+        if batch.error:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить персонажа '{name}': {batch.error}")
+            return
         QMessageBox.information(
             self,
             "Сохранение персонажа",
-            f"Персонаж '{self.description_window.character_name}' успешно создан и сохранен!",
+            f"Персонаж '{name}' успешно создан и сохранен!",
         )
-        self.description_window.parent().is_creating_character = False
-        self.close()
+        self.wizard.finish()
 
     def return_to_previous_step(self):
-        self.description_window.show()
-        self.close()
+        self.wizard.previous_step()
+
+
+# Снятие выбора со всех переключателей группы
+def uncheck_buttons(button_group):
+    button_group.setExclusive(False)
+    for button in button_group.buttons():
+        button.setChecked(False)
+    button_group.setExclusive(True)
+
+
+def check_button(button_group, text):
+    uncheck_buttons(button_group)
+    for button in button_group.buttons():
+        if button.text() == text:
+            button.setChecked(True)
+
+
+# Модель списка персонажей: строки добавляются страницами через fetchMore,
+# а в памяти держится только ограниченное число недавно показанных страниц
+class CharacterListModel(QAbstractListModel):
+    PAGE_SIZE = 200
+    MAX_PAGES = 16
+    SORT_ORDERS = {
+        "Имя (А-Я)": ("name", False),
+        "Имя (Я-А)": ("name", True),
+        "Раса": ("race", False),
+        "Класс": ("class", False),
+    }
+
+    def __init__(self, store, search_index=None, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.search_index = search_index
+        self.query = ""
+        # Номера документов поискового индекса, пока задан запрос; иначе строки берутся страницами из базы
+        self.results = None
+        self.order = "name"
+        self.descending = False
+        self.pages = OrderedDict()
+        self.total = 0
+        self.loaded = 0
+        # Удаления, отправленные на запись: {имя: строка}
+        self.pending_deletes = {}
+        self.refresh()
+
+    def refresh(self):
+        self.beginResetModel()
+        self.pages.clear()
+        if self.query and self.search_index is not None and self.search_index.ready:
+            self.results = self.search_index.search(self.query, self.order, self.descending).tolist()
+            self.total = len(self.results)
+        else:
+            self.results = None
+            self.total = self.store.count()
+        self.loaded = 0
+        self.version = self.store.settled_version()
+        self.endResetModel()
+
+    def is_outdated(self):
+        return self.version != self.store.settled_version()
+
+    def set_sort_order(self, title):
+        self.order, self.descending = self.SORT_ORDERS[title]
+        self.refresh()
+
+    def set_query(self, query):
+        self.query = query.strip()
+        self.refresh()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.loaded < self.total
+
+    def fetchMore(self, parent):
+        count = min(self.PAGE_SIZE, self.total - self.loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.row_data(index.row())
+        if row is None:
+            return None
+        if role == Qt.DisplayRole:
+            return row[0]
+        if role == Qt.ToolTipRole:
+            return f"{row[1]}, {row[2]}"
+        return None
+
+    def row_data(self, row):
+        if self.results is not None:
+            return self.search_index.row(self.results[row]) if row < len(self.results) else None
+        page_number = row // self.PAGE_SIZE
+        page = self.pages.get(page_number)
+        if page is None:
+            page = self.store.page(page_number * self.PAGE_SIZE, self.PAGE_SIZE, self.order, self.descending)
+            self.pages[page_number] = page
+            if len(self.pages) > self.MAX_PAGES:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(page_number)
+        position = row - page_number * self.PAGE_SIZE
+        return page[position] if position < len(page) else None
+
+    def name(self, row):
+        row = self.row_data(row)
+        return row[0] if row else None
+
+    # Удаление уходит в фоновую запись и попадает в базу не сразу. Строка остаётся в списке, пока
+    # запись не подтверждена: если бы страницы перечитались раньше, удалённый ещё был бы в базе
+    def mark_deleted(self, row):
+        name = self.name(row)
+        if name is None or name in self.pending_deletes:
+            return None
+        self.pending_deletes[name] = row
+        return name
+
+    # Записанные удаления. Все строки сверяются с кэшем до того, как первая из них убрана:
+    # remove_row сбрасывает страницы, а перечитанные из базы уже без удалённых. Убираются снизу вверх,
+    # поэтому номера ещё не убранных не сдвигаются. False — строку не нашли на прежнем месте
+    def confirm_deleted(self, names):
+        rows = sorted(
+            ((self.pending_deletes.pop(name), name) for name in names if name in self.pending_deletes), reverse=True
+        )
+        if len(rows) != len(names) or any(self.name(row) != name for row, name in rows):
+            return False
+        for row, _ in rows:
+            self.remove_row(row)
+        self.pending_deletes = {
+            other: other_row - sum(row < other_row for row, _ in rows)
+            for other, other_row in self.pending_deletes.items()
+        }
+        return True
+
+    def remove_row(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.total -= 1
+        self.loaded -= 1
+        if self.results is not None:
+            del self.results[row]
+        # Страницы после удалённой строки сдвинулись
+        first_page = row // self.PAGE_SIZE
+        for page_number in [number for number in self.pages if number >= first_page]:
+            del self.pages[page_number]
+        self.version = self.store.settled_version()
+        self.endRemoveRows()
 
 
 # Вызов списка персонажей
 class CharacterListWidget(QWidget):
+    PREFETCH_RADIUS = 3
+
     def __init__(self, parent):
         super().__init__(parent)
         self.setWindowTitle("Список персонажей")
         self.setWindowFlags(Qt.FramelessWindowHint)
         self.setGeometry(276, 76, 1555, 922)
         self.parent = parent
+        self.sheet_cache = SheetCache(self.parent.character_store.path)
         self.init_ui()
+        self.parent.character_store.add_listener(self.on_roster_changed)
 
     def init_ui(self):
         layout = QVBoxLayout()
-        self.character_list = QListWidget()
-        self.character_list.itemClicked.connect(self.display_character_info)
+        self.search_edit = QLineEdit()
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.search_characters)
+        layout.addWidget(self.search_edit)
+
+        self.sort_combobox = QComboBox()
+        self.sort_combobox.addItems(CharacterListModel.SORT_ORDERS.keys())
+        self.sort_combobox.currentTextChanged.connect(self.sort_characters)
+        layout.addWidget(self.sort_combobox)
+
+        self.character_list = QListView()
+        self.character_list.setUniformItemSizes(True)
 
         self.load_characters()
+        self.on_search_index_ready()
+        # Выбор строки мышью или стрелками
+        self.character_list.selectionModel().currentChanged.connect(self.display_character_info)
 
         layout.addWidget(self.character_list)
 
@@ -799,47 +1456,286 @@ class CharacterListWidget(QWidget):
         layout.addWidget(self.back_button)
 
         self.character_info_text = QTextEdit()
+        self.character_info_text.setObjectName("characterInfo")
         self.character_info_text.setReadOnly(True)
         layout.addWidget(self.character_info_text)
 
         self.setLayout(layout)
 
     def load_characters(self):
-        if not os.path.exists("characters"):
-            os.makedirs("characters")
-        for character_file in os.listdir("characters"):
-            if character_file.endswith(".txt"):
-                self.character_list.addItem(character_file.replace(".txt", ""))
-
-    def display_character_info(self, item):
-        character_name = item.text()
-        file_path = os.path.join("characters", f"{character_name}.txt")
-        with open(file_path, "r") as file:
-            character_info = file.read()
-        self.character_info_text.setStyleSheet("font-size: 16px;")
-        self.character_info_text.setText(character_info)
+        self.character_model = CharacterListModel(self.parent.character_store, self.parent.search_index, self)
+        self.character_list.setModel(self.character_model)
+
+    # Индекса может ещё не быть: он создаётся отложенным этапом запуска
+    def on_search_index_ready(self):
+        ready = self.parent.search_index is not None and self.parent.search_index.ready
+        # Список мог открыться раньше, чем появился индекс
+        self.character_model.search_index = self.parent.search_index
+        self.search_edit.setEnabled(ready)
+        self.search_edit.setPlaceholderText(
+            "Поиск: имя, описание, снаряжение, раса:эльф класс:колдун Харизма>=16" if ready
+            else "Поиск станет доступен после построения индекса…"
+        )
+        if ready and self.search_edit.text():
+            self.search_characters(self.search_edit.text())
 
-    def delete_character(self):
-        current_item = self.character_list.currentItem()
-        if current_item:
-            character_name = current_item.text()
-            file_path = os.path.join("characters", f"{character_name}.txt")
-            os.remove(file_path)
-            self.character_list.takeItem(self.character_list.row(current_item))
+    def refresh(self):
+        if self.character_model.is_outdated():
+            self.character_model.refresh()
             self.character_info_text.clear()
 
+    def on_roster_changed(self, saved, deleted):
+        # Удаления из этого окна убирают свои строки, когда запись подтверждена.
+        # Остальное перечитывается; пока список скрыт, обновление откладывается до следующего открытия
+        if deleted and not self.character_model.confirm_deleted(deleted):
+            self.character_model.pending_deletes.clear()
+            self.character_model.version = None
+            saved = True
+        if saved and self.isVisible():
+            self.refresh()
+
+    def sort_characters(self, title):
+        self.character_model.set_sort_order(title)
+        self.character_info_text.clear()
+
+    def search_characters(self, query):
+        self.character_model.set_query(query)
+        self.character_info_text.clear()
+
+    def display_character_info(self, index):
+        if not index.isValid():
+            return
+        row = self.character_model.row_data(index.row())
+        character = self.sheet_cache.get(self.parent.character_store, row[0], row[3]) if row else None
+        if character is None:
+            return
+        self.character_info_text.setText(format_sheet(character) + self.level_text(character))
+        self.prefetch_neighbours(index.row())
+
+    # Уровень, хиты, бонус мастерства и ячейки заклинаний под листом персонажа
+    def level_text(self, character):
+        from progression import describe_level, level_info
+
+        if character["Класс"] not in get_catalog().classes:
+            return ""
+        info = level_info(character["Класс"], character["Уровень"], character["Хиты"], character["Телосложение"])
+        return "\n" + describe_level(info)
+
+    def prefetch_neighbours(self, row):
+        neighbours = []
+        for neighbour in range(row - self.PREFETCH_RADIUS, row + self.PREFETCH_RADIUS + 1):
+            if neighbour != row and 0 <= neighbour < self.character_model.rowCount():
+                data = self.character_model.row_data(neighbour)
+                if data:
+                    neighbours.append((data[0], data[3]))
+        self.sheet_cache.prefetch(neighbours)
+
+    def delete_character(self):
+        current_index = self.character_list.currentIndex()
+        if current_index.isValid():
+            name = self.character_model.mark_deleted(current_index.row())
+            if name is not None:
+                self.parent.character_writer.delete(name)
+                self.character_info_text.clear()
+
     def return_to_main_menu(self):
         self.hide()
         self.parent.is_viewing_characters = False
         self.parent.show()
 
 
+# Горизонтальные столбцы с подписями слева и числами справа
+class BarChart(QWidget):
+    LABEL_SHARE = 0.35
+    TEXT_WIDTH = 150
+    BAR_COLOR = QColor(120, 90, 160)
+
+    def __init__(self, title, parent=None):
+        super().__init__(parent)
+        self.title = title
+        self.bars = []
+
+    # Высота строки зависит от шрифта темы
+    def row_height(self):
+        return self.fontMetrics().height() + 6
+
+    # bars — тройки (подпись, значение, текст справа)
+    def set_bars(self, bars):
+        self.bars = bars
+        self.setMinimumHeight((len(bars) + 1) * self.row_height() + 8)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        width = self.width()
+        height = self.row_height()
+        painter.drawText(4, 0, width - 8, height, Qt.AlignLeft | Qt.AlignVCenter, self.title)
+        label_width = int(width * self.LABEL_SHARE)
+        bar_space = max(1, width - label_width - self.TEXT_WIDTH - 16)
+        largest = max((value for _, value, _ in self.bars), default=0) or 1
+        for position, (label, value, text) in enumerate(self.bars):
+            top = (position + 1) * height
+            painter.drawText(4, top, label_width - 8, height, Qt.AlignRight | Qt.AlignVCenter, label)
+            painter.fillRect(label_width, top + 3, int(bar_space * value / largest), height - 6, self.BAR_COLOR)
+            painter.drawText(
+                label_width + bar_space + 8, top, self.TEXT_WIDTH, height, Qt.AlignLeft | Qt.AlignVCenter, text
+            )
+        painter.end()
+
+
+# Состав списка: расы, классы, распределения характеристик и самые популярные предметы.
+# Графики строятся по столбцам RosterColumns и пересчитываются, только когда список изменился
+class AnalyticsWidget(QWidget):
+    TOP_ITEMS = 15
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setWindowTitle("Аналитика")
+        self.setWindowFlags(Qt.FramelessWindowHint)
+        self.setGeometry(276, 76, 1555, 922)
+        self.parent = parent
+        self.shown_version = None
+        self.summary = None
+        self.init_ui()
+        self.parent.character_store.add_listener(self.on_roster_changed)
+
+    def init_ui(self):
+        set_role(self, "page panel")
+        layout = QVBoxLayout()
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        stat_layout = QHBoxLayout()
+        stat_layout.addWidget(QLabel("Характеристика:"))
+        self.stat_combobox = QComboBox()
+        self.stat_combobox.addItems(STATS)
+        self.stat_combobox.currentIndexChanged.connect(self.show_stat_charts)
+        stat_layout.addWidget(self.stat_combobox)
+        layout.addLayout(stat_layout)
+
+        charts = QWidget()
+        charts_layout = QVBoxLayout(charts)
+        self.race_chart = BarChart("Расы")
+        self.class_chart = BarChart("Классы")
+        self.stat_chart = BarChart("Значения характеристики")
+        self.stat_mean_chart = BarChart("Среднее значение по классам")
+        self.item_chart = BarChart(
+            f"Предметы, которые берут чаще всего (взяли / при случайном выборе), первые {self.TOP_ITEMS}"
+        )
+        for chart in (self.race_chart, self.class_chart, self.stat_chart, self.stat_mean_chart, self.item_chart):
+            charts_layout.addWidget(chart)
+        self.scroll_area = QScrollArea(self)
+        self.scroll_area.setWidgetResizable(True)
+        self.scroll_area.setWidget(charts)
+        layout.addWidget(self.scroll_area)
+
+        self.back_button = QPushButton("Назад", self)
+        self.back_button.clicked.connect(self.return_to_main_menu)
+        layout.addWidget(self.back_button)
+        self.setLayout(layout)
+
+    def on_roster_changed(self, saved, deleted):
+        if self.isVisible():
+            self.refresh()
+
+    @metrics.timed("analytics_refresh")
+    def refresh(self):
+        columns = self.parent.roster_columns
+        if not columns.ready:
+            self.status_label.setText("Столбцы для аналитики строятся…")
+            return
+        if columns.version == self.shown_version:
+            return
+        self.shown_version = columns.version
+        summary = self.summary = columns.summary()
+        self.status_label.setText(f"Персонажей: {summary.count}")
+        self.race_chart.set_bars([(race, count, share(count, summary.count)) for race, count in summary.races])
+        self.class_chart.set_bars([
+            (character_class, count, share(count, summary.count)) for character_class, count in summary.classes
+        ])
+        self.item_chart.set_bars([
+            (item, taken / expected if expected else taken, f"{taken} / {expected:.0f}")
+            for item, taken, expected in summary.item_usage[:self.TOP_ITEMS]
+        ])
+        self.show_stat_charts()
+
+    def show_stat_charts(self):
+        from analytics import MAX_STAT
+
+        if self.summary is None:
+            return
+        position = self.stat_combobox.currentIndex()
+        histogram = self.summary.stat_histograms[position]
+        values = histogram.nonzero()[0]
+        self.stat_chart.set_bars([
+            (f"{value}+" if value == MAX_STAT else str(value), int(histogram[value]), str(int(histogram[value])))
+            for value in (range(values.min(), values.max() + 1) if len(values) else ())
+        ])
+        means = sorted(
+            ((class_name, means[position]) for class_name, means in self.summary.stat_means.items()),
+            key=lambda pair: -pair[1],
+        )
+        self.stat_mean_chart.set_bars([(class_name, mean, f"{mean:.1f}") for class_name, mean in means])
+
+    def return_to_main_menu(self):
+        self.hide()
+        self.parent.is_viewing_analytics = False
+        self.parent.show()
+
+
+def share(count, total):
+    return f"{count} ({count / total:.0%})" if total else str(count)
+
+
 # Начало программы
 if __name__ == "__main__":
+    # Команды без окна: python main.py generate N, export PATH, import PATH, pack, serve, level-up
+    if sys.argv[1:2] == ["generate"]:
+        import npc
+        sys.exit(npc.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["level-up"]:
+        import progression
+        sys.exit(progression.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["export"]:
+        import transfer
+        sys.exit(transfer.export_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["import"]:
+        import transfer
+        sys.exit(transfer.import_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["pack"]:
+        import assets
+        sys.exit(assets.pack_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["serve"]:
+        import server
+        sys.exit(server.main(sys.argv[2:]))
+    if "--trace-startup" in sys.argv:
+        sys.argv.remove("--trace-startup")
+        startup_trace.enable()
+    if "--metrics" in sys.argv:
+        sys.argv.remove("--metrics")
+        metrics.enable()
+    # --serve [адрес:порт]: открыть список персонажей по HTTP, по умолчанию только на этом компьютере
+    serve_address = None
+    if "--serve" in sys.argv:
+        position = sys.argv.index("--serve")
+        sys.argv.pop(position)
+        serve_address = os.environ.get("DND_SERVE_ADDRESS", "127.0.0.1:8765")
+        if position < len(sys.argv) and not sys.argv[position].startswith("-"):
+            serve_address = sys.argv.pop(position)
     app = QApplication(sys.argv)
+    # Одна таблица стилей на всё приложение, до создания первого окна
+    with startup_trace.stage("тема оформления"):
+        apply_theme(initial_theme())
     image_folder = "Pictures/Background"
     icon_path = "Pictures/Icon/D&D.ico"
     music_folder = "Music"
-    main_window = MainWindow(image_folder, icon_path, music_folder)
+    database_path = "characters.db"
+    characters_folder = "characters"
+    cache_folder = "cache"
+    # Собранный командой pack пакет ресурсов; если его нет, файлы читаются из папок
+    with startup_trace.stage("пакет ресурсов"):
+        assets = open_assets(DEFAULT_PACK)
+    main_window = MainWindow(image_folder, icon_path, music_folder, database_path, characters_folder, cache_folder,
+                             assets, serve_address)
     main_window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,187 @@
+import atexit
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+
+# Замеры включаются переменной окружения DND_METRICS=1 или флагом --metrics. Выключенные замеры
+# почти ничего не стоят: декораторы только проверяют флаг. Включённые пишут каждое событие
+# в JSONL с ротацией и раз в EXPORT_INTERVAL секунд обновляют файл для Prometheus
+METRICS_FOLDER = os.environ.get("DND_METRICS_DIR", "metrics")
+EVENTS_FILE = "events.jsonl"
+PROMETHEUS_FILE = "metrics.prom"
+MAX_EVENTS_BYTES = 5 * 1024 * 1024
+EVENTS_BACKUPS = 3
+EXPORT_INTERVAL = 5.0
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def metric_name(name):
+    return "dnd_" + re.sub(r"[^a-zA-Z0-9_]", "_", name) + "_seconds"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in pairs) + "}"
+
+
+# Гистограмма длительностей с накопленными корзинами, как их считает Prometheus
+class Histogram:
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for position, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[position] += 1
+                break
+
+    def buckets(self):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            yield str(bound), cumulative
+        yield "+Inf", self.count
+
+
+# Замер как контекстный менеджер (with metrics.timed("...")) или декоратор (@metrics.timed("..."))
+class Timer:
+    __slots__ = ("metrics", "name", "labels", "started")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.metrics.enabled:
+            self.metrics.observe(self.name, time.perf_counter() - self.started, self.labels)
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.metrics.enabled:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.metrics.observe(self.name, time.perf_counter() - started, self.labels)
+        return wrapper
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.folder = None
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.listener = None
+        self.logger = logging.getLogger("dnd.metrics")
+        self.logger.propagate = False
+        self.stopped = threading.Event()
+        self.exporter = None
+
+    # Файлы пишутся в фоновых потоках, чтобы замер не добавлял дисковых операций в поток интерфейса
+    def enable(self, folder=METRICS_FOLDER):
+        if self.enabled:
+            return
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        events = queue.SimpleQueue()
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(folder, EVENTS_FILE), maxBytes=MAX_EVENTS_BYTES, backupCount=EVENTS_BACKUPS, encoding="utf-8"
+        )
+        self.listener = logging.handlers.QueueListener(events, file_handler)
+        self.listener.start()
+        self.logger.addHandler(logging.handlers.QueueHandler(events))
+        self.logger.setLevel(logging.INFO)
+        self.exporter = threading.Thread(target=self.export_loop, daemon=True)
+        self.exporter.start()
+        self.enabled = True
+        atexit.register(self.close)
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.stopped.set()
+        self.exporter.join()
+        self.export_prometheus()
+        self.listener.stop()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def timed(self, name, **labels):
+        return Timer(self, name, tuple(sorted(labels.items())))
+
+    def observe(self, name, seconds, labels=()):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram()
+            histogram.observe(seconds)
+        event = {"time": round(time.time(), 6), "metric": name, "seconds": round(seconds, 6)}
+        event.update(labels)
+        self.logger.info(json.dumps(event, ensure_ascii=False))
+
+    def export_loop(self):
+        while not self.stopped.wait(EXPORT_INTERVAL):
+            self.export_prometheus()
+
+    def prometheus_text(self):
+        with self.lock:
+            snapshot = [
+                (name, labels, list(histogram.buckets()), histogram.total, histogram.count)
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        lines = []
+        described = set()
+        for name, labels, buckets, total, count in snapshot:
+            family = metric_name(name)
+            if family not in described:
+                described.add(family)
+                lines.append(f"# TYPE {family} histogram")
+            for bound, cumulative in buckets:
+                lines.append(f"{family}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{family}_sum{format_labels(labels)} {total:.6f}")
+            lines.append(f"{family}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    # Файл подменяется целиком, чтобы сборщик не прочитал его наполовину записанным
+    def export_prometheus(self):
+        path = os.path.join(self.folder, PROMETHEUS_FILE)
+        temporary_path = path + ".tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                file.write(self.prometheus_text())
+            os.replace(temporary_path, path)
+        except OSError as error:
+            print(f"Не удалось записать {path}: {error}")
+
+
+metrics = Metrics()
+if os.environ.get("DND_METRICS", "") not in ("", "0"):
+    metrics.enable()
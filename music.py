@@ -0,0 +1,153 @@
+import random
+import threading
+
+import pygame
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from assets import BufferReader
+from metrics import metrics
+
+
+# Перемешанный плейлист: каждый трек звучит один раз за круг и не повторяется дважды подряд
+class Playlist:
+    def __init__(self, tracks, rng=None):
+        self.tracks = list(tracks)
+        self.rng = rng or random.Random()
+        self.order = []
+        self.last = None
+
+    def next_track(self):
+        if not self.order:
+            self.order = self.tracks[:]
+            self.rng.shuffle(self.order)
+            # Следующий трек берётся с конца списка
+            if len(self.order) > 1 and self.order[-1] == self.last:
+                self.order[0], self.order[-1] = self.order[-1], self.order[0]
+        self.last = self.order.pop()
+        return self.last
+
+
+# Фоновая музыка: один таймер на всё время работы, следующий трек заранее читается
+# в отдельном потоке и ставится в очередь pygame, поэтому переход между треками без паузы
+class MusicPlayer(QObject):
+    POLL_INTERVAL = 1000
+    prefetched = pyqtSignal(str, object)
+
+    def __init__(self, assets, music_folder, volume=0.1, parent=None):
+        super().__init__(parent)
+        self.assets = assets
+        self.music_folder = music_folder
+        self.volume = volume
+        tracks = assets.files(music_folder)
+        if not tracks:
+            raise Exception("No music files found in the specified directory.")
+        self.playlist = Playlist(tracks)
+
+        # pygame закрывает переданный ему файловый объект, поэтому храним данные трека
+        # (байты или срез пакета ресурсов) и на каждую передачу создаём новый BufferReader
+        self.current_track = None
+        self.current_data = None
+        self.queued_track = None
+        self.queued_data = None
+        self.prefetching = False
+
+        self.timer_ticks = 0
+        self.end_events = 0
+        self.tracks_started = 0
+        self.prefetches = 0
+        self.gapless_transitions = 0
+
+        self.prefetched.connect(self.on_prefetched)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self.check_events)
+
+    def start(self):
+        pygame.display.init()
+        pygame.mixer.init()
+        pygame.mixer.music.set_endevent(pygame.USEREVENT)
+        track = self.playlist.next_track()
+        self.play(track, self.read_track(track))
+        self.poll_timer.start(self.POLL_INTERVAL)
+
+    def stop(self):
+        self.poll_timer.stop()
+        if pygame.mixer.get_init():
+            pygame.mixer.music.stop()
+
+    @metrics.timed("music_track_read")
+    def read_track(self, track):
+        return self.assets.data(track)
+
+    def play(self, track, data):
+        self.current_track = track
+        self.current_data = data
+        pygame.mixer.music.load(BufferReader(data), track)
+        pygame.mixer.music.set_volume(self.volume)
+        pygame.mixer.music.play()
+        self.tracks_started += 1
+        self.prefetch_next()
+
+    def prefetch_next(self):
+        if self.prefetching or self.queued_track is not None:
+            return
+        self.prefetching = True
+        track = self.playlist.next_track()
+        threading.Thread(target=self.prefetch, args=(track,), daemon=True).start()
+
+    def prefetch(self, track):
+        try:
+            data = self.read_track(track)
+        except OSError as error:
+            print(f"Не удалось прочитать {track}: {error}")
+            data = None
+        self.prefetched.emit(track, data)
+
+    def on_prefetched(self, track, data):
+        self.prefetching = False
+        if data is None:
+            self.prefetch_next()
+            return
+        self.prefetches += 1
+        self.queued_track = track
+        self.queued_data = data
+        if pygame.mixer.music.get_busy():
+            pygame.mixer.music.queue(BufferReader(data), track)
+        else:
+            self.play_queued()
+
+    def play_queued(self):
+        track, data = self.queued_track, self.queued_data
+        self.queued_track = None
+        self.queued_data = None
+        self.play(track, data)
+
+    def check_events(self):
+        self.timer_ticks += 1
+        for event in pygame.event.get():
+            if event.type == pygame.USEREVENT:
+                self.on_track_end()
+
+    def on_track_end(self):
+        self.end_events += 1
+        if self.queued_track is not None and pygame.mixer.music.get_busy():
+            # pygame уже сам запустил трек из очереди
+            self.gapless_transitions += 1
+            self.tracks_started += 1
+            self.current_track = self.queued_track
+            self.current_data = self.queued_data
+            self.queued_track = None
+            self.queued_data = None
+            self.prefetch_next()
+        elif self.queued_track is not None:
+            self.play_queued()
+        # Иначе следующий трек ещё читается и запустится в on_prefetched
+
+    def stats(self):
+        return {
+            "timer_ticks": self.timer_ticks,
+            "end_events": self.end_events,
+            "tracks_started": self.tracks_started,
+            "prefetches": self.prefetches,
+            "gapless_transitions": self.gapless_transitions,
+            "current_track": self.current_track,
+        }
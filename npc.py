@@ -0,0 +1,132 @@
+import argparse
+import itertools
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from assignment import STANDARD_ARRAY, best_assignments_for_all
+from core import CharacterBuilder
+from rules import get_catalog
+from storage import CharacterStore, STATS
+
+GIVEN_NAMES = [
+    "Арден", "Бранн", "Велька", "Горан", "Дара", "Ёрвин", "Зора", "Ивель", "Кайра", "Лорин",
+    "Мирта", "Нейл", "Ольва", "Радим", "Села", "Торвин", "Ульма", "Фенрик", "Хельга", "Эйра",
+]
+FAMILY_NAMES = [
+    "Бурый", "Вересковый", "Громов", "Дубовый", "Железнорук", "Камнелом", "Лунный", "Медовар",
+    "Огнебород", "Речной", "Серебряный", "Тёмный", "Холмов", "Чернолес", "Ясный",
+]
+CHUNK_SIZE = 1000
+BATCH_SIZE = 5000
+IN_FLIGHT_PER_WORKER = 2
+
+
+# Генератор случайных чисел для куска зависит только от зерна и номера куска,
+# поэтому набор НПС не меняется от числа процессов
+def chunk_rng(seed, chunk):
+    return random.Random(f"{seed}:{chunk}")
+
+
+# best_stats — таблица лучших распределений {(раса, класс): характеристики} или None для случайных
+def random_npc(number, rng, catalog, best_stats=None):
+    race = rng.choice(list(catalog.races))
+    class_name = rng.choice(list(catalog.classes))
+    if best_stats:
+        stats = best_stats[(race, class_name)]
+    else:
+        values = list(STANDARD_ARRAY)
+        rng.shuffle(values)
+        stats = dict(zip(STATS, values))
+    builder = (
+        CharacterBuilder()
+        .with_name(f"{rng.choice(GIVEN_NAMES)} {rng.choice(FAMILY_NAMES)} {number:06d}")
+        .with_race(race)
+        .with_class(class_name)
+        .with_description("Случайный НПС")
+        .with_stats(stats)
+    )
+    for category, items in catalog.classes[class_name].equipment:
+        if items:
+            builder = builder.with_equipment(category, rng.choice(items))
+    return builder.build(catalog)
+
+
+# Выполняется в процессе пула: кусок НПС с номерами [start, start + count) в формате хранилища
+def generate_chunk(seed, chunk, start, count, best_stats=False):
+    catalog = get_catalog()
+    rng = chunk_rng(seed, chunk)
+    best_stats = best_assignments_for_all(catalog) if best_stats else None
+    return [random_npc(number, rng, catalog, best_stats).to_dict(catalog) for number in range(start, start + count)]
+
+
+def chunks(count, first_number=0):
+    for chunk, start in enumerate(range(0, count, CHUNK_SIZE)):
+        yield chunk, first_number + start, min(CHUNK_SIZE, count - start)
+
+
+# НПС по мере готовности кусков; порядок кусков сохраняется. В работе не больше
+# IN_FLIGHT_PER_WORKER кусков на процесс: готовые куски не копятся в памяти, пока их сохраняют
+def generate(count, seed=0, workers=None, first_number=0, best_stats=False):
+    parts = chunks(count, first_number)
+    if workers == 1:
+        for chunk, start, size in parts:
+            yield from generate_chunk(seed, chunk, start, size, best_stats)
+        return
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = deque()
+        for chunk, start, size in itertools.islice(parts, IN_FLIGHT_PER_WORKER * workers):
+            futures.append(pool.submit(generate_chunk, seed, chunk, start, size, best_stats))
+        while futures:
+            characters = futures.popleft().result()
+            for chunk, start, size in itertools.islice(parts, 1):
+                futures.append(pool.submit(generate_chunk, seed, chunk, start, size, best_stats))
+            yield from characters
+
+
+def save_batches(store, characters, batch_size=BATCH_SIZE, progress=None):
+    saved = 0
+    batch = []
+    for character in characters:
+        batch.append(character)
+        if len(batch) == batch_size:
+            store.save_many(batch)
+            saved += len(batch)
+            batch = []
+            if progress:
+                progress(saved)
+    if batch:
+        store.save_many(batch)
+        saved += len(batch)
+    return saved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py generate", description="Массовое создание случайных НПС")
+    parser.add_argument("count", type=int, help="сколько персонажей создать")
+    parser.add_argument("--database", default="characters.db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="число процессов, 1 — без пула")
+    parser.add_argument("--start", type=int, default=0, help="номер первого НПС, от него зависят имена")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--best-stats", action="store_true", help="лучшее распределение для класса вместо случайного")
+    args = parser.parse_args(argv)
+
+    store = CharacterStore(args.database)
+    started = time.perf_counter()
+
+    def progress(saved):
+        elapsed = time.perf_counter() - started
+        print(f"  {saved:>9,} сохранено, {saved / elapsed:10,.0f} в секунду")
+
+    try:
+        characters = generate(args.count, args.seed, args.workers, args.start, args.best_stats)
+        saved = save_batches(store, characters, args.batch_size, progress)
+    finally:
+        store.close()
+    elapsed = time.perf_counter() - started
+    print(f"Создано {saved:,} НПС за {elapsed:.2f} с, {saved / max(elapsed, 1e-9):,.0f} в секунду")
+    return 0
@@ -0,0 +1,242 @@
+import argparse
+import functools
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from metrics import metrics
+from rules import get_catalog
+from storage import CharacterStore, STATS
+
+MAX_LEVEL = 20
+SPELL_LEVELS = 9
+# Выше этого значения характеристики не растут
+MAX_IMPROVED_STAT = 20
+# Рост характеристик на уровне улучшения: два раза по +1, сначала самой важной для класса
+IMPROVEMENT_POINTS = 2
+CONSTITUTION = STATS.index("Телосложение")
+
+# Ячейки полного заклинателя по уровню заклинателя, по уровням заклинаний с первого
+FULL_CASTER_SLOTS = (
+    (),
+    (2,), (3,), (4, 2), (4, 3), (4, 3, 2),
+    (4, 3, 3), (4, 3, 3, 1), (4, 3, 3, 2), (4, 3, 3, 3, 1), (4, 3, 3, 3, 2),
+    (4, 3, 3, 3, 2, 1), (4, 3, 3, 3, 2, 1), (4, 3, 3, 3, 2, 1, 1), (4, 3, 3, 3, 2, 1, 1), (4, 3, 3, 3, 2, 1, 1, 1),
+    (4, 3, 3, 3, 2, 1, 1, 1), (4, 3, 3, 3, 2, 1, 1, 1, 1), (4, 3, 3, 3, 3, 1, 1, 1, 1), (4, 3, 3, 3, 3, 2, 1, 1, 1),
+    (4, 3, 3, 3, 3, 2, 2, 1, 1),
+)
+# Магия договора колдуна: (уровень, с которого действует, число ячеек, их уровень)
+PACT_SLOTS = ((1, 1, 1), (2, 2, 1), (3, 2, 2), (5, 2, 3), (7, 2, 4), (9, 2, 5), (11, 3, 5), (17, 4, 5))
+
+# Таблицы по всем классам справочника; строка уровня 0 пустая, чтобы индексом был сам уровень.
+# hit_die — (классы,), proficiency — (уровни,), improvements — (классы, уровни) bool,
+# spell_slots — (классы, уровни, уровни заклинаний), stat_order — номера характеристик
+# каждого класса от самой важной к наименее важной
+ProgressionTables = namedtuple(
+    "ProgressionTables", ("class_names", "codes", "hit_die", "proficiency", "improvements", "spell_slots", "stat_order")
+)
+# Уровень персонажа для листа: хиты, бонус мастерства, ячейки по уровням заклинаний
+# и следующий уровень с ростом характеристик (None — больше не будет)
+LevelInfo = namedtuple("LevelInfo", ("level", "hit_points", "proficiency", "spell_slots", "next_improvement"))
+# Кривая хитов по уровням для каждого класса: среднее и 10-й и 90-й процентили по всем прогонам
+HitPointCurve = namedtuple("HitPointCurve", ("class_names", "mean", "low", "high"))
+
+
+def modifiers(values):
+    return (np.asarray(values) - 10) // 2
+
+
+# Уровень заклинателя, по которому ячейки берутся из таблицы полного заклинателя
+def caster_level(spellcasting, level):
+    if spellcasting == "full":
+        return level
+    if spellcasting == "half":
+        return (level + 1) // 2 if level >= 2 else 0
+    if spellcasting == "artificer":
+        return (level + 1) // 2
+    return 0
+
+
+def pact_slots(level):
+    slots = np.zeros(SPELL_LEVELS, dtype=np.int8)
+    for first_level, count, slot_level in PACT_SLOTS:
+        if level >= first_level:
+            slots[:] = 0
+            slots[slot_level - 1] = count
+    return slots
+
+
+# Таблицы считаются один раз на справочник; дальше любой расчёт — выборка по индексам
+@functools.lru_cache(maxsize=None)
+def progression_tables(catalog=None):
+    catalog = catalog or get_catalog()
+    classes = list(catalog.classes.values())
+    levels = np.arange(MAX_LEVEL + 1)
+    proficiency = np.where(levels > 0, 2 + (levels - 1) // 4, 0).astype(np.int8)
+
+    improvements = np.zeros((len(classes), MAX_LEVEL + 1), dtype=bool)
+    spell_slots = np.zeros((len(classes), MAX_LEVEL + 1, SPELL_LEVELS), dtype=np.int8)
+    for code, character_class in enumerate(classes):
+        improvements[code, list(character_class.ability_score_improvements)] = True
+        for level in range(1, MAX_LEVEL + 1):
+            if character_class.spellcasting == "pact":
+                spell_slots[code, level] = pact_slots(level)
+            else:
+                slots = FULL_CASTER_SLOTS[caster_level(character_class.spellcasting, level)]
+                spell_slots[code, level, :len(slots)] = slots
+
+    priorities = np.array([character_class.stat_priorities for character_class in classes])
+    return ProgressionTables(
+        tuple(character_class.name for character_class in classes),
+        {character_class.name: code for code, character_class in enumerate(classes)},
+        np.array([character_class.hit_die for character_class in classes], dtype=np.int16),
+        proficiency,
+        improvements,
+        spell_slots,
+        np.argsort(-priorities, axis=1, kind="stable"),
+    )
+
+
+def first_level_hit_points(hit_die, constitution):
+    return np.maximum(1, np.asarray(hit_die) + modifiers(constitution))
+
+
+# Хиты персонажа: 0 в базе значит, что они ещё не считались и равны хитам первого уровня
+def current_hit_points(class_name, hit_points, constitution, catalog=None):
+    if hit_points:
+        return hit_points
+    tables = progression_tables(catalog or get_catalog())
+    return int(first_level_hit_points(tables.hit_die[tables.codes[class_name]], constitution))
+
+
+def level_info(class_name, level, hit_points, constitution, catalog=None):
+    tables = progression_tables(catalog or get_catalog())
+    code = tables.codes[class_name]
+    level = max(1, min(level, MAX_LEVEL))
+    later = np.flatnonzero(tables.improvements[code, level + 1:])
+    slots = tables.spell_slots[code, level]
+    # Ячейки до старшего доступного уровня заклинаний, без пустого хвоста
+    filled = np.flatnonzero(slots)
+    return LevelInfo(
+        level,
+        current_hit_points(class_name, hit_points, constitution, catalog),
+        int(tables.proficiency[level]),
+        tuple(slots[:filled[-1] + 1].tolist()) if len(filled) else (),
+        int(level + 1 + later[0]) if len(later) else None,
+    )
+
+
+def describe_level(info):
+    lines = [
+        f"Уровень: {info.level}",
+        f"Хиты: {info.hit_points}",
+        f"Бонус мастерства: +{info.proficiency}",
+    ]
+    if info.spell_slots:
+        slots = ", ".join(f"{slot_level}-й: {count}" for slot_level, count in enumerate(info.spell_slots, 1) if count)
+        lines.append(f"Ячейки заклинаний: {slots}")
+    if info.next_improvement:
+        lines.append(f"Следующее увеличение характеристик: {info.next_improvement} уровень")
+    return "\n".join(lines)
+
+
+# Рост характеристик у отмеченных строк: каждое очко достаётся первой по важности для класса
+# характеристике, которая ещё меньше MAX_IMPROVED_STAT
+def improve_stats(stats, codes, improving, stat_order):
+    rows = np.flatnonzero(improving)
+    order = stat_order[codes[rows]]
+    for _ in range(IMPROVEMENT_POINTS):
+        ordered = np.take_along_axis(stats[rows], order, axis=1)
+        eligible = ordered < MAX_IMPROVED_STAT
+        columns = order[np.arange(len(rows)), eligible.argmax(axis=1)]
+        chosen = eligible.any(axis=1)
+        stats[rows[chosen], columns[chosen]] += 1
+
+
+# Повышение уровня всем строкам сразу. Каждый уровень — один векторный шаг по всему списку:
+# бросок кости хитов (или среднее значение), рост характеристик на уровнях улучшения
+# и пересчёт хитов за прошлые уровни, если вырос модификатор Телосложения.
+# rows — строки CharacterStore.progression_rows; возвращает строки для write_progression,
+# в которых характеристики None, если они не изменились
+def level_up(rows, levels=1, rng=None, average=False, catalog=None):
+    tables = progression_tables(catalog or get_catalog())
+    rng = rng or np.random.default_rng()
+    rows = [row for row in rows if row[1] in tables.codes]
+    if not rows:
+        return []
+    names = [row[0] for row in rows]
+    codes = np.array([tables.codes[row[1]] for row in rows], dtype=np.intp)
+    level = np.clip(np.array([row[2] for row in rows], dtype=np.int16), 1, MAX_LEVEL)
+    hit_points = np.array([row[3] for row in rows], dtype=np.int32)
+    stats = np.array([row[4:4 + len(STATS)] for row in rows], dtype=np.int16)
+    hit_die = tables.hit_die[codes]
+
+    original_stats = stats.copy()
+    unset = hit_points <= 0
+    hit_points[unset] = first_level_hit_points(hit_die[unset], stats[unset, CONSTITUTION])
+    for _ in range(levels):
+        active = level < MAX_LEVEL
+        if not active.any():
+            break
+        new_level = level + active
+        previous_modifier = modifiers(stats[:, CONSTITUTION])
+        improve_stats(stats, codes, active & tables.improvements[codes, new_level], tables.stat_order)
+        constitution_modifier = modifiers(stats[:, CONSTITUTION])
+        if average:
+            rolls = hit_die // 2 + 1
+        else:
+            rolls = rng.integers(1, hit_die + 1)
+        gain = np.maximum(1, rolls + constitution_modifier) + level * (constitution_modifier - previous_modifier)
+        hit_points += np.where(active, gain, 0).astype(np.int32)
+        level = new_level
+    # Характеристики возвращаются только там, где они выросли
+    changed = (stats != original_stats).any(axis=1).tolist()
+    return [
+        (name, row_level, row_hit_points, tuple(row_stats) if row_changed else None)
+        for name, row_level, row_hit_points, row_stats, row_changed
+        in zip(names, level.tolist(), hit_points.tolist(), stats.tolist(), changed)
+    ]
+
+
+# Повышение уровня всему списку или персонажам из names одной транзакцией; число изменённых
+def level_up_roster(store, levels=1, names=None, seed=None, average=False, catalog=None):
+    with metrics.timed("level_up", levels=levels):
+        rows = level_up(store.progression_rows(names), levels, np.random.default_rng(seed), average, catalog)
+        store.write_progression(rows)
+    return len(rows)
+
+
+# Хиты с 1-го по 20-й уровень при постоянном Телосложении: runs прогонов на класс одним массивом
+# (классы, прогоны, уровни); накопленная сумма по уровням даёт хиты на каждом уровне
+def simulate_hit_points(class_names=None, constitution=10, runs=10000, seed=None, catalog=None):
+    tables = progression_tables(catalog or get_catalog())
+    class_names = tuple(class_names or tables.class_names)
+    hit_die = tables.hit_die[[tables.codes[name] for name in class_names]].reshape(-1, 1, 1)
+    constitution_modifier = int(modifiers(constitution))
+    rng = np.random.default_rng(seed)
+    rolls = rng.integers(1, hit_die + 1, size=(len(class_names), runs, MAX_LEVEL), dtype=np.int16)
+    gains = np.maximum(1, rolls + constitution_modifier)
+    gains[:, :, 0] = first_level_hit_points(hit_die[:, :, 0], constitution)
+    curves = gains.cumsum(axis=2, dtype=np.int32)
+    low, high = np.percentile(curves, (10, 90), axis=1)
+    return HitPointCurve(class_names, curves.mean(axis=1), low, high)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py level-up", description="Повышение уровня персонажей в базе")
+    parser.add_argument("names", nargs="*", help="имена персонажей, без них — весь список")
+    parser.add_argument("--levels", type=int, default=1, help="на сколько уровней поднять")
+    parser.add_argument("--database", default="characters.db")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--average", action="store_true", help="среднее значение кости хитов вместо броска")
+    args = parser.parse_args(argv)
+
+    store = CharacterStore(args.database)
+    started = time.perf_counter()
+    try:
+        count = level_up_roster(store, args.levels, args.names or None, args.seed, args.average)
+    finally:
+        store.close()
+    print(f"Повышен уровень {count:,} персонажей за {time.perf_counter() - started:.2f} с")
+    return 0
@@ -0,0 +1,215 @@
+import json
+import os
+import pickle
+import sys
+
+from storage import STATS
+
+# Пути от папки программы, а не от текущей: запуск из другой папки находит тот же кэш
+PROGRAM_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DATA_FOLDER = os.path.join(PROGRAM_FOLDER, "data")
+DATA_FILES = ["races.json", "classes.json", "items.json"]
+CACHE_PATH = os.path.join(PROGRAM_FOLDER, "cache", "rules.pickle")
+# Увеличивается при любом изменении устройства записей, чтобы старый кэш не подхватился
+CATALOG_VERSION = 5
+
+EQUIPMENT_CATEGORIES = ["оружие", "снаряжение", "инструменты", "снаряжение класса"]
+# Уровни, на которых растут характеристики, если у класса в classes.json не указаны свои
+ABILITY_SCORE_IMPROVEMENTS = (4, 8, 12, 16, 19)
+# Виды заклинателей: full — полный, half — половинный, artificer — изобретатель (половинный
+# с первого уровня), pact — магия договора колдуна; None — класс без заклинаний
+SPELLCASTING = (None, "full", "half", "artificer", "pact")
+
+
+def intern(text):
+    return sys.intern(str(text))
+
+
+# Неизменяемая запись справочника правил
+class Record:
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} нельзя изменять")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} нельзя изменять")
+
+    def __reduce__(self):
+        return (self.__class__.restore, tuple(getattr(self, name) for name in self.__slots__))
+
+    @classmethod
+    def restore(cls, *values):
+        return cls(**dict(zip(cls.__slots__, values)))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+
+class Race(Record):
+    __slots__ = ("name", "description", "features", "bonuses")
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(
+            name=intern(data["name"]),
+            description=data["description"],
+            features=data["features"],
+            bonuses=tuple((intern(stat), int(bonus)) for stat, bonus in data["bonuses"].items()),
+        )
+
+    def bonus_dict(self):
+        return dict(self.bonuses)
+
+    def bonus(self, stat):
+        return self.bonus_dict().get(stat, 0)
+
+
+# hit_die — кость хитов класса, spellcasting — вид заклинателя из SPELLCASTING,
+# ability_score_improvements — уровни, на которых растут характеристики
+class CharacterClass(Record):
+    __slots__ = (
+        "name", "description", "equipment", "stat_priorities", "hit_die", "spellcasting", "ability_score_improvements",
+    )
+
+    @classmethod
+    def from_data(cls, data):
+        priorities = data.get("stat_priorities", {})
+        spellcasting = data.get("spellcasting")
+        if spellcasting not in SPELLCASTING:
+            raise ValueError(f"{data['name']}: неизвестный вид заклинателя {spellcasting!r}")
+        return cls(
+            name=intern(data["name"]),
+            description=data["description"],
+            equipment=tuple(
+                (intern(category), tuple(intern(item) for item in data["equipment"].get(category, [])))
+                for category in EQUIPMENT_CATEGORIES
+            ),
+            # Вес каждой характеристики для класса, по порядку STATS
+            stat_priorities=tuple(float(priorities.get(stat, 1)) for stat in STATS),
+            hit_die=int(data.get("hit_die", 8)),
+            spellcasting=spellcasting,
+            ability_score_improvements=tuple(
+                int(level) for level in data.get("ability_score_improvements", ABILITY_SCORE_IMPROVEMENTS)
+            ),
+        )
+
+    def equipment_dict(self):
+        return dict(self.equipment)
+
+
+# Предмет снаряжения: вес в фунтах, цена в золотых, прибавка к классу доспеха (КД) и кости урона.
+# У предметов без описания в items.json вес и цена нулевые
+class Item(Record):
+    __slots__ = ("name", "weight", "cost", "armor_class", "damage")
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(
+            name=intern(data["name"]),
+            weight=float(data.get("weight", 0)),
+            cost=float(data.get("cost", 0)),
+            armor_class=int(data.get("armor_class", 0)),
+            damage=data.get("damage"),
+        )
+
+    @classmethod
+    def unknown(cls, name):
+        return cls(name=name, weight=0.0, cost=0.0, armor_class=0, damage=None)
+
+
+# Справочник рас, классов и снаряжения с индексами для поиска
+class RulesCatalog:
+    def __init__(self, races, classes, items=()):
+        self.races = {race.name: race for race in races}
+        self.classes = {character_class.name: character_class for character_class in classes}
+
+        self.items = {item.name: item for item in items}
+        self.classes_by_item = {}
+        for character_class in classes:
+            for category, class_items in character_class.equipment:
+                for item in class_items:
+                    self.items.setdefault(item, Item.unknown(item))
+                    owners = self.classes_by_item.setdefault(item, [])
+                    if character_class.name not in owners:
+                        owners.append(character_class.name)
+        self.classes_by_item = {item: tuple(owners) for item, owners in self.classes_by_item.items()}
+
+        self.race_bonuses = {race.name: race.bonus_dict() for race in races}
+        self.races_by_stat = {
+            stat: tuple(race.name for race in races if race.bonus(stat)) for stat in STATS
+        }
+
+    def race(self, name):
+        return self.races[name]
+
+    def character_class(self, name):
+        return self.classes[name]
+
+    def equipment(self, class_name):
+        return self.classes[class_name].equipment_dict()
+
+    def item(self, name):
+        return self.items.get(name) or Item.unknown(name)
+
+    def is_class_item(self, class_name, category, item):
+        return item in self.equipment(class_name).get(category, ())
+
+
+def data_signature(data_folder):
+    signature = [CATALOG_VERSION]
+    for file_name in DATA_FILES:
+        stat = os.stat(os.path.join(data_folder, file_name))
+        signature.append((file_name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def parse_catalog(data_folder):
+    with open(os.path.join(data_folder, "races.json"), encoding="utf-8") as file:
+        races = [Race.from_data(race) for race in json.load(file)["races"]]
+    with open(os.path.join(data_folder, "classes.json"), encoding="utf-8") as file:
+        classes = [CharacterClass.from_data(data) for data in json.load(file)["classes"]]
+    with open(os.path.join(data_folder, "items.json"), encoding="utf-8") as file:
+        items = [Item.from_data(data) for data in json.load(file)["items"]]
+    return RulesCatalog(races, classes, items)
+
+
+# Справочник из кэша, если файлы данных не менялись, иначе разбор JSON и обновление кэша
+def load_catalog(data_folder=DATA_FOLDER, cache_path=CACHE_PATH):
+    signature = data_signature(data_folder)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            # Подпись лежит отдельно перед справочником: старый кэш не разбирается вовсе
+            with open(cache_path, "rb") as file:
+                if pickle.load(file) == signature:
+                    return pickle.load(file)
+        except (OSError, pickle.PickleError, EOFError, AttributeError, KeyError, TypeError, ValueError):
+            pass
+
+    catalog = parse_catalog(data_folder)
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            temporary_path = cache_path + ".tmp"
+            with open(temporary_path, "wb") as file:
+                pickle.dump(signature, file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(catalog, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, cache_path)
+        except OSError as error:
+            print(f"Не удалось сохранить кэш правил: {error}")
+    return catalog
+
+
+_catalog = None
+
+
+# Общий для всех окон справочник правил
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog()
+    return _catalog
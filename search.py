@@ -0,0 +1,385 @@
+import bisect
+import json
+import operator
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from storage import CHARACTER_COLUMNS, STATS, fetch_characters
+
+WORD = re.compile(r"[0-9a-zа-я]+")
+# Слово запроса или условие: «раса:эльф», «раса:"Тёмный эльф"», «Харизма>=16»
+QUERY_TERM = re.compile(r'[^\s"]*"[^"]*"?|\S+')
+QUERY_FILTER = re.compile(r"^(?P<key>[^<>=:]+)(?P<op>:|>=|<=|>|<|=)(?P<value>.*)$")
+FACETS = {"раса": "race", "race": "race", "класс": "class", "class": "class"}
+COMPARISONS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq,
+    ":": operator.eq,
+}
+# Сколько слов словаря может подставиться вместо слова короче триграммы
+MAX_PREFIX_TOKENS = 256
+# Одна буква почти ничего не отсеивает, пока её дописывают, она не учитывается
+MIN_WORD_LENGTH = 2
+SORT_KEYS = ("name", "race", "class")
+BATCH_SIZE = 5000
+ALL = ("all", None)
+# Условие распознано, но ещё не дописано: ничего не отсеивает (в -1 установлены все биты)
+NO_FILTER = -1
+
+
+def normalize(text):
+    return str(text).lower().replace("ё", "е")
+
+
+def tokenize(text):
+    return WORD.findall(normalize(text))
+
+
+def trigrams(text):
+    return {text[position:position + 3] for position in range(len(text) - 2)}
+
+
+# Битовая карта (целое число Python) из номеров документов: бит i установлен, если документ i подходит
+def bitmap(ids):
+    if len(ids) == 0:
+        return 0
+    ids = np.asarray(ids, dtype=np.int64)
+    flags = np.zeros(int(ids.max()) + 1, dtype=bool)
+    flags[ids] = True
+    return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+
+# Битовая карта как массив флагов длины size
+def bitmap_flags(bits, size):
+    data = np.frombuffer(bits.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(data, count=size, bitorder="little").astype(bool)
+
+
+# Документ индекса: всё, что нужно для поиска, сортировки и удаления из индекса
+class Document:
+    __slots__ = ("name", "race", "character_class", "stats", "tokens", "updated")
+
+    def __init__(self, name, race, character_class, description, equipment, stats, updated):
+        self.name = name
+        self.race = race
+        self.character_class = character_class
+        self.stats = stats
+        text = " ".join([name, description] + [item for item in equipment.values() if item])
+        self.tokens = frozenset(tokenize(text))
+        self.updated = updated
+
+    @classmethod
+    def from_character(cls, updated, character):
+        return cls(
+            character["Имя"],
+            character["Раса"],
+            character["Класс"],
+            character.get("Описание", ""),
+            character.get("Снаряжение") or {},
+            tuple(int(character[stat]) for stat in STATS),
+            updated,
+        )
+
+    # Строка выборки CHARACTER_COLUMNS + updated
+    @classmethod
+    def from_row(cls, row):
+        return cls(row[0], row[1], row[2], row[3], json.loads(row[4]), row[6:12], row[12])
+
+    # Ключи битовых карт, в которые входит документ
+    def bitmap_keys(self):
+        keys = [ALL, ("race", self.race), ("class", self.character_class)]
+        keys.extend((position, value) for position, value in enumerate(self.stats))
+        return keys
+
+    def sort_key(self, order):
+        if order == "race":
+            return self.race, self.name
+        if order == "class":
+            return self.character_class, self.name
+        return self.name
+
+    def row(self):
+        return self.name, self.race, self.character_class, self.updated
+
+
+# Документы, отсортированные для одного порядка списка; вставка и удаление без пересортировки
+class SortOrder:
+    def __init__(self, order, documents):
+        self.order = order
+        pairs = sorted((data.sort_key(order), document) for document, data in enumerate(documents) if data is not None)
+        self.keys = [key for key, document in pairs]
+        self.ids = [document for key, document in pairs]
+        self.array = None
+
+    def add(self, document, data):
+        key = data.sort_key(self.order)
+        position = bisect.bisect_left(self.keys, key)
+        self.keys.insert(position, key)
+        self.ids.insert(position, document)
+        self.array = None
+
+    def remove(self, document, data):
+        position = bisect.bisect_left(self.keys, data.sort_key(self.order))
+        if position < len(self.ids) and self.ids[position] == document:
+            del self.keys[position]
+            del self.ids[position]
+            self.array = None
+
+    def documents(self):
+        if self.array is None:
+            self.array = np.array(self.ids, dtype=np.int64)
+        return self.array
+
+
+# Поиск по списку персонажей в памяти: обратный индекс слов имени, описания и снаряжения,
+# триграммы слов словаря для частичных совпадений и битовые карты рас, классов и значений
+# характеристик. Номер документа не меняется, пока персонаж есть в базе
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.store = None
+        self.ready = False
+        self.building = False
+        self.replay = []
+        self.documents = []
+        self.ids = {}
+        # ("all", None), ("race", раса), ("class", класс), (номер характеристики, значение) -> битовая карта
+        self.bitmaps = {}
+        self.postings = {}
+        self.token_trigrams = {}
+        self.vocabulary = None
+        self.orders = {}
+
+    # Подписка на хранилище и построение в фоновом потоке со своим соединением только для чтения.
+    # Изменения, пришедшие во время построения, применяются поверх готового индекса
+    def attach(self, store, on_ready=None):
+        with self.lock:
+            self.store = store
+            self.building = True
+            self.replay = []
+        store.add_listener(self.on_roster_changed)
+        thread = threading.Thread(target=self.build, args=(store.path, on_ready), daemon=True)
+        thread.start()
+        return thread
+
+    def build(self, path, on_ready=None):
+        index = SearchIndex()
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            cursor = connection.execute(f"SELECT {', '.join(CHARACTER_COLUMNS)}, updated FROM characters")
+            while True:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                index.add_rows(rows)
+                # Отдаём GIL потоку интерфейса между пачками
+                time.sleep(0)
+        finally:
+            connection.close()
+        index.orders = {order: SortOrder(order, index.documents) for order in SORT_KEYS}
+        for order in index.orders.values():
+            order.documents()
+        index.sorted_vocabulary()
+
+        with self.lock:
+            for name in ("documents", "ids", "bitmaps", "postings", "token_trigrams", "orders"):
+                setattr(self, name, getattr(index, name))
+            for characters, deleted in self.replay:
+                self.apply(characters, deleted)
+            self.vocabulary = index.vocabulary if not self.replay else None
+            self.replay = []
+            self.building = False
+            self.ready = True
+        if on_ready:
+            on_ready()
+
+    # Подписчик хранилища: вызывается в том же потоке, что и сохранение
+    def on_roster_changed(self, saved, deleted):
+        characters = list(fetch_characters(self.store.connection, saved).values())
+        self.update(characters, deleted)
+
+    def update(self, characters, deleted=()):
+        with self.lock:
+            if self.building:
+                self.replay.append((characters, deleted))
+            self.apply(characters, deleted)
+
+    # Изменения битовых карт копятся по ключам и применяются одной операцией на ключ,
+    # иначе каждая вставка копировала бы всю карту
+    def apply(self, characters, deleted):
+        added = {}
+        removed = {}
+        for name in deleted:
+            document = self.ids.pop(name, None)
+            if document is not None:
+                self.remove_document(document, removed)
+        for updated, character in characters:
+            document = self.ids.get(character["Имя"])
+            if document is None:
+                document = len(self.documents)
+                self.documents.append(None)
+                self.ids[character["Имя"]] = document
+            else:
+                self.remove_document(document, removed)
+            self.add_document(document, Document.from_character(updated, character), added)
+
+        bitmaps = self.bitmaps
+        for key, ids in removed.items():
+            bitmaps[key] = bitmaps.get(key, 0) & ~bitmap(ids)
+        for key, ids in added.items():
+            bitmaps[key] = bitmaps.get(key, 0) | bitmap(ids)
+
+    # Первичное заполнение: только новые персонажи, битовые карты строятся по столбцам пачки
+    def add_rows(self, rows):
+        first = len(self.documents)
+        for row in rows:
+            data = Document.from_row(row)
+            self.ids[data.name] = len(self.documents)
+            self.documents.append(data)
+            self.add_tokens(len(self.documents) - 1, data.tokens)
+
+        ids = np.arange(first, len(self.documents))
+        columns = [("race", np.array([row[1] for row in rows])), ("class", np.array([row[2] for row in rows]))]
+        stats = np.array([row[6:12] for row in rows], dtype=np.int64).reshape(-1, len(STATS))
+        columns.extend((position, stats[:, position]) for position in range(len(STATS)))
+        updates = [(ALL, ids)]
+        for kind, column in columns:
+            updates.extend(((kind, value.item()), ids[column == value]) for value in np.unique(column))
+        for key, key_ids in updates:
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | bitmap(key_ids)
+
+    def add_document(self, document, data, added):
+        self.documents[document] = data
+        for key in data.bitmap_keys():
+            added.setdefault(key, []).append(document)
+        self.add_tokens(document, data.tokens)
+        for order in self.orders.values():
+            order.add(document, data)
+
+    def add_tokens(self, document, tokens):
+        postings = self.postings
+        for token in tokens:
+            documents = postings.get(token)
+            if documents is None:
+                documents = postings[token] = set()
+                self.add_token(token)
+            documents.add(document)
+
+    def remove_document(self, document, removed):
+        data = self.documents[document]
+        self.documents[document] = None
+        for key in data.bitmap_keys():
+            removed.setdefault(key, []).append(document)
+        for order in self.orders.values():
+            order.remove(document, data)
+        for token in data.tokens:
+            self.postings[token].discard(document)
+
+    def add_token(self, token):
+        if self.vocabulary is not None:
+            bisect.insort(self.vocabulary, token)
+        for trigram in trigrams(token):
+            self.token_trigrams.setdefault(trigram, []).append(token)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Номера подходящих документов в порядке сортировки списка
+    def search(self, query, order="name", descending=False):
+        with self.lock:
+            flags = self.match(query)
+            ordered = self.ordered(order)
+            found = ordered[flags[ordered]]
+            return found[::-1] if descending else found
+
+    def row(self, document):
+        data = self.documents[document] if 0 <= document < len(self.documents) else None
+        return data.row() if data else None
+
+    # Флаги документов, подходящих под все условия и слова запроса
+    def match(self, query):
+        size = len(self.documents)
+        bits = self.bitmaps.get(ALL, 0)
+        text = None
+        for term in QUERY_TERM.findall(query):
+            condition = QUERY_FILTER.match(term)
+            if condition:
+                key = normalize(condition.group("key"))
+                filter_bits = self.filter_bits(key, condition.group("op"), condition.group("value").strip('"'))
+                if filter_bits is not None:
+                    bits &= filter_bits
+                    continue
+            for word in tokenize(term):
+                if len(word) < MIN_WORD_LENGTH:
+                    continue
+                matched = self.match_word(word)
+                text = matched if text is None else text & matched
+        flags = bitmap_flags(bits, size)
+        if text is not None:
+            text_flags = np.zeros(size, dtype=bool)
+            text_flags[np.fromiter(text, dtype=np.int64, count=len(text))] = True
+            flags &= text_flags
+        return flags
+
+    # Битовая карта условия или None, если это не условие, а слово для поиска
+    def filter_bits(self, key, op, value):
+        if key in FACETS:
+            if op not in (":", "="):
+                return None
+            facet = FACETS[key]
+            value = normalize(value)
+            names = [name for kind, name in self.bitmaps if kind == facet]
+            exact = [name for name in names if normalize(name) == value]
+            bits = 0
+            for name in exact or [name for name in names if normalize(name).startswith(value)]:
+                bits |= self.bitmaps[(facet, name)]
+            return bits
+
+        stats = [position for position, stat in enumerate(STATS) if key and normalize(stat).startswith(key)]
+        if len(stats) != 1:
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            return NO_FILTER
+        compare = COMPARISONS[op]
+        bits = 0
+        for (kind, stat_value), stat_bits in self.bitmaps.items():
+            if kind == stats[0] and compare(stat_value, limit):
+                bits |= stat_bits
+        return bits
+
+    # Документы со словом, в котором встречается искомое; короткое слово ищется как начало слова
+    def match_word(self, word):
+        if len(word) < 3:
+            vocabulary = self.sorted_vocabulary()
+            start = bisect.bisect_left(vocabulary, word)
+            tokens = [token for token in vocabulary[start:start + MAX_PREFIX_TOKENS] if token.startswith(word)]
+        else:
+            lists = sorted((self.token_trigrams.get(trigram, ()) for trigram in trigrams(word)), key=len)
+            # Триграммы могут найтись в слове вразброс, поэтому подстрока проверяется
+            tokens = [token for token in lists[0] if word in token]
+        matched = set()
+        for token in tokens:
+            matched |= self.postings[token]
+        return matched
+
+    def sorted_vocabulary(self):
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+        return self.vocabulary
+
+    # Все живые документы в порядке сортировки
+    def ordered(self, order):
+        if order not in SORT_KEYS:
+            raise ValueError(f"Неизвестная сортировка: {order}")
+        if order not in self.orders:
+            self.orders[order] = SortOrder(order, self.documents)
+        return self.orders[order].documents()
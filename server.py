@@ -0,0 +1,385 @@
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from sheet import format_sheet
+from storage import ChangeWatcher, fetch_characters, fetch_page
+
+# Сервис только читает базу; по умолчанию слушает лишь этот компьютер.
+# Чтобы открыть список планшетам в локальной сети, адрес указывается явно: --serve 0.0.0.0:8765
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+POOL_SIZE = 4
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+CACHE_SIZE = 512
+COMPRESS_MIN_SIZE = 1024
+KEEP_ALIVE_TIMEOUT = 15
+MAX_HEAD_SIZE = 16 * 1024
+STATUS_TEXT = {
+    200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Request Header Fields Too Large", 503: "Service Unavailable",
+}
+
+
+def parse_address(text, default_host=DEFAULT_HOST, default_port=DEFAULT_PORT):
+    host, _, port = (text or "").rpartition(":") if ":" in (text or "") else (text, None, None)
+    return host or default_host, int(port) if port else default_port
+
+
+# Соединения только для чтения, по одному на поток пула: запросы к базе не ждут друг друга
+# и не занимают ни поток цикла событий, ни поток интерфейса
+class ReadPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="roster-read")
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Готовый ответ. ETag — хэш тела, поэтому совпадает у одинаковых ответов даже после перезапуска;
+# сжатая версия создаётся один раз, когда её впервые попросят
+class Response:
+    def __init__(self, status, body, content_type="application/json; charset=utf-8"):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.compressed = None
+
+    @classmethod
+    def json(cls, data, status=200):
+        return cls(status, json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    def gzipped(self):
+        if self.compressed is None:
+            self.compressed = gzip.compress(self.body, compresslevel=6)
+        return self.compressed
+
+
+def parse_int(params, key, default, minimum=0, maximum=None):
+    values = params.get(key)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise HTTPError(400, f"{key} должен быть числом") from None
+    value = max(minimum, value)
+    return min(value, maximum) if maximum is not None else value
+
+
+# Длина тела запроса или None, если заголовок не целое неотрицательное число
+def parse_length(headers):
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+
+def parse_order(params):
+    order = (params.get("order") or ["name"])[0]
+    if order not in ("name", "race", "class"):
+        raise HTTPError(400, "order: name, race или class")
+    return order, (params.get("desc") or ["0"])[0] in ("1", "true", "yes")
+
+
+def row_json(row):
+    name, race, character_class, updated = row
+    return {"name": name, "race": race, "class": character_class, "updated": updated}
+
+
+# Список, поиск и карточки персонажей по HTTP/JSON. Работает в своём потоке с циклом asyncio;
+# ответы кэшируются до следующего изменения базы, о котором говорит PRAGMA data_version
+class RosterService:
+    def __init__(self, database_path, search_index=None, host=DEFAULT_HOST, port=DEFAULT_PORT, pool_size=POOL_SIZE,
+                 store_version=None):
+        self.database_path = database_path
+        self.search_index = search_index
+        self.host = host
+        self.port = port
+        self.pool = ReadPool(database_path, pool_size)
+        # Поисковый индекс обновляется после записи в потоке интерфейса, поэтому для поиска
+        # к версии базы добавляется счётчик изменений хранилища
+        self.store_version = store_version or (lambda: 0)
+        self.cache = OrderedDict()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = threading.Event()
+        self.error = None
+        self.version_connection = None
+        self.clients = set()
+        self.requests = 0
+        self.not_modified = 0
+        self.cache_hits = 0
+
+    # Запуск в фоновом потоке; возвращает настоящий адрес, когда сервер уже принимает соединения
+    def start(self):
+        self.thread = threading.Thread(target=self.run_in_thread, name="roster-service", daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error:
+            raise self.error
+        return self.address()
+
+    def run_in_thread(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.open())
+        except OSError as error:
+            self.error = error
+            self.started.set()
+            self.loop.close()
+            return
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.shutdown())
+            self.loop.close()
+
+    async def open(self):
+        self.version_connection = sqlite3.connect(f"file:{self.database_path}?mode=ro", uri=True)
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_HEAD_SIZE)
+
+    # Соединения, оставленные клиентами открытыми, закрываются до остановки цикла событий
+    async def shutdown(self):
+        self.server.close()
+        clients = list(self.clients)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        await self.server.wait_closed()
+        self.version_connection.close()
+        self.pool.close()
+
+    def stop(self):
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def address(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return host, port
+
+    # Без фонового потока, для python main.py serve
+    def serve_forever(self):
+        async def main():
+            self.loop = asyncio.get_running_loop()
+            await self.open()
+            self.started.set()
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await self.shutdown()
+        asyncio.run(main())
+
+    def data_version(self):
+        return self.version_connection.execute("PRAGMA data_version").fetchone()[0], self.store_version()
+
+    async def handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, Response.json({"error": "слишком длинный запрос"}, 413), {}, False, "GET")
+                    break
+                method, target, headers, keep_alive = self.parse_head(head)
+                length = parse_length(headers)
+                if length is None:
+                    # Без длины тела не найти начало следующего запроса, поэтому соединение закрывается
+                    await self.send(writer, Response.json({"error": "неверный Content-Length"}, 400), {}, False, "GET")
+                    break
+                if length:
+                    await reader.readexactly(length)
+                response = await self.respond(method, target)
+                await self.send(writer, response, headers, keep_alive, method)
+                if not keep_alive:
+                    break
+        # Отмена при остановке сервиса — обычное завершение соединения; отменённой задачу не оставляем,
+        # иначе asyncio сообщает об её исключении в обработчике соединения
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(task)
+            writer.close()
+
+    def parse_head(self, head):
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3:
+            return None, None, {}, False
+        method, target, version = parts
+        headers = {}
+        for line in lines[1:]:
+            key, separator, value = line.partition(":")
+            if separator:
+                headers[key.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return method, target, headers, keep_alive
+
+    async def respond(self, method, target):
+        self.requests += 1
+        if method is None:
+            return Response.json({"error": "неверная строка запроса"}, 400)
+        if method not in ("GET", "HEAD"):
+            return Response.json({"error": "поддерживаются только GET и HEAD"}, 405)
+        key = (target, self.data_version())
+        response = self.cache.get(key)
+        if response is not None:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return response
+        try:
+            response = await self.pool.run(self.build_response, target)
+        except HTTPError as error:
+            return Response.json({"error": str(error)}, error.status)
+        if response.status == 200:
+            self.cache[key] = response
+            while len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return response
+
+    async def send(self, writer, response, headers, keep_alive, method):
+        status = response.status
+        body = response.body
+        extra = [f"ETag: {response.etag}", "Cache-Control: no-cache", "Vary: Accept-Encoding"]
+        if status == 200 and response.etag in (tag.strip() for tag in headers.get("if-none-match", "").split(",")):
+            status = 304
+            body = b""
+            self.not_modified += 1
+        elif len(body) >= COMPRESS_MIN_SIZE and "gzip" in headers.get("accept-encoding", ""):
+            if response.compressed is None:
+                await self.pool.run(response.gzipped)
+            body = response.compressed
+            extra.append("Content-Encoding: gzip")
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ] + extra
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if method != "HEAD":
+            writer.write(body)
+        await writer.drain()
+
+    # Выполняется в потоке пула
+    def build_response(self, target):
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        if not parts:
+            return Response.json({"endpoints": ["/characters", "/characters/<имя>", "/characters/<имя>/sheet", "/search?q="]})
+        if parts[0] == "characters" and len(parts) == 1:
+            return self.list_characters(params)
+        if parts[0] == "characters" and len(parts) in (2, 3):
+            if len(parts) == 3 and parts[2] != "sheet":
+                raise HTTPError(404, f"Нет такого адреса: {url.path}")
+            return self.get_character(parts[1], as_sheet=len(parts) == 3)
+        if parts == ["search"]:
+            return self.search_characters(params)
+        raise HTTPError(404, f"Нет такого адреса: {url.path}")
+
+    def list_characters(self, params):
+        offset = parse_int(params, "offset", 0)
+        limit = parse_int(params, "limit", DEFAULT_LIMIT, 1, MAX_LIMIT)
+        order, descending = parse_order(params)
+        connection = self.pool.connection()
+        total = connection.execute("SELECT COUNT(*) FROM characters").fetchone()[0]
+        rows = fetch_page(connection, offset, limit, order, descending)
+        return Response.json({"total": total, "offset": offset, "characters": [row_json(row) for row in rows]})
+
+    def get_character(self, name, as_sheet=False):
+        found = fetch_characters(self.pool.connection(), [name])
+        if name not in found:
+            raise HTTPError(404, f"Персонаж {name} не найден")
+        updated, character = found[name]
+        if as_sheet:
+            return Response(200, format_sheet(character).encode("utf-8"), "text/plain; charset=utf-8")
+        return Response.json(dict(character, updated=updated))
+
+    def search_characters(self, params):
+        if self.search_index is None or not self.search_index.ready:
+            raise HTTPError(503, "Поисковый индекс ещё строится")
+        query = (params.get("q") or [""])[0]
+        offset = parse_int(params, "offset", 0)
+        limit = parse_int(params, "limit", DEFAULT_LIMIT, 1, MAX_LIMIT)
+        order, descending = parse_order(params)
+        found = self.search_index.search(query, order, descending)
+        rows = [self.search_index.row(int(document)) for document in found[offset:offset + limit]]
+        return Response.json({
+            "total": len(found), "offset": offset, "query": query,
+            "characters": [row_json(row) for row in rows if row],
+        })
+
+    def stats(self):
+        return {"requests": self.requests, "cache_hits": self.cache_hits, "not_modified": self.not_modified}
+
+
+def main(argv=None):
+    from search import SearchIndex
+
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Список персонажей по HTTP для планшетов")
+    parser.add_argument("address", nargs="?", default=f"{DEFAULT_HOST}:{DEFAULT_PORT}", help="адрес:порт")
+    parser.add_argument("--database", default="characters.db")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE)
+    args = parser.parse_args(argv)
+
+    host, port = parse_address(args.address)
+    search_index = SearchIndex()
+    # Сервис один на базу: записи интерфейса и команд приходят из других процессов,
+    # поэтому индекс следует за базой через ChangeWatcher, а не за своими сохранениями
+    watcher = ChangeWatcher(args.database, search_index.attach)
+    service = RosterService(args.database, search_index, host, port, args.pool_size,
+                            lambda: watcher.store.version if watcher.store else 0)
+    # Поиск появится, когда индекс достроится; список и карточки работают сразу
+    print(f"Список персонажей: http://{host}:{port}/characters (Ctrl+C — остановить)")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
@@ -0,0 +1,323 @@
+import ast
+import json
+import math
+import re
+from collections import namedtuple
+
+# Характеристики персонажа в порядке листа
+STATS = ["Сила", "Ловкость", "Телосложение", "Интеллект", "Мудрость", "Харизма"]
+SHEET_KEYS = ["Имя", "Раса", "Класс", "Описание", "Снаряжение", "Особенности расы"] + STATS
+# Первая строка листа второй версии; листы без неё — первой версии, как их писала старая программа
+V2_HEADER = "Лист персонажа v2"
+ENCODINGS = ("utf-8", "cp1251")
+BOM = "\ufeff"
+# Снаряжение и характеристики в листах повторяются, поэтому разобранные значения запоминаются
+MAX_CACHED_VALUES = 65536
+
+SHEET_FIELDS = (
+    "name", "race", "character_class", "description", "equipment", "race_features", "stats",
+    "version", "newline", "encoding", "source",
+)
+
+
+def modifier(value):
+    return math.floor((value - 10) / 2)
+
+
+# Значение характеристики и модификатор в том виде, в каком он записан в листе
+class Stat(namedtuple("Stat", ("value", "modifier"))):
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, value):
+        return cls(value, modifier(value))
+
+    def __str__(self):
+        return f"{self.value} ({self.modifier})"
+
+
+# Лист персонажа с разобранными полями. Снаряжение — пары (категория, предмет) в порядке листа.
+# source — исходный текст: пока лист не менялся, он и записывается, поэтому разбор и запись
+# возвращают файл байт в байт. replace() сбрасывает source, и лист собирается из полей;
+# у v1 при этом пробелы по краям значений теряются (см. format_v1)
+class Sheet(namedtuple("Sheet", SHEET_FIELDS)):
+    __slots__ = ()
+
+    def __new__(cls, name, race="", character_class="", description="", equipment=(), race_features="",
+                stats=(), version=1, newline="\n", encoding="utf-8", source=None):
+        return super().__new__(
+            cls, name, race, character_class, description, equipment, race_features, stats,
+            version, newline, encoding, source,
+        )
+
+    @classmethod
+    def from_character(cls, character, version=1):
+        return cls(
+            character["Имя"],
+            character["Раса"],
+            character["Класс"],
+            character["Описание"],
+            tuple((character.get("Снаряжение") or {}).items()),
+            character["Особенности расы"],
+            tuple(Stat.of(character[stat]) for stat in STATS),
+            version,
+        )
+
+    def replace(self, **changes):
+        return self._replace(source=None, **changes)
+
+    def equipment_dict(self):
+        return dict(self.equipment)
+
+    def stat_dict(self):
+        return {stat: value.value for stat, value in zip(STATS, self.stats)}
+
+    # Словарь персонажа в формате хранилища
+    def to_character(self):
+        character = {
+            "Имя": self.name,
+            "Раса": self.race,
+            "Класс": self.character_class,
+            "Описание": self.description,
+            "Снаряжение": dict(self.equipment),
+            "Особенности расы": self.race_features,
+        }
+        for stat, value in zip(STATS, self.stats):
+            character[stat] = value.value
+        return character
+
+    def serialize(self):
+        if self.source is not None:
+            return self.source
+        return (format_v2 if self.version == 2 else format_v1)(self)
+
+    def encode(self):
+        return self.serialize().encode(self.encoding)
+
+
+# Кэш разборов: значения неизменяемые, поэтому один объект отдаётся всем листам
+class ValueCache(dict):
+    def __init__(self, parse):
+        super().__init__()
+        self.parse = parse
+
+    def __missing__(self, text):
+        value = self.parse(text)
+        if len(self) >= MAX_CACHED_VALUES:
+            self.clear()
+        self[text] = value
+        return value
+
+
+def parse_equipment_repr(text):
+    if not text:
+        return ()
+    equipment = ast.literal_eval(text)
+    if not isinstance(equipment, dict):
+        raise ValueError(f"Снаряжение должно быть словарём, а не {type(equipment).__name__}")
+    return tuple(equipment.items())
+
+
+def parse_stat(text):
+    value, _, rest = text.partition(" ")
+    value = int(value) if value else 0
+    if rest.startswith("(") and rest.endswith(")"):
+        return Stat(value, int(rest[1:-1]))
+    return Stat.of(value)
+
+
+def parse_equipment_json(text):
+    return tuple((category, item) for category, item in json.loads(text)) if text else ()
+
+
+def parse_stat_value(text):
+    return Stat.of(int(text))
+
+
+# Блок строк характеристик целиком, от значения силы до значения харизмы: в пачке листов
+# одинаковые блоки встречаются часто, и разбор сводится к одному поиску в словаре
+def parse_stat_block(block, parse_value):
+    lines = block.split("\n")
+    values = [lines[0]] + [line.partition(": ")[2] for line in lines[1:]]
+    return tuple(parse_value(value.strip()) for value in values)
+
+
+EQUIPMENT_REPRS = ValueCache(parse_equipment_repr)
+EQUIPMENT_JSON = ValueCache(parse_equipment_json)
+STAT_BLOCKS = ValueCache(lambda block: parse_stat_block(block, parse_stat))
+STAT_VALUE_BLOCKS = ValueCache(lambda block: parse_stat_block(block, parse_stat_value))
+
+
+# Первая версия: «Ключ: значение» по строке на поле, описание может занимать несколько строк,
+# снаряжение записано как repr словаря, характеристики как «16 (3)».
+# Разбор v1 обрезает пробелы и пустые строки по краям каждого значения: в этом формате их не отличить
+# от разметки. Поэтому лист, собранный из полей, совпадает с исходным только с точностью до них;
+# байт в байт его возвращает source, а текст с ведущими пробелами сохраняет только v2
+
+def v1_template(newline):
+    return "".join(f"{key}: {{}}{newline}" for key in SHEET_KEYS)
+
+
+V1_TEMPLATES = {newline: v1_template(newline) for newline in ("\n", "\r\n")}
+
+
+def format_v1(sheet):
+    return V1_TEMPLATES[sheet.newline].format(
+        sheet.name, sheet.race, sheet.character_class, sheet.description, dict(sheet.equipment),
+        sheet.race_features, *sheet.stats,
+    )
+
+
+# Поле продолжается до строки с ключом, которого ещё не было; повторный ключ внутри описания — его текст
+def v1_fields(lines):
+    fields = {}
+    key = None
+    for line in lines:
+        head, separator, value = line.partition(": ")
+        if separator and head in SHEET_KEYS and head not in fields:
+            key = head
+            fields[key] = [value]
+        elif key is not None:
+            fields[key].append(line)
+    return fields
+
+
+# Обычный лист: ровно по строке на ключ в стандартном порядке; такой разбирается одним регулярным
+# выражением. \r перед переводом строки попадает в значение и убирается вместе с пробелами
+V1_LAYOUT = re.compile(
+    "".join(f"{re.escape(key)}: ([^\n]*)\n" for key in SHEET_KEYS[:-1])
+    + f"{re.escape(SHEET_KEYS[-1])}: ([^\n]*)\n?\\Z"
+)
+
+
+def parse_v1(text, encoding="utf-8"):
+    body = text[1:] if text.startswith(BOM) else text
+    match = V1_LAYOUT.match(body)
+    if match:
+        newline = "\r\n" if body[match.end(1) - 1:match.end(1)] == "\r" else "\n"
+        values = list(map(str.strip, match.group(1, 2, 3, 4, 5, 6)))
+        stats = STAT_BLOCKS[body[match.start(7):match.end(12)]]
+    else:
+        newline = "\r\n" if "\r\n" in body else "\n"
+        fields = v1_fields(body.split(newline))
+        if "Имя" not in fields:
+            raise ValueError("В листе персонажа нет имени")
+        values = [newline.join(fields[key]).strip() if key in fields else "" for key in SHEET_KEYS]
+        stats = tuple(parse_stat(value) for value in values[6:])
+    return Sheet._make((
+        values[0], values[1], values[2], values[3], EQUIPMENT_REPRS[values[4]], values[5],
+        stats, 1, newline, encoding, text,
+    ))
+
+
+# Вторая версия: заголовок, затем строго по строке на ключ в порядке SHEET_KEYS.
+# Переводы строк и обратная косая черта в тексте экранируются, снаряжение — JSON, характеристики — числа
+
+def escape(text):
+    return text.replace("\\", "\\\\").replace("\r", "\\r").replace("\n", "\\n") if text else text
+
+
+def unescape(text):
+    parts = text.split("\\\\")
+    return "\\".join(part.replace("\\n", "\n").replace("\\r", "\r") for part in parts)
+
+
+def format_v2(sheet):
+    values = (
+        escape(sheet.name), escape(sheet.race), escape(sheet.character_class), escape(sheet.description),
+        json.dumps([list(pair) for pair in sheet.equipment], ensure_ascii=False), escape(sheet.race_features),
+        *(stat.value for stat in sheet.stats),
+    )
+    newline = sheet.newline
+    return V2_HEADER + newline + "".join(f"{key}: {value}{newline}" for key, value in zip(SHEET_KEYS, values))
+
+
+def v2_layout(newline):
+    # Значения экранированы и не содержат переводов строк, поэтому хватает «.», самого быстрого класса
+    fields = "".join(f"{re.escape(key)}: (.*){newline}" for key in SHEET_KEYS)
+    return re.compile(f"{re.escape(V2_HEADER)}{newline}{fields}\\Z")
+
+
+V2_LAYOUTS = {newline: v2_layout(newline) for newline in ("\n", "\r\n")}
+
+
+def parse_v2(text, encoding="utf-8"):
+    body = text[1:] if text.startswith(BOM) else text
+    newline = "\r\n" if body[len(V2_HEADER):len(V2_HEADER) + 1] == "\r" else "\n"
+    match = V2_LAYOUTS[newline].match(body)
+    if not match:
+        raise ValueError(f"Лист v2 должен содержать поля {', '.join(SHEET_KEYS)} по одному на строке")
+    values = match.group(1, 2, 3, 4, 5, 6)
+    if "\\" in body:
+        values = [unescape(value) for value in values]
+    return Sheet._make((
+        values[0], values[1], values[2], values[3], EQUIPMENT_JSON[values[4]], values[5],
+        STAT_VALUE_BLOCKS[body[match.start(7):match.end(12)]], 2, newline, encoding, text,
+    ))
+
+
+# Версия определяется по первой строке, поэтому старые листы разбираются так же быстро, как раньше
+def parse(text, encoding="utf-8"):
+    if text.startswith(V2_HEADER) or text.startswith(BOM + V2_HEADER):
+        return parse_v2(text, encoding)
+    return parse_v1(text, encoding)
+
+
+def decode(data):
+    for encoding in ENCODINGS[:-1]:
+        try:
+            return data.decode(encoding), encoding
+        except UnicodeDecodeError:
+            pass
+    # Листы, сохранённые под Windows в кодировке по умолчанию
+    return data.decode(ENCODINGS[-1]), ENCODINGS[-1]
+
+
+def parse_bytes(data):
+    text, encoding = decode(data)
+    return parse(text, encoding)
+
+
+def read_sheet(path):
+    with open(path, "rb") as file:
+        return parse_bytes(file.read())
+
+
+# Пакетный разбор: ошибка в одном листе не останавливает остальные.
+# Возвращает пары (лист, None) или (None, текст ошибки) в порядке входа
+def parse_many(texts):
+    results = []
+    for text in texts:
+        try:
+            results.append((parse(text), None))
+        except (ValueError, SyntaxError) as error:
+            results.append((None, str(error)))
+    return results
+
+
+def format_many(sheets):
+    return [sheet.serialize() for sheet in sheets]
+
+
+# Листы из файлов по одному, без загрузки всей папки в память: (путь, лист или None, ошибка)
+def iter_sheet_files(paths):
+    for path in paths:
+        try:
+            yield path, read_sheet(path), None
+        except (OSError, ValueError, SyntaxError) as error:
+            yield path, None, str(error)
+
+
+# Текст листа для словаря персонажа, как в старых .txt файлах. Первая версия собирается
+# прямо из словаря: так лист показывается в списке персонажей, и это должно быть быстро
+def format_sheet(character, version=1):
+    if version != 1:
+        return Sheet.from_character(character, version).serialize()
+    return V1_TEMPLATES["\n"].format(
+        character["Имя"], character["Раса"], character["Класс"], character["Описание"], character["Снаряжение"],
+        character["Особенности расы"], *(f"{character[stat]} ({modifier(character[stat])})" for stat in STATS),
+    )
+
+
+def parse_sheet(text):
+    return parse(text).to_character()
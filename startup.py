@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+# Замер времени запуска по этапам. Этапы записываются всегда, а отчёт печатается,
+# только если задана переменная окружения DND_TRACE_STARTUP=1 или флаг --trace-startup
+class StartupTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.stages = []
+        self.enabled = os.environ.get("DND_TRACE_STARTUP", "") not in ("", "0")
+
+    def enable(self):
+        self.enabled = True
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last, now - self.started))
+        self.last = now
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.stages.append((name, now - started, now - self.started))
+            self.last = now
+
+    def finish(self):
+        self.mark("запуск завершён")
+        if not self.enabled:
+            return
+        print("Время запуска по этапам:", file=sys.stderr)
+        for stage, duration, total in self.stages:
+            print(f"  {stage:<32} {duration * 1000:8.1f} мс  (с начала {total * 1000:8.1f} мс)", file=sys.stderr)
+
+
+trace = StartupTrace()
@@ -0,0 +1,589 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+from sheet import STATS, format_sheet, iter_sheet_files, modifier
+
+# Колонки базы для характеристик
+STAT_COLUMNS = {
+    "Сила": "strength",
+    "Ловкость": "dexterity",
+    "Телосложение": "constitution",
+    "Интеллект": "intelligence",
+    "Мудрость": "wisdom",
+    "Харизма": "charisma",
+}
+CHARACTER_COLUMNS = ["name", "race", "class", "description", "equipment", "race_features"] + [
+    STAT_COLUMNS[stat] for stat in STATS
+]
+# Уровень и хиты лежат в той же строке, но сохранение из мастера, листа или импорта их не читает
+# и не перезаписывает; в словарь персонажа их добавляет только fetch_characters, для показа.
+# Хиты 0 — ещё не считались, у персонажа первый уровень
+PROGRESSION_COLUMNS = {"level": "INTEGER NOT NULL DEFAULT 1", "hit_points": "INTEGER NOT NULL DEFAULT 0"}
+NOTIFY_BATCH = 5000
+
+
+def row_character(row):
+    character = {
+        "Имя": row[0],
+        "Раса": row[1],
+        "Класс": row[2],
+        "Описание": row[3],
+        "Снаряжение": json.loads(row[4]),
+        "Особенности расы": row[5],
+    }
+    for stat, value in zip(STATS, row[6:12]):
+        character[stat] = value
+    return character
+
+
+# Персонажи по списку имён: {имя: (время изменения, персонаж)}; у персонажа есть и «Уровень» с «Хитами»,
+# чтобы лист с уровнем собирался из одного запроса и кэшировался целиком
+def fetch_characters(connection, names):
+    names = list(names)
+    if not names:
+        return {}
+    rows = connection.execute(
+        f"SELECT {', '.join(CHARACTER_COLUMNS)}, {', '.join(PROGRESSION_COLUMNS)}, updated FROM characters "
+        f"WHERE name IN ({', '.join('?' for _ in names)})",
+        names,
+    )
+    found = {}
+    for row in rows:
+        character = row_character(row)
+        character["Уровень"], character["Хиты"] = row[len(CHARACTER_COLUMNS):len(CHARACTER_COLUMNS) + 2]
+        found[row[0]] = (row[-1], character)
+    return found
+
+
+# Страница списка: (имя, раса, класс, время изменения), отсортированная по name, race или class
+def fetch_page(connection, offset, limit, order="name", descending=False):
+    if order not in ("name", "race", "class"):
+        raise ValueError(f"Неизвестная сортировка: {order}")
+    direction = "DESC" if descending else "ASC"
+    order_by = f"{order} {direction}" if order == "name" else f"{order} {direction}, name {direction}"
+    return connection.execute(
+        f"SELECT name, race, class, updated FROM characters ORDER BY {order_by} LIMIT ? OFFSET ?",
+        (limit, offset),
+    ).fetchall()
+
+
+# Хранилище персонажей в одной базе SQLite
+class CharacterStore:
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        # Счётчик изменений и подписчики на них (список персонажей, индексы)
+        self.version = 0
+        self.listeners = []
+        self.notifying = 0
+        self.sheet_index = None
+
+    def create_tables(self):
+        stat_columns = "".join(f"{STAT_COLUMNS[stat]} INTEGER NOT NULL, " for stat in STATS)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS characters ("
+                "id INTEGER PRIMARY KEY, "
+                "name TEXT NOT NULL UNIQUE, "
+                "race TEXT NOT NULL, "
+                "class TEXT NOT NULL, "
+                "description TEXT NOT NULL, "
+                "equipment TEXT NOT NULL, "
+                "race_features TEXT NOT NULL, "
+                f"{stat_columns}"
+                "updated REAL NOT NULL)"
+            )
+            # Раса и класс индексируются вместе с именем, чтобы сортировка списка шла по индексу
+            for column in ["race", "class"]:
+                self.connection.execute(f"DROP INDEX IF EXISTS characters_{column}")
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS characters_{column}_name ON characters({column}, name)"
+                )
+            for column in [STAT_COLUMNS[stat] for stat in STATS]:
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS characters_{column} ON characters({column})"
+                )
+            # Базы, созданные до появления уровней, дополняются недостающими колонками
+            existing = {row[1] for row in self.connection.execute("PRAGMA table_info(characters)")}
+            for column, definition in PROGRESSION_COLUMNS.items():
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE characters ADD COLUMN {column} {definition}")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            # Индекс листов из папки characters: файл, время изменения, размер и имя персонажа
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sheet_files ("
+                "file_name TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, name TEXT)"
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def character_row(self, character):
+        row = [
+            character["Имя"],
+            character["Раса"],
+            character["Класс"],
+            character["Описание"],
+            json.dumps(character["Снаряжение"], ensure_ascii=False),
+            character["Особенности расы"],
+        ]
+        row.extend(int(character[stat]) for stat in STATS)
+        row.append(time.time())
+        return row
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    # Счётчик растёт, когда все подписчики уже обновились: кэш, ключом которого служит версия,
+    # не сохранит под новой версией ответ по ещё не обновлённому индексу
+    def notify(self, saved, deleted):
+        self.notifying += 1
+        try:
+            for callback in list(self.listeners):
+                callback(saved, deleted)
+        finally:
+            self.notifying -= 1
+            self.version += 1
+
+    # Версия, которая будет после текущего оповещения: её запоминает подписчик, который уже учёл изменение
+    def settled_version(self):
+        return self.version + 1 if self.notifying else self.version
+
+    def save(self, character):
+        self.save_many([character])
+
+    # meta — служебные значения, которые записываются в той же транзакции (например, позиция импорта)
+    @metrics.timed("storage", operation="save_many")
+    def save_many(self, characters, meta=None):
+        self.write(characters, [], meta)
+
+    # Сохранения и удаления одной транзакцией: после сбоя в базе либо все изменения, либо ни одного
+    def write(self, characters, deleted, meta=None):
+        characters = list(characters)
+        with self.connection:
+            self.insert_characters(characters)
+            self.connection.executemany("DELETE FROM characters WHERE name = ?", ((name,) for name in deleted))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                ((key, str(value)) for key, value in (meta or {}).items()),
+            )
+        self.notify([character["Имя"] for character in characters], list(deleted))
+
+    def insert_characters(self, characters):
+        columns = CHARACTER_COLUMNS + ["updated"]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        query = (
+            f"INSERT INTO characters ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(name) DO UPDATE SET {updates}"
+        )
+        self.connection.executemany(query, (self.character_row(c) for c in characters))
+
+    @metrics.timed("storage", operation="delete")
+    def delete(self, name):
+        self.write([], [name])
+
+    @metrics.timed("storage", operation="get")
+    def get(self, name):
+        row = self.connection.execute(
+            f"SELECT {', '.join(CHARACTER_COLUMNS)} FROM characters WHERE name = ?", (name,)
+        ).fetchone()
+        return row_character(row) if row else None
+
+    def names(self):
+        return [row[0] for row in self.connection.execute("SELECT name FROM characters ORDER BY name")]
+
+    # Страница списка: (имя, раса, класс, время изменения), отсортированная по name, race или class
+    @metrics.timed("storage", operation="page")
+    def page(self, offset, limit, order="name", descending=False):
+        return fetch_page(self.connection, offset, limit, order, descending)
+
+    # Все персонажи по порядку добавления, пачками через отдельный курсор: память не зависит от размера базы
+    def iter_characters(self, batch_size=1000):
+        cursor = self.connection.execute(f"SELECT {', '.join(CHARACTER_COLUMNS)} FROM characters ORDER BY id")
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row_character(row)
+        finally:
+            cursor.close()
+
+    # Данные для расчёта уровней: (имя, класс, уровень, хиты, характеристики по порядку STATS);
+    # names=None — весь список по порядку добавления
+    def progression_rows(self, names=None):
+        columns = ["name", "class", "level", "hit_points"] + [STAT_COLUMNS[stat] for stat in STATS]
+        query = f"SELECT {', '.join(columns)} FROM characters"
+        if names is None:
+            return self.connection.execute(query + " ORDER BY id").fetchall()
+        names = list(names)
+        if not names:
+            return []
+        return self.connection.execute(
+            query + f" WHERE name IN ({', '.join('?' for _ in names)})", names
+        ).fetchall()
+
+    # Новые уровни, хиты и характеристики одной транзакцией: строки (имя, уровень, хиты, характеристики).
+    # stats None — характеристики не менялись; такие строки не трогают индексы по характеристикам
+    @metrics.timed("storage", operation="write_progression")
+    def write_progression(self, rows):
+        rows = list(rows)
+        assignments = ", ".join(f"{STAT_COLUMNS[stat]} = ?" for stat in STATS)
+        updated = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE characters SET level = ?, hit_points = ?, updated = ? WHERE name = ?",
+                ((level, hit_points, updated, name) for name, level, hit_points, stats in rows if stats is None),
+            )
+            self.connection.executemany(
+                f"UPDATE characters SET level = ?, hit_points = ?, {assignments}, updated = ? WHERE name = ?",
+                ((level, hit_points, *stats, updated, name) for name, level, hit_points, stats in rows
+                 if stats is not None),
+            )
+        # Подписчики перечитывают изменённых персонажей запросом с IN, поэтому имена идут пачками
+        for start in range(0, len(rows), NOTIFY_BATCH):
+            self.notify([row[0] for row in rows[start:start + NOTIFY_BATCH]], [])
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM characters").fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+            )
+
+    # Сверка папки листов с индексом: разбираются только новые и изменённые файлы.
+    # Персонажи удалённых файлов остаются в базе, из индекса убирается только сам файл
+    @metrics.timed("storage", operation="sync_sheets")
+    def sync_sheets(self, folder):
+        if not os.path.isdir(folder):
+            return 0
+        if self.sheet_index is None:
+            self.sheet_index = {
+                row[0]: (row[1], row[2])
+                for row in self.connection.execute("SELECT file_name, mtime, size FROM sheet_files")
+            }
+
+        changed = []
+        present = set()
+        for entry in os.scandir(folder):
+            if not entry.name.endswith(".txt") or not entry.is_file():
+                continue
+            present.add(entry.name)
+            stat = entry.stat()
+            signature = (stat.st_mtime, stat.st_size)
+            if self.sheet_index.get(entry.name) != signature:
+                changed.append((entry.name, signature))
+        removed = [file_name for file_name in self.sheet_index if file_name not in present]
+        if not changed and not removed:
+            return 0
+
+        characters = []
+        file_rows = []
+        sheets = iter_sheet_files(os.path.join(folder, file_name) for file_name, _ in changed)
+        for (file_name, (mtime, size)), (_, sheet, error) in zip(changed, sheets):
+            name = None
+            if sheet is not None:
+                characters.append(sheet.to_character())
+                name = sheet.name
+            else:
+                print(f"Не удалось прочитать {file_name}: {error}")
+            file_rows.append((file_name, mtime, size, name))
+
+        with self.connection:
+            self.insert_characters(characters)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO sheet_files (file_name, mtime, size, name) VALUES (?, ?, ?, ?)",
+                file_rows,
+            )
+            self.connection.executemany(
+                "DELETE FROM sheet_files WHERE file_name = ?", ((file_name,) for file_name in removed)
+            )
+        for file_name, signature in changed:
+            self.sheet_index[file_name] = signature
+        for file_name in removed:
+            del self.sheet_index[file_name]
+        names = [character["Имя"] for character in characters]
+        for start in range(0, len(names), NOTIFY_BATCH):
+            self.notify(names[start:start + NOTIFY_BATCH], [])
+        return len(changed) + len(removed)
+
+
+# Сверка папки листов в фоновом потоке со своим соединением: первый импорт может занять
+# десятки тысяч листов. Запросы, пришедшие во время сверки, сливаются в одну следующую.
+# on_synced(имена) вызывается в потоке сверки пачками не больше NOTIFY_BATCH имён
+class SheetSyncer:
+    STOP = object()
+
+    def __init__(self, path, folder, on_synced=None):
+        self.path = path
+        self.folder = folder
+        self.on_synced = on_synced
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.sync_loop, daemon=True)
+        self.thread.start()
+
+    def request(self):
+        self.requests.put(True)
+
+    # Недоделанная сверка дорабатывается, ожидающие отбрасываются: при следующем запуске
+    # папка сверится заново
+    def close(self):
+        if self.thread.is_alive():
+            self.requests.put(self.STOP)
+            self.thread.join()
+
+    def next_request(self):
+        stopping = self.requests.get() is self.STOP
+        while not stopping:
+            try:
+                stopping = self.requests.get_nowait() is self.STOP
+            except queue.Empty:
+                break
+        return stopping
+
+    def on_roster_changed(self, saved, deleted):
+        if self.on_synced and saved:
+            self.on_synced(saved)
+
+    def sync_loop(self):
+        store = CharacterStore(self.path)
+        store.add_listener(self.on_roster_changed)
+        try:
+            while not self.next_request():
+                try:
+                    store.sync_sheets(self.folder)
+                except (sqlite3.Error, OSError) as error:
+                    print(f"Не удалось сверить папку листов: {error}")
+        finally:
+            store.close()
+
+
+# Слежение за записями других процессов: поток со своим хранилищем раз в interval секунд
+# сверяет PRAGMA data_version и, если база изменилась, находит изменённых и удалённых персонажей
+# по времени изменения и оповещает подписчиков своего хранилища. on_started(хранилище) вызывается
+# в потоке слежения, когда исходное состояние уже запомнено, — там подключаются индексы
+class ChangeWatcher:
+    def __init__(self, path, on_started=None, interval=0.5):
+        self.path = path
+        self.on_started = on_started
+        self.interval = interval
+        self.store = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.watch_loop, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def snapshot(self, store):
+        return dict(store.connection.execute("SELECT name, updated FROM characters"))
+
+    def watch_loop(self):
+        store = CharacterStore(self.path)
+        try:
+            data_version = store.connection.execute("PRAGMA data_version").fetchone()[0]
+            known = self.snapshot(store)
+            self.store = store
+            if self.on_started:
+                self.on_started(store)
+            while not self.stopping.wait(self.interval):
+                current = store.connection.execute("PRAGMA data_version").fetchone()[0]
+                if current == data_version:
+                    continue
+                data_version = current
+                present = self.snapshot(store)
+                saved = [name for name, updated in present.items() if known.get(name) != updated]
+                deleted = [name for name in known if name not in present]
+                known = present
+                for start in range(0, max(len(saved), len(deleted)), NOTIFY_BATCH):
+                    store.notify(saved[start:start + NOTIFY_BATCH], deleted[start:start + NOTIFY_BATCH])
+        finally:
+            store.close()
+
+
+# Итог записи пачки: номера заявок, сохранённые и удалённые имена или текст ошибки
+class WriteBatch:
+    def __init__(self, tickets, saved, deleted, error=None):
+        self.tickets = tickets
+        self.saved = saved
+        self.deleted = deleted
+        self.error = error
+
+
+# Запись персонажей в фоновом потоке со своим соединением. Заявки, пришедшие почти одновременно,
+# сливаются: по каждому имени остаётся последнее действие, и вся пачка пишется одной транзакцией
+# с synchronous=FULL, то есть с одним fsync на пачку. on_written вызывается в потоке записи
+class CharacterWriter:
+    COALESCE_DELAY = 0.05
+    MAX_BATCH = 1000
+    STOP = object()
+
+    def __init__(self, path, on_written=None):
+        self.path = path
+        self.on_written = on_written
+        self.requests = queue.Queue()
+        self.tickets = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, action, value):
+        with self.lock:
+            self.tickets += 1
+            ticket = self.tickets
+        self.requests.put((ticket, action, value))
+        return ticket
+
+    def save(self, character):
+        return self.submit("save", character)
+
+    def delete(self, name):
+        return self.submit("delete", name)
+
+    # Дописывает всё, что уже в очереди, и останавливает поток
+    def close(self):
+        if self.thread.is_alive():
+            self.requests.put(self.STOP)
+            self.thread.join()
+
+    def next_batch(self):
+        request = self.requests.get()
+        if request is self.STOP:
+            return [], True
+        batch = [request]
+        deadline = time.monotonic() + self.COALESCE_DELAY
+        while len(batch) < self.MAX_BATCH:
+            try:
+                request = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is self.STOP:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def write_loop(self):
+        store = CharacterStore(self.path)
+        store.connection.execute("PRAGMA synchronous=FULL")
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self.next_batch()
+                if batch:
+                    self.write_batch(store, batch)
+        finally:
+            store.close()
+
+    # Любая ошибка пачки, не только ошибка базы, возвращается заявкам: поток записи продолжает работу,
+    # а интерфейс, ждущий ответа, получает его
+    def write_batch(self, store, batch):
+        tickets = [ticket for ticket, _, _ in batch]
+        try:
+            latest = {}
+            for ticket, action, value in batch:
+                name = value["Имя"] if action == "save" else value
+                latest.pop(name, None)
+                latest[name] = (action, value)
+            characters = [value for action, value in latest.values() if action == "save"]
+            deleted = [name for name, (action, _) in latest.items() if action == "delete"]
+            with metrics.timed("character_writer_batch"):
+                store.write(characters, deleted)
+            result = WriteBatch(tickets, [character["Имя"] for character in characters], deleted)
+        except Exception as error:
+            result = WriteBatch(tickets, [], [], str(error) or type(error).__name__)
+        if self.on_written:
+            self.on_written(result)
+
+
+# Ограниченный LRU-кэш разобранных листов с ключом (имя, время изменения).
+# Соседние строки списка подгружаются заранее в фоновом потоке со своим соединением
+class SheetCache:
+    def __init__(self, path, capacity=256):
+        self.path = path
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.requests = queue.Queue()
+        self.thread = None
+
+    def get(self, store, name, updated):
+        key = (name, updated)
+        with self.lock:
+            character = self.entries.get(key)
+            if character is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return character
+            self.misses += 1
+        found = fetch_characters(store.connection, [name])
+        if name not in found:
+            return None
+        updated, character = found[name]
+        self.put((name, updated), character)
+        return character
+
+    def put(self, key, character):
+        with self.lock:
+            self.entries[key] = character
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def prefetch(self, keys):
+        with self.lock:
+            missing = [name for name, updated in keys if (name, updated) not in self.entries]
+        if not missing:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.prefetch_loop, daemon=True)
+            self.thread.start()
+        self.requests.put(missing)
+
+    def prefetch_loop(self):
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        while True:
+            names = self.requests.get()
+            # Если пользователь листает быстро, важна только последняя просьба
+            while not self.requests.empty():
+                names = self.requests.get()
+            try:
+                found = fetch_characters(connection, names)
+            except sqlite3.Error as error:
+                print(f"Не удалось подгрузить персонажей: {error}")
+                continue
+            for name, (updated, character) in found.items():
+                self.put((name, updated), character)
+                self.prefetched += 1
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "prefetched": self.prefetched, "size": len(self.entries)}
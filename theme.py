@@ -0,0 +1,95 @@
+import functools
+import os
+from string import Template
+
+from PyQt5.QtWidgets import QApplication
+
+# Оформление всего приложения одной таблицей стилей. Виджеты не задают стили сами, а получают
+# роль (динамическое свойство role) или имя объекта, и правила ниже выбирают их по этим селекторам.
+# Таблица собирается из темы один раз и ставится на QApplication, поэтому Qt разбирает её
+# однажды, а не при создании каждой страницы
+DEFAULT_THEME = "Светлая"
+THEMES = {
+    "Светлая": {
+        "font_size": "16px",
+        "panel": "white",
+        "panel_text": "black",
+        "caption": "white",
+        "caption_text": "black",
+    },
+    "Тёмная": {
+        "font_size": "16px",
+        "panel": "#2b2724",
+        "panel_text": "#eee4d3",
+        "caption": "#2b2724",
+        "caption_text": "#eee4d3",
+    },
+    "Пергамент": {
+        "font_size": "17px",
+        "panel": "#f3e7c9",
+        "panel_text": "#3b2a17",
+        "caption": "#e8d5a9",
+        "caption_text": "#3b2a17",
+    },
+}
+
+# Роли виджетов:
+# page — страница мастера: крупный шрифт у неё и у всего внутри;
+# panel — светлая подложка под текстом поверх фона, тоже вместе со всем содержимым;
+# caption — отдельная подпись на подложке.
+# Ролей у виджета может быть несколько через пробел, селектор ~= выбирает по одной из них
+RULES = (
+    ('QWidget[role~="page"], QWidget[role~="page"] QWidget', "font-size: $font_size;"),
+    ('QWidget[role~="panel"], QWidget[role~="panel"] QWidget', "background-color: $panel; color: $panel_text;"),
+    ('QLabel[role~="caption"]', "background-color: $caption; color: $caption_text; font-size: $font_size;"),
+    ("QTextEdit#characterInfo", "font-size: $font_size;"),
+)
+
+
+# Роль задаётся до создания дочерних виджетов: Qt запоминает подходящие правила при первом обращении к стилю
+def set_role(widget, role):
+    widget.setProperty("role", role)
+    return widget
+
+
+# Объявления каждого правила с подставленными значениями темы
+def theme_rules(name):
+    values = THEMES[name]
+    return [(selector, Template(declarations).substitute(values)) for selector, declarations in RULES]
+
+
+@functools.lru_cache(maxsize=None)
+def compile_stylesheet(name):
+    return "\n".join(f"{selector} {{ {declarations} }}" for selector, declarations in theme_rules(name))
+
+
+def theme_names():
+    return list(THEMES)
+
+
+def next_theme(name):
+    names = theme_names()
+    return names[(names.index(name) + 1) % len(names)] if name in names else DEFAULT_THEME
+
+
+# Тема при запуске: DND_THEME, если такая есть, иначе светлая
+def initial_theme():
+    name = os.environ.get("DND_THEME", DEFAULT_THEME)
+    return name if name in THEMES else DEFAULT_THEME
+
+
+# Смена темы на лету: новая таблица ставится целиком, Qt сам перерисовывает открытые окна
+def apply_theme(name, app=None):
+    if name not in THEMES:
+        raise ValueError(f"Неизвестная тема: {name}. Есть: {', '.join(THEMES)}")
+    app = app or QApplication.instance()
+    stylesheet = compile_stylesheet(name)
+    if app.styleSheet() != stylesheet:
+        app.setStyleSheet(stylesheet)
+    app.setProperty("theme", name)
+    return name
+
+
+def current_theme(app=None):
+    app = app or QApplication.instance()
+    return app.property("theme") or DEFAULT_THEME
@@ -0,0 +1,317 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from core import check_character
+from rules import EQUIPMENT_CATEGORIES, get_catalog
+from storage import CharacterStore, STATS
+
+FORMATS = ("jsonl", "csv")
+BATCH_SIZE = 5000
+EXPORT_PROGRESS_INTERVAL = 100000
+MAX_REPORTED_ERRORS = 20
+EQUIPMENT_COLUMNS = {category: f"Снаряжение: {category}" for category in EQUIPMENT_CATEGORIES}
+CSV_COLUMNS = ["Имя", "Раса", "Класс", "Описание", "Особенности расы"] + STATS + list(EQUIPMENT_COLUMNS.values())
+BOM = "\ufeff"
+
+
+def detect_format(path, requested=None):
+    if requested:
+        return requested
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    if extension == "csv":
+        return "csv"
+    raise ValueError(f"Не удалось определить формат {path}, укажите --format")
+
+
+# Экспорт: персонажи идут из базы пачками и сразу пишутся строками файла
+
+def jsonl_lines(characters):
+    for character in characters:
+        yield json.dumps(character, ensure_ascii=False) + "\n"
+
+
+def csv_row(character):
+    equipment = character.get("Снаряжение") or {}
+    row = [character[key] for key in ("Имя", "Раса", "Класс", "Описание", "Особенности расы")]
+    row.extend(character[stat] for stat in STATS)
+    row.extend(equipment.get(category) or "" for category in EQUIPMENT_CATEGORIES)
+    return row
+
+
+def csv_lines(characters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM нужен, чтобы Excel узнал UTF-8 и показал кириллицу
+    writer.writerow(CSV_COLUMNS)
+    yield BOM + buffer.getvalue()
+    for character in characters:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(csv_row(character))
+        yield buffer.getvalue()
+
+
+# Файл пишется рядом под временным именем и подменяет старый только целиком
+def export_characters(store, path, file_format, progress=None):
+    lines = {"jsonl": jsonl_lines, "csv": csv_lines}[file_format]
+    count = 0
+
+    def characters():
+        nonlocal count
+        for character in store.iter_characters():
+            count += 1
+            if progress:
+                progress(count)
+            yield character
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8", newline="") as file:
+        file.writelines(lines(characters()))
+    os.replace(temporary_path, path)
+    return count
+
+
+def print_export_progress(total, started):
+    def report(count):
+        if count % EXPORT_PROGRESS_INTERVAL == 0 or count == total:
+            elapsed = time.perf_counter() - started
+            percent = count / total * 100 if total else 100
+            print(f"  {count:>10,} из {total:,} ({percent:5.1f}%), {count / max(elapsed, 1e-9):10,.0f} в секунду")
+    return report
+
+
+# Импорт: строки читаются из файла по одной, позиция в байтах запоминается вместе с каждой пачкой
+
+# Строки файла с текущим смещением в байтах и номером строки; позицию можно сдвинуть для продолжения
+class LineSource:
+    def __init__(self, file):
+        self.file = file
+        self.offset = 0
+        self.line = 0
+
+    def seek(self, offset, line):
+        self.file.seek(offset)
+        self.offset = offset
+        self.line = line
+
+    def __iter__(self):
+        for raw in self.file:
+            at_start = self.offset == 0
+            self.offset += len(raw)
+            self.line += 1
+            text = raw.decode("utf-8")
+            yield text[1:] if at_start and text.startswith(BOM) else text
+
+
+# Записи файла: (номер строки, персонаж или None, ошибки)
+def jsonl_records(source):
+    for text in source:
+        if not text.strip():
+            continue
+        try:
+            character = json.loads(text)
+        except json.JSONDecodeError as error:
+            yield source.line, None, [f"не JSON: {error}"]
+            continue
+        if not isinstance(character, dict):
+            yield source.line, None, ["ожидается объект JSON"]
+            continue
+        yield source.line, character, []
+
+
+# Числа приходят строками; нечисловые значения остаются как есть и отклоняются проверкой
+def csv_character(row):
+    character = {key: row.get(key, "") for key in ("Имя", "Раса", "Класс", "Описание", "Особенности расы")}
+    for stat in STATS:
+        try:
+            character[stat] = int(row.get(stat, ""))
+        except ValueError:
+            character[stat] = row.get(stat)
+    character["Снаряжение"] = {
+        category: row.get(column) or None for category, column in EQUIPMENT_COLUMNS.items()
+    }
+    return character
+
+
+def csv_records(source, header):
+    for values in csv.reader(source):
+        if not values:
+            continue
+        if len(values) != len(header):
+            yield source.line, None, [f"ожидается {len(header)} столбцов, получено {len(values)}"]
+            continue
+        yield source.line, csv_character(dict(zip(header, values))), []
+
+
+def complete_character(character, catalog):
+    # Особенности расы можно не указывать: они берутся из справочника
+    if not character.get("Особенности расы") and character.get("Раса") in catalog.races:
+        character["Особенности расы"] = catalog.races[character["Раса"]].features
+    character.setdefault("Описание", "")
+    character.setdefault("Снаряжение", {})
+    return character
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def progress_key(path):
+    return f"import:{os.path.abspath(path)}"
+
+
+# Позиция прошлого импорта того же файла, если файл с тех пор не менялся
+def saved_progress(store, path):
+    value = store.get_meta(progress_key(path))
+    if value is None:
+        return None
+    progress = json.loads(value)
+    return progress if progress.get("signature") == file_signature(path) else None
+
+
+class ImportResult:
+    def __init__(self, progress=None):
+        progress = progress or {}
+        self.offset = progress.get("offset", 0)
+        self.line = progress.get("line", 0)
+        self.imported = progress.get("imported", 0)
+        self.rejected = progress.get("rejected", 0)
+        # С какой строки начат этот запуск, для скорости
+        self.first_line = self.line
+        self.errors = []
+
+    def reject(self, line, errors):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, errors))
+
+    def state(self, signature, done=False):
+        return json.dumps({
+            "signature": signature,
+            "offset": self.offset,
+            "line": self.line,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "done": done,
+        })
+
+
+# Импорт с проверкой по справочнику правил. Каждая пачка сохраняется одной транзакцией вместе
+# с позицией в файле, поэтому после обрыва импорт продолжается с первой несохранённой строки
+def import_characters(store, path, file_format, batch_size=BATCH_SIZE, restart=False, on_batch=None):
+    catalog = get_catalog()
+    signature = file_signature(path)
+    key = progress_key(path)
+    result = ImportResult(None if restart else saved_progress(store, path))
+
+    with open(path, "rb") as file:
+        source = LineSource(file)
+        if file_format == "csv":
+            header = next(csv.reader(source), None)
+            if header is None or not {"Имя", "Раса", "Класс"} <= set(header):
+                raise ValueError(f"В {path} нет заголовка с колонками Имя, Раса, Класс")
+            if result.offset > source.offset:
+                source.seek(result.offset, result.line)
+            records = csv_records(source, header)
+        else:
+            source.seek(result.offset, result.line)
+            records = jsonl_records(source)
+
+        batch = []
+        for line, character, errors in records:
+            if character is not None and not errors:
+                errors = check_character(complete_character(character, catalog), catalog)
+            if errors:
+                result.reject(line, errors)
+            else:
+                batch.append(character)
+            if len(batch) >= batch_size:
+                result.offset, result.line = source.offset, source.line
+                result.imported += len(batch)
+                store.save_many(batch, {key: result.state(signature)})
+                batch = []
+                if on_batch:
+                    on_batch(result, signature[0])
+        result.offset, result.line = source.offset, source.line
+        result.imported += len(batch)
+        store.save_many(batch, {key: result.state(signature, done=True)})
+        if on_batch:
+            on_batch(result, signature[0])
+    return result
+
+
+def print_import_progress(started):
+    def report(result, size):
+        elapsed = time.perf_counter() - started
+        percent = result.offset / size * 100 if size else 100
+        print(
+            f"  {result.line:>10,} строк ({percent:5.1f}%), сохранено {result.imported:,}, "
+            f"отклонено {result.rejected:,}, {(result.line - result.first_line) / max(elapsed, 1e-9):10,.0f} строк в секунду"
+        )
+    return report
+
+
+def export_main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py export", description="Выгрузка всех персонажей в JSONL или CSV")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--database", default="characters.db")
+    args = parser.parse_args(argv)
+
+    store = CharacterStore(args.database)
+    started = time.perf_counter()
+    try:
+        progress = print_export_progress(store.count(), started)
+        count = export_characters(store, args.path, detect_format(args.path, args.format), progress)
+    finally:
+        store.close()
+    print(f"Выгружено {count:,} персонажей в {args.path} за {time.perf_counter() - started:.1f} с")
+    return 0
+
+
+def import_main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py import", description="Загрузка персонажей из JSONL или CSV")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--database", default="characters.db")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="начать заново, даже если импорт уже начинался")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.path):
+        print(f"Файл {args.path} не найден", file=sys.stderr)
+        return 2
+    store = CharacterStore(args.database)
+    started = time.perf_counter()
+    if not args.restart:
+        progress = saved_progress(store, args.path)
+        if progress and progress["done"]:
+            print(f"{args.path} уже загружен, для повторной загрузки укажите --restart")
+            store.close()
+            return 0
+        if progress:
+            print(f"Импорт продолжается со строки {progress['line'] + 1:,}")
+    try:
+        result = import_characters(
+            store, args.path, detect_format(args.path, args.format), args.batch_size, args.restart,
+            print_import_progress(started),
+        )
+    finally:
+        store.close()
+    for line, errors in result.errors:
+        print(f"Строка {line}: {'; '.join(errors)}", file=sys.stderr)
+    if result.rejected > len(result.errors):
+        print(f"… и ещё {result.rejected - len(result.errors):,} отклонённых строк", file=sys.stderr)
+    print(
+        f"Сохранено {result.imported:,}, отклонено {result.rejected:,} "
+        f"за {time.perf_counter() - started:.1f} с"
+    )
+    return 1 if result.rejected else 0